@@ -0,0 +1,307 @@
+import asyncio
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from dispatcher import (TICK_SECONDS, claim_next_batches, load_next_due_time, load_next_lease_expiry,
+                        record_batch, renew_leases)
+from rate_limit import RateLimiter
+from retry import DEFAULT_RETRY_POLICY, RetryPolicy
+from storage import Storage
+from transport import OutgoingMessage, SendResult, Transport, deliver_batch_async
+from workers import SendPool
+
+
+class AsyncDispatcher:
+    """Sends messages as they come due, from an asyncio event loop on its own thread.
+
+    Due times are loop.call_at timers that wake the loop: the next one in
+    the database (re-armed after every pass) and those passed to notify().  All
+    database work runs on one dedicated executor thread, so the loop never
+    blocks on SQLite, and claimed recipient batches are sent as concurrent
+    tasks, at most concurrency at a time.  An is_async transport is awaited
+    on the loop (default concurrency: its max_async_concurrency); any other
+    is sent through pool, the SendPool that Send Now shares, so a
+    single-desktop transport keeps one lane (default concurrency: its
+    workers).
+    Batches for one recipient are sent in order, and results that finish
+    together are recorded in one transaction.
+
+    start(), stop() and notify() may be called from any thread.
+    """
+
+    # Re-check the wall clock at least this often (seconds) so a suspended
+    # machine or a clock change cannot leave a due message waiting.
+    MAX_WAIT = 60.0
+
+    def __init__(self, storage: Storage, transport: Transport, owner: str,
+                 pool: Optional[SendPool] = None, concurrency: Optional[int] = None, lease_seconds: float = 900,
+                 claim_limit: int = 100, limiter: Optional[RateLimiter] = None,
+                 retry: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 has_external_changes: Optional[Callable[[], bool]] = None,
+                 poll_interval: float = 1.0,
+                 on_results: Optional[Callable[[List[SendResult]], None]] = None):
+        self.storage = storage
+        self.transport = transport
+        self.owner = owner
+        self.pool = pool if pool or transport.is_async else SendPool(transport)
+        if concurrency is None:
+            concurrency = transport.max_async_concurrency if transport.is_async else self.pool.workers
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.claim_limit = claim_limit
+        self.limiter = limiter
+        self.retry = retry
+        # Cheap check (e.g. PRAGMA data_version) for rows written by other
+        # processes; when it fires the timers are re-seeded from the database.
+        self._has_external_changes = has_external_changes
+        self._poll_interval = poll_interval
+        # Called on the loop thread with every recorded group of results.
+        self.on_results = on_results
+
+        # One thread keeps one SQLite connection (and one data_version baseline).
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispatch-db")
+        self._lock = threading.Lock()
+        self._running = False
+        self._reseed_requested = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_active = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """Start dispatching; the timers are seeded from the database on the loop"""
+        with self._lock:
+            self._running = True
+            self._reseed_requested = True
+            if self._loop_active:
+                # The loop is starting, or still finishing in-flight sends
+                # after a stop(); it reseeds and carries on instead.
+                self._call_soon(self._wake)
+                return
+            self._loop_active = True
+        threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True).start()
+
+    def stop(self):
+        """Stop dispatching; messages already claimed are sent and recorded first"""
+        with self._lock:
+            self._running = False
+            self._call_soon(self._wake)
+
+    def notify(self, due_time: float):
+        """Register a new due time (epoch seconds) and wake the dispatcher at it"""
+        with self._lock:
+            # Before the loop exists nothing is lost: it seeds from the database.
+            self._call_soon(self._add_timer, due_time)
+
+    def _call_soon(self, callback: Callable, *args):
+        if self._loop:
+            try:
+                self._loop.call_soon_threadsafe(callback, *args)
+            except RuntimeError:
+                pass  # the loop just closed
+
+    async def _db(self, func: Callable, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor,
+                                                                partial(func, *args, **kwargs))
+
+    # Everything below runs on the loop thread.
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._due_heap: List[float] = []
+        self._timers: Dict[float, Optional[asyncio.TimerHandle]] = {}
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # Last delivery task per phone number, so a recipient's batches stay in order.
+        self._tails: Dict[str, asyncio.Task] = {}
+        self._queued = 0
+        self._queue_changed = asyncio.Condition()
+        self._finished: List[SendResult] = []
+        self._results_ready = asyncio.Event()
+        self._draining = False
+        self._next_renewal = 0.0
+        with self._lock:
+            self._loop = loop
+
+        poller = loop.create_task(self._poll_external_changes()) if self._has_external_changes else None
+        try:
+            while True:
+                self._draining = False
+                recorder = loop.create_task(self._record_results())
+                await self._dispatch_until_stopped()
+
+                # Let claimed messages finish and be recorded before the loop goes away.
+                while self._tails:
+                    await asyncio.gather(*self._tails.values(), return_exceptions=True)
+                self._draining = True
+                self._results_ready.set()
+                await recorder
+                with self._lock:
+                    if not self._running:
+                        self._loop = None
+                        self._loop_active = False
+                        return
+        finally:
+            for handle in self._timers.values():
+                if handle:
+                    handle.cancel()
+            if poller:
+                poller.cancel()
+
+    async def _dispatch_until_stopped(self):
+        while True:
+            with self._lock:
+                reseed, self._reseed_requested = self._reseed_requested, False
+                if not self._running:
+                    return
+            try:
+                if reseed:
+                    await self._reseed()
+                if self._take_due():
+                    started = time.time()
+                    with TICK_SECONDS.time():
+                        await self._tick()
+                    await self._arm_next(started)
+                    continue
+            except Exception as e:
+                print(f"Dispatcher error: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.MAX_WAIT)
+            except asyncio.TimeoutError:
+                pass
+
+    def _wake(self):
+        self._wakeup.set()
+
+    def _add_timer(self, due_time: float):
+        if due_time in self._timers:
+            return
+        loop = asyncio.get_running_loop()
+        delay = due_time - time.time()
+        # Wall-clock due times map onto the loop's monotonic clock here;
+        # MAX_WAIT bounds the error if the wall clock jumps later.
+        self._timers[due_time] = loop.call_at(loop.time() + delay, self._wake) if delay > 0 else None
+        heapq.heappush(self._due_heap, due_time)
+        if delay <= 0:
+            self._wake()
+
+    def _take_due(self) -> bool:
+        """Drop the timers that are due; True if there were any"""
+        now = time.time()
+        due = False
+        while self._due_heap and self._due_heap[0] <= now:
+            handle = self._timers.pop(heapq.heappop(self._due_heap))
+            if handle:
+                handle.cancel()
+            due = True
+        return due
+
+    async def _reseed(self):
+        # Timers armed before may belong to rows changed elsewhere; drop
+        # them before loading, so a notify() that races with the load is
+        # kept.  Take the change baseline before loading too, so a commit
+        # that lands in between still triggers a later reseed.
+        for handle in self._timers.values():
+            if handle:
+                handle.cancel()
+        self._timers.clear()
+        self._due_heap.clear()
+        if self._has_external_changes:
+            await self._db(self._has_external_changes)
+        await self._arm_next()
+
+    async def _arm_next(self, after: float = 0):
+        """Arm timers for the next pending due time and lease expiry later than after.
+
+        Only the earliest of each is armed; after the pass it wakes, the
+        next one is loaded.  Rows still due after a pass (started at after)
+        are held back by the rate limiter, which notify()s their time.
+        """
+        for load in (load_next_due_time, load_next_lease_expiry):
+            due_time = await self._db(load, self.storage, after)
+            if due_time is not None:
+                self._add_timer(due_time)
+
+    async def _poll_external_changes(self):
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            try:
+                if await self._db(self._has_external_changes):
+                    with self._lock:
+                        self._reseed_requested = True
+                    self._wake()
+            except Exception as e:
+                print(f"Dispatcher error: {e}")
+
+    async def _tick(self):
+        """Claim every due message and start sending it"""
+        while self._running:
+            # Backpressure: keep no more claimed batches waiting than can be sent at once.
+            async with self._queue_changed:
+                await self._queue_changed.wait_for(lambda: self._queued < self.concurrency)
+            batches = await self._db(claim_next_batches, self.storage, self.owner, self.lease_seconds,
+                                     self.claim_limit, self.notify, self.limiter)
+            if batches is None:
+                return
+            for batch in batches:
+                self._start_delivery(batch)
+
+    def _start_delivery(self, batch: List[OutgoingMessage]):
+        phone_number = batch[0].phone_number
+        task = asyncio.get_running_loop().create_task(
+            self._deliver(batch, self._tails.get(phone_number)))
+        self._tails[phone_number] = task
+        self._queued += 1
+        task.add_done_callback(partial(self._delivered, phone_number))
+
+    def _delivered(self, phone_number: str, task: asyncio.Task):
+        if self._tails.get(phone_number) is task:
+            del self._tails[phone_number]
+
+    async def _deliver(self, batch: List[OutgoingMessage], previous: Optional[asyncio.Task]):
+        try:
+            if previous:
+                await asyncio.wait([previous])
+            print(f"Sending {len(batch)} message(s) to {batch[0].recipient_name}")
+            async with self._slots:
+                if self.transport.is_async:
+                    results = await deliver_batch_async(self.transport, batch)
+                else:
+                    results = await self.pool.deliver(batch[0].phone_number, batch)
+            self._finished.extend(results)
+            self._results_ready.set()
+        finally:
+            async with self._queue_changed:
+                self._queued -= 1
+                self._queue_changed.notify_all()
+
+    async def _record_results(self):
+        """Record finished sends, batching those that finish while a record is running"""
+        while True:
+            # Check the list rather than the event: results may have been
+            # added, and draining started, while the last record ran.
+            if not self._finished:
+                if self._draining:
+                    return
+                self._results_ready.clear()
+                await self._results_ready.wait()
+                continue
+            results, self._finished = self._finished, []
+            try:
+                await self._db(record_batch, self.storage, self.owner, results, self.retry, self.notify)
+                if time.monotonic() >= self._next_renewal:
+                    # Leases of claimed rows still waiting to be sent
+                    await self._db(renew_leases, self.storage, self.owner, self.lease_seconds)
+                    self._next_renewal = time.monotonic() + self.lease_seconds / 4
+                if self.on_results:
+                    self.on_results(results)
+            except Exception as e:
+                print(f"Error recording send results: {e}")
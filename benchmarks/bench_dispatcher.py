@@ -0,0 +1,112 @@
+"""Headless throughput benchmark for the asyncio dispatcher.
+
+Fills a fresh database with --messages due messages to distinct
+recipients and delivers them through the fake transport, whose latency
+stands in for a fast network API.  One synchronous pass over a pool of
+sender threads (deliver_due_messages with --workers threads) is compared
+with the AsyncDispatcher awaiting sends on its event loop, and the
+results are printed as JSON:
+
+    python benchmarks/bench_dispatcher.py --messages 5000 --latency 0.05 --json dispatcher.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_dispatcher import AsyncDispatcher  # noqa: E402
+from dispatcher import deliver_due_messages, new_owner_id  # noqa: E402
+from storage import Storage, now_ms  # noqa: E402
+from transport import FakeTransport  # noqa: E402
+from workers import SendPool  # noqa: E402
+
+
+def fill(db_path: str, messages: int) -> Storage:
+    storage = Storage(db_path)
+    storage.init_schema()
+    due = now_ms() - 1000
+    with storage.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO scheduled_messages
+                (recipient_name, phone_number, phone_e164, message, scheduled_time, status)
+            VALUES (?, ?, ?, ?, ?, 'pending')
+        ''', ((f"r{i}", f"+1555{i:07d}", f"+1555{i:07d}", f"Message {i}", due) for i in range(messages)))
+    return storage
+
+
+def sent_count(storage: Storage) -> int:
+    return storage.query_one("SELECT COUNT(*) FROM scheduled_messages WHERE status = 'sent'")[0]
+
+
+def result(name: str, messages: int, sent: int, seconds: float, concurrency: int) -> dict:
+    return {
+        'benchmark': name,
+        'concurrency': concurrency,
+        'messages': messages,
+        'sent': sent,
+        'seconds': seconds,
+        'messages_per_second': messages / seconds,
+    }
+
+
+def bench_thread_pool(db_path: str, messages: int, workers: int, latency: float) -> dict:
+    storage = fill(db_path, messages)
+    transport = FakeTransport(latency=latency)
+    pool = SendPool(transport, workers)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        deliver_due_messages(storage, transport, new_owner_id(), pool)
+        seconds = time.perf_counter() - start
+        pool.close()
+    sent = sent_count(storage)
+    storage.close()
+    return result('thread_pool', messages, sent, seconds, pool.workers)
+
+
+def bench_async(db_path: str, messages: int, latency: float, concurrency: int) -> dict:
+    storage = fill(db_path, messages)
+    dispatcher = AsyncDispatcher(storage, FakeTransport(latency=latency), new_owner_id(),
+                                 concurrency=concurrency)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        dispatcher.start()
+        while sent_count(storage) < messages:
+            time.sleep(0.01)
+        seconds = time.perf_counter() - start
+        dispatcher.stop()
+    sent = sent_count(storage)
+    storage.close()
+    return result('async_dispatcher', messages, sent, seconds, dispatcher.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per message")
+    parser.add_argument('--workers', type=int, default=4, help="sender threads of the thread pool")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="sends the async dispatcher awaits at once (default: the transport's)")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = [
+            bench_thread_pool(os.path.join(data_dir, 'threads.db'), args.messages, args.workers, args.latency),
+            bench_async(os.path.join(data_dir, 'async.db'), args.messages, args.latency, args.concurrency),
+        ]
+
+    output = json.dumps({'python': platform.python_version(), 'results': results}, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Micro-benchmark for nl_parser.parse_command.
+
+Parses every command in parser_corpus.txt (or --corpus) repeatedly and
+reports the best throughput over several repeats, as JSON so runs can be
+compared across commits:
+
+    python benchmarks/bench_parser.py --iterations 2000 --json parser.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nl_parser import parse_command  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.txt")
+
+
+def load_corpus(path: str):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def bench_parse(commands, iterations: int, repeats: int) -> dict:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for command in commands:
+                parse_command(command)
+        best = min(best, time.perf_counter() - start)
+
+    parsed = iterations * len(commands)
+    return {
+        'benchmark': 'parse_command',
+        'commands': len(commands),
+        'iterations': iterations,
+        'repeats': repeats,
+        'best_seconds': best,
+        'commands_per_second': parsed / best,
+        'usec_per_command': best / parsed * 1e6,
+        'unparsed': sum(not parse_command(c).is_complete for c in commands),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--json', help="also write the result to this file")
+    args = parser.parse_args()
+
+    result = bench_parse(load_corpus(args.corpus), args.iterations, args.repeats)
+    result['python'] = platform.python_version()
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
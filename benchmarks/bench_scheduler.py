@@ -0,0 +1,206 @@
+"""Synthetic-load benchmarks for the scheduler, storage and GUI refresh paths.
+
+Generates scheduler.db files with N rows in scheduled_messages and contacts
+(cached in --data-dir), times the key paths against each and writes the
+results as JSON so runs can be compared across commits:
+
+    python benchmarks/bench_scheduler.py --sizes 10000,100000 --json results.json
+
+Of the generated messages 1% are due, 9% are pending in the future and the
+rest are sent history.  The dispatch pass uses the in-process fake
+transport, so no desktop is needed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import WhatsAppScheduler  # noqa: E402
+from storage import Storage, now_ms  # noqa: E402
+from transport import FakeTransport  # noqa: E402
+
+try:
+    from whatsapp_scheduler_gui import MESSAGE_PAGE_SIZE, fetch_message_page  # noqa: E402
+except ImportError:  # tkinter is not installed
+    fetch_message_page = None
+
+DEFAULT_SIZES = "10000,100000,1000000"
+CHUNK_SIZE = 50000
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.txt")
+
+
+def _chunked(rows, size=CHUNK_SIZE):
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def contact_name(i: int) -> str:
+    return f"contact{i}"
+
+
+def generate_database(path: str, rows: int, seed: int = 0):
+    """Create a database with rows contacts and rows scheduled messages"""
+    rng = random.Random(seed)
+    now = now_ms()
+    minute = 60 * 1000
+
+    def contacts():
+        for i in range(rows):
+            yield contact_name(i), f"+91{9000000000 + i}", f"+91{9000000000 + i}"
+
+    def messages():
+        for i in range(rows):
+            contact = rng.randrange(rows)
+            bucket = i % 100
+            if bucket == 0:
+                status, scheduled, sent_at = 'pending', now - rng.randrange(1, 60) * minute, None
+            elif bucket < 10:
+                status, scheduled, sent_at = 'pending', now + rng.randrange(1, 60 * 24 * 30) * minute, None
+            else:
+                scheduled = now - rng.randrange(60, 60 * 24 * 365) * minute
+                status, sent_at = 'sent', scheduled + rng.randrange(1, 120) * 1000
+            yield (contact_name(contact), f"+91{9000000000 + contact}", f"+91{9000000000 + contact}",
+                   f"Synthetic reminder #{i}", scheduled, status, sent_at)
+
+    storage = Storage(path)
+    storage.init_schema()
+    for chunk in _chunked(contacts()):
+        with storage.transaction() as cursor:
+            cursor.executemany("INSERT INTO contacts (name, phone_number, phone_e164) VALUES (?, ?, ?)", chunk)
+    for chunk in _chunked(messages()):
+        with storage.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO scheduled_messages
+                (recipient_name, phone_number, phone_e164, message, scheduled_time, status, sent_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', chunk)
+    storage.close()
+
+
+def timed(name: str, size, func, operations: int = 1) -> dict:
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    print(f"  {name:<28} {seconds:9.4f}s  ({operations / seconds:,.0f} ops/s)", file=sys.stderr)
+    return {
+        'benchmark': name,
+        'size': size,
+        'operations': operations,
+        'seconds': seconds,
+        'ops_per_second': operations / seconds if seconds else None,
+    }
+
+
+def bench_size(db_path: str, size: int, lookups: int) -> list:
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        scheduler = WhatsAppScheduler(db_path, FakeTransport(), workers=4)
+
+        rng = random.Random(1)
+        names = [contact_name(rng.randrange(size)) for _ in range(lookups)]
+        results.append(timed('get_contact_number', size,
+                             lambda: [scheduler.get_contact_number(name) for name in names], lookups))
+        results[-1]['contact_cache'] = scheduler.contacts.stats()
+
+        results.append(timed('list_scheduled_messages', size, scheduler.list_scheduled_messages, size))
+
+        if fetch_message_page:
+            results.append(timed('gui_first_page', size,
+                                 lambda: fetch_message_page(scheduler.storage), MESSAGE_PAGE_SIZE))
+
+            def scroll(pages=10, **filters):
+                cursor = None
+                for _ in range(pages):
+                    _, cursor = fetch_message_page(scheduler.storage, after=cursor, **filters)
+
+            results.append(timed('gui_scroll_10_pages', size, scroll, 10 * MESSAGE_PAGE_SIZE))
+            results.append(timed('gui_scroll_pending_filter', size,
+                                 lambda: scroll(status='pending'), 10 * MESSAGE_PAGE_SIZE))
+
+        due = scheduler.storage.query_one(
+            "SELECT COUNT(*) FROM scheduled_messages WHERE status = 'pending' AND scheduled_time <= ?",
+            (now_ms(),))[0]
+        results.append(timed('check_and_send_messages', size, scheduler.check_and_send_messages, due))
+
+        scheduler.send_pool.close()
+        scheduler.storage.close()
+    return results
+
+
+def bench_parse(iterations: int) -> dict:
+    with open(CORPUS, encoding='utf-8') as f:
+        commands = [line.strip() for line in f if line.strip()]
+    scheduler = WhatsAppScheduler.__new__(WhatsAppScheduler)  # parsing needs no database
+
+    def run():
+        for _ in range(iterations):
+            for command in commands:
+                scheduler.parse_natural_language(command)
+
+    return timed('parse_natural_language', None, run, iterations * len(commands))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="comma-separated row counts")
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'bench_data'),
+                        help="where generated databases are cached")
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--parse-iterations', type=int, default=1000)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': [bench_parse(args.parse_iterations)],
+    }
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        source = os.path.join(args.data_dir, f"scheduler_{size}.db")
+        if not os.path.exists(source):
+            print(f"Generating {size:,} rows -> {source}", file=sys.stderr)
+            generate_database(source + ".tmp", size)
+            os.replace(source + ".tmp", source)
+
+        print(f"Size {size:,}", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp:
+            # Work on a copy: the dispatch pass marks the due rows as sent.
+            db_path = os.path.join(tmp, "scheduler.db")
+            shutil.copyfile(source, db_path)
+            report['results'].extend(bench_size(db_path, size, args.lookups))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
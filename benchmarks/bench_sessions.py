@@ -0,0 +1,84 @@
+"""Headless throughput benchmark for the browser session pool.
+
+Sends --messages messages to --recipients recipients through the
+'browser' transport with the fake driver, whose latencies stand in for
+a cold WhatsApp Web load, a chat switch and a send.  The real driver's
+chat switch is a page reload served from the browser cache, so set
+--switch-latency to that, not to an in-app navigation.  A tab per message
+(sessions recycled after every send, like the pywhatkit transport) is
+compared with warm pools of several sizes, and the results are printed
+as JSON:
+
+    python benchmarks/bench_sessions.py --messages 200 --open-latency 0.2 --json sessions.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transport import BrowserTransport, OutgoingMessage  # noqa: E402
+from workers import SendPool  # noqa: E402
+
+
+def bench_pool(name: str, messages, sessions: int, max_sends: int, latencies: dict) -> dict:
+    transport = BrowserTransport(driver='fake', sessions=sessions, max_sends=max_sends, **latencies)
+    pool = SendPool(transport, workers=sessions)
+    sent = []
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for message in messages:
+            pool.submit(message.phone_number, [message],
+                        lambda results: sent.extend(r for r in results if r.success))
+        pool.join()
+        seconds = time.perf_counter() - start
+        pool.close()
+        transport.close()
+
+    return {
+        'benchmark': name,
+        'sessions': sessions,
+        'max_sends': max_sends,
+        'messages': len(messages),
+        'sent': len(sent),
+        'seconds': seconds,
+        'messages_per_second': len(messages) / seconds,
+        'pool': transport.pool.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--recipients', type=int, default=20)
+    parser.add_argument('--open-latency', type=float, default=0.2, help="seconds per cold page load")
+    parser.add_argument('--switch-latency', type=float, default=0.02, help="seconds per chat switch")
+    parser.add_argument('--send-latency', type=float, default=0.005, help="seconds per message")
+    parser.add_argument('--max-sends', type=int, default=50)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    latencies = {'open_latency': args.open_latency, 'switch_latency': args.switch_latency,
+                 'send_latency': args.send_latency}
+    # Interleaved recipients, as a due backlog usually is.
+    messages = [OutgoingMessage(f"+1555000{i % args.recipients:04d}", f"Message {i}")
+                for i in range(args.messages)]
+
+    results = [bench_pool('tab_per_message', messages, 1, 1, latencies)]
+    for sessions in (1, 2, 4):
+        results.append(bench_pool(f'warm_pool_{sessions}', messages, sessions, args.max_sends, latencies))
+
+    output = json.dumps({'python': platform.python_version(), 'results': results}, indent=2)
+    print(output)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from storage import DataVersionWatcher, Storage
+
+
+@dataclass
+class ChangeSet:
+    """Rows changed after one revision of the change log, up to another"""
+    revision: int
+    # (id, recipient_name, message, scheduled_time, status)
+    messages: List[tuple] = field(default_factory=list)
+    deleted_messages: List[int] = field(default_factory=list)
+    # (id, name, phone_number)
+    contacts: List[tuple] = field(default_factory=list)
+    deleted_contacts: List[int] = field(default_factory=list)
+    # More changes than the reader asked for; it should reload everything.
+    truncated: bool = False
+
+    def __len__(self):
+        return (len(self.messages) + len(self.deleted_messages)
+                + len(self.contacts) + len(self.deleted_contacts))
+
+
+def current_revision(storage: Storage) -> int:
+    """Latest revision in the change log (0 for an empty log)"""
+    return storage.query_one("SELECT COALESCE(MAX(revision), 0) FROM change_log")[0]
+
+
+def fetch_changes(storage: Storage, since: int, limit: int = 1000) -> ChangeSet:
+    """Current state of every row changed after revision since.
+
+    Rows are read as they are now, so a row changed again after the
+    returned revision may already show its newer values; it is reported
+    once more on the next call.
+    """
+    revision = current_revision(storage)
+    if revision <= since:
+        return ChangeSet(since)
+
+    changed = storage.query_one(
+        "SELECT COUNT(*) FROM change_log WHERE revision > ? AND revision <= ?", (since, revision))[0]
+    if changed > limit:
+        return ChangeSet(revision, truncated=True)
+
+    changes = ChangeSet(revision)
+    for row_id, msg_id, recipient, message, scheduled_time, status in storage.query('''
+        SELECT c.row_id, m.id, m.recipient_name, m.message, m.scheduled_time, m.status
+        FROM change_log c LEFT JOIN scheduled_messages m ON m.id = c.row_id
+        WHERE c.revision > ? AND c.revision <= ? AND c.table_name = 'scheduled_messages'
+        ORDER BY c.revision
+    ''', (since, revision)):
+        if msg_id is None:
+            changes.deleted_messages.append(row_id)
+        else:
+            changes.messages.append((msg_id, recipient, message, scheduled_time, status))
+
+    for row_id, contact_id, name, phone_number in storage.query('''
+        SELECT c.row_id, k.id, k.name, k.phone_number
+        FROM change_log c LEFT JOIN contacts k ON k.id = c.row_id
+        WHERE c.revision > ? AND c.revision <= ? AND c.table_name = 'contacts'
+        ORDER BY c.revision
+    ''', (since, revision)):
+        if contact_id is None:
+            changes.deleted_contacts.append(row_id)
+        else:
+            changes.contacts.append((contact_id, name, phone_number))
+    return changes
+
+
+class ChangeFeed:
+    """Incremental reader of the change log.
+
+    poll() first checks PRAGMA data_version, so it costs one pragma while
+    nothing changes, and only reads the log after another connection or
+    process committed.  Writes made on the polling thread's own connection
+    are not seen; call poll() from one dedicated thread.
+    """
+
+    def __init__(self, storage: Storage, revision: Optional[int] = None, limit: int = 1000):
+        self.storage = storage
+        self.revision = current_revision(storage) if revision is None else revision
+        self.limit = limit
+        self._watcher = DataVersionWatcher(storage)
+        self._primed = False
+
+    def poll(self) -> Optional[ChangeSet]:
+        """Changes since the previous poll, or None if there are none"""
+        changed = self._watcher()
+        if self._primed and not changed:
+            return None
+        # The first call only primes the watcher, so read the log anyway.
+        self._primed = True
+
+        changes = fetch_changes(self.storage, self.revision, self.limit)
+        if changes.revision == self.revision:
+            return None
+        self.revision = changes.revision
+        return changes
@@ -0,0 +1,184 @@
+import json
+import os
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from storage import to_epoch_ms
+
+# The daemon (daemon.py) listens here, and the CLI and GUI become its
+# clients while it runs.  Set WHATSAPP_SCHEDULER_DAEMON to another
+# host:port, or to "off" to never connect.
+DEFAULT_DAEMON_ADDRESS = "127.0.0.1:8765"
+
+# Every request carries the token the daemon keeps in this file next to
+# its database, so only users who can read the database can use the API.
+TOKEN_FILE = "daemon.token"
+
+
+class DaemonError(Exception):
+    """The daemon answered with an error; status is the HTTP status code"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def daemon_address() -> Optional[str]:
+    """host:port from WHATSAPP_SCHEDULER_DAEMON, or None when it is 'off'"""
+    address = os.environ.get("WHATSAPP_SCHEDULER_DAEMON", DEFAULT_DAEMON_ADDRESS).strip()
+    return None if address in ('', 'off', 'none') else address
+
+
+def token_path(db_path: str = "scheduler.db") -> str:
+    """Where the daemon serving db_path keeps its API token"""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), TOKEN_FILE)
+
+
+def read_token(path: str) -> Optional[str]:
+    """The token stored at path, or None if there is none"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def split_address(address: str) -> Tuple[str, int]:
+    """('host', port) of 'host:port' (or just ':port' for localhost)"""
+    host, _, port = address.rpartition(':')
+    return host or "127.0.0.1", int(port)
+
+
+class SchedulerClient:
+    """JSON-over-HTTP client of the scheduler daemon.
+
+    Times are epoch milliseconds, as in the database.  Errors the daemon
+    reports raise DaemonError; an unreachable daemon raises OSError.
+    """
+
+    def __init__(self, address: str = DEFAULT_DAEMON_ADDRESS, token: str = "", timeout: float = 30.0):
+        host, port = split_address(address)
+        self.address = f"{host}:{port}"
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: Optional[Dict] = None, wait: bool = False) -> Dict:
+        """Send one request and return the decoded JSON response.
+
+        wait drops the timeout, for requests that send messages.
+        """
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(f"http://{self.address}{path}", data=data, method=method,
+                                         headers={'Content-Type': 'application/json',
+                                                  'Authorization': f"Bearer {self.token}"})
+        try:
+            with urllib.request.urlopen(request, timeout=None if wait else self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode('utf-8'))['error']
+            except (ValueError, KeyError):
+                message = e.reason
+            raise DaemonError(e.code, message) from None
+
+    def health(self) -> Dict:
+        return self.request('GET', '/health')
+
+    def set_dispatching(self, running: bool) -> bool:
+        """Start or stop the daemon's dispatcher"""
+        return self.request('POST', '/dispatcher', {'running': running})['running']
+
+    def contacts(self) -> List[Dict]:
+        return self.request('GET', '/contacts')['contacts']
+
+    def contact_number(self, name: str) -> Optional[str]:
+        """E.164 number of a contact, or None if there is none by that name"""
+        try:
+            return self.request('GET', f"/contacts/{quote(name, safe='')}")['phone_number']
+        except DaemonError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def add_contact(self, name: str, phone_number: str) -> str:
+        """Add or update a contact; returns the stored E.164 number"""
+        return self.request('POST', '/contacts', {'name': name, 'phone_number': phone_number})['phone_number']
+
+    def remove_contact(self, name: str) -> bool:
+        return self.request('DELETE', f"/contacts/{quote(name, safe='')}")['deleted']
+
+    def messages(self, status: Optional[str] = None) -> List[Dict]:
+        query = f"?{urlencode({'status': status})}" if status else ""
+        return self.request('GET', f"/messages{query}")['messages']
+
+    def schedule(self, recipient: str, message: str, scheduled_time: Optional[datetime] = None,
+                 delay_minutes: Optional[int] = None, recurrence: Optional[str] = None) -> Dict:
+        """Schedule a message for a contact; see WhatsAppScheduler.schedule"""
+        body = {'recipient': recipient, 'message': message, 'delay_minutes': delay_minutes,
+                'recurrence': recurrence}
+        if scheduled_time is not None:
+            body['scheduled_time'] = to_epoch_ms(scheduled_time)
+        return self.request('POST', '/messages', body)
+
+    def schedule_command(self, command: str) -> Dict:
+        """Schedule a natural language command such as 'Send john "hi" in 2 hours'"""
+        return self.request('POST', '/messages', {'command': command})
+
+    def schedule_many(self, commands: List[str]) -> Dict:
+        """Schedule many commands in one transaction; returns scheduled and errors"""
+        return self.request('POST', '/messages/batch', {'commands': list(commands)})
+
+    def cancel(self, message_ids: List[int]) -> int:
+        return self.request('POST', '/messages/cancel', {'ids': list(message_ids)})['cancelled']
+
+    def send_messages_now(self, message_ids: List[int]) -> Dict:
+        """Send scheduled messages now; returns skipped, sent and failed counts"""
+        return self.request('POST', '/messages/send', {'ids': list(message_ids)}, wait=True)
+
+    def send(self, phone_number: str, message: str) -> bool:
+        """Send a message to a number immediately"""
+        return self.request('POST', '/send', {'phone_number': phone_number, 'message': message},
+                            wait=True)['sent']
+
+    def recurring(self) -> List[Dict]:
+        return self.request('GET', '/recurring')['schedules']
+
+    def end_recurring(self, schedule_id: int) -> bool:
+        try:
+            return self.request('DELETE', f"/recurring/{schedule_id}")['cancelled']
+        except DaemonError as e:
+            if e.status == 404:
+                return False
+            raise
+
+    def dead_letters(self, limit: int = 100) -> List[Dict]:
+        return self.request('GET', f"/dead-letters?limit={limit}")['dead_letters']
+
+    def replay(self, ids: Optional[List[int]] = None) -> int:
+        """Replay dead letters (all, or the given ids); returns how many"""
+        return self.request('POST', '/dead-letters/replay', {'ids': ids})['replayed']
+
+    def import_file(self, kind: str, path: str) -> str:
+        """Import 'contacts' or 'messages' from a file the daemon can read; returns the report"""
+        return self.request('POST', '/import', {'kind': kind, 'path': path}, wait=True)['report']
+
+    def stats(self) -> Dict:
+        """The daemon's metrics summary lines and rate limit levels"""
+        return self.request('GET', '/stats')
+
+
+def connect_to_daemon(address: Optional[str] = None, timeout: float = 1.0,
+                      db_path: str = "scheduler.db") -> Optional[SchedulerClient]:
+    """A client of the daemon serving db_path, or None if none answers at address"""
+    address = address or daemon_address()
+    token = read_token(token_path(db_path))
+    if not address or not token:
+        return None
+    try:
+        SchedulerClient(address, token, timeout).health()
+    except (OSError, DaemonError, ValueError):
+        return None
+    return SchedulerClient(address, token)
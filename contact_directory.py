@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from change_feed import current_revision
+from metrics import REGISTRY
+from storage import Storage
+from tracing import TRACER
+
+CACHE_HITS = REGISTRY.counter('whatsapp_scheduler_contact_cache_hits_total',
+                              'Contact lookups answered from the contact directory cache')
+CACHE_MISSES = REGISTRY.counter('whatsapp_scheduler_contact_cache_misses_total',
+                                'Contact lookups that had to query the database')
+
+
+class ContactDirectory:
+    """In-memory cache of contact name -> E.164 phone number lookups.
+
+    Entries (including misses, so unknown names are not re-queried) are
+    loaded on demand.  The cache is dropped by invalidate(), which callers
+    run after writing contacts themselves, and when another connection or
+    process changed contacts: lookups compare PRAGMA data_version on the
+    calling thread's connection (at most every CHECK_INTERVAL seconds per
+    thread), and only if it moved read the change log to see whether
+    contacts were among the changes.  Safe to use from several threads.
+    """
+
+    # Changes made by other processes become visible within this many seconds.
+    CHECK_INTERVAL = 0.25
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._numbers: Dict[str, Optional[str]] = {}
+        self._generation = 0
+        self._revision = current_revision(storage)
+        self._lock = threading.Lock()
+        self._seen = threading.local()
+
+    def lookup(self, name: str) -> Optional[str]:
+        """Phone number of the contact, or None if there is no such contact"""
+        with TRACER.span('contacts.lookup') as span:
+            self._check_external_changes()
+            name = name.lower()
+            with self._lock:
+                if name in self._numbers:
+                    self.hits += 1
+                    CACHE_HITS.inc()
+                    span.set(cached=True)
+                    return self._numbers[name]
+            span.set(cached=False)
+            return self.lookup_many([name]).get(name)
+
+    def lookup_many(self, names: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Phone numbers (or None) keyed by lowercased name; misses are loaded with one query"""
+        self._check_external_changes()
+        names = {name.lower() for name in names}
+
+        with self._lock:
+            found = {name: self._numbers[name] for name in names if name in self._numbers}
+            generation = self._generation
+            self.hits += len(found)
+            self.misses += len(names) - len(found)
+        CACHE_HITS.inc(len(found))
+        CACHE_MISSES.inc(len(names) - len(found))
+        missing = sorted(names - found.keys())
+        if not missing:
+            return found
+
+        loaded: Dict[str, Optional[str]] = dict.fromkeys(missing)
+        with TRACER.span('contacts.load', names=len(missing)):
+            loaded.update(self.storage.query(
+                "SELECT name, COALESCE(phone_e164, phone_number) FROM contacts "
+                "WHERE name IN (SELECT value FROM json_each(?))",
+                (json.dumps(missing),)))
+
+        with self._lock:
+            # An invalidation while loading may have made these stale
+            if generation == self._generation:
+                self._numbers.update(loaded)
+        found.update(loaded)
+        return found
+
+    def invalidate(self):
+        """Forget every cached entry"""
+        with self._lock:
+            self._numbers.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters of this directory and current size (the registry counts all directories)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'cached': len(self._numbers),
+            }
+
+    def _check_external_changes(self):
+        now = time.monotonic()
+        if now < getattr(self._seen, 'next_check', 0.0):
+            return
+        self._seen.next_check = now + self.CHECK_INTERVAL
+
+        # data_version is per connection, so each thread keeps its own baseline.
+        version = self.storage.data_version()
+        seen = getattr(self._seen, 'version', None)
+        self._seen.version = version
+        if seen == version:
+            return
+
+        # Something was committed elsewhere (or this thread has not looked
+        # before); only contact changes matter.
+        with self._lock:
+            revision = self._revision
+        latest, contacts_changed = self.storage.query_one('''
+            SELECT MAX(revision), COUNT(CASE WHEN table_name = 'contacts' THEN 1 END)
+            FROM change_log WHERE revision > ?
+        ''', (revision,))
+        if latest is None:
+            return
+        with self._lock:
+            self._revision = max(self._revision, latest)
+        if contacts_changed:
+            self.invalidate()
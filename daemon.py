@@ -0,0 +1,338 @@
+import hmac
+import json
+import os
+import re
+import secrets
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote
+
+from client import DEFAULT_DAEMON_ADDRESS, daemon_address, read_token, split_address, token_path
+from main import ScheduledMessage, WhatsAppScheduler, create_scheduler
+from metrics import REGISTRY
+from storage import to_epoch_ms, from_epoch_ms
+from tracing import run_entry_point
+
+# Headless mode: one process runs the dispatcher and serves a JSON API on
+# localhost; the CLI and GUI connect to it as thin clients.
+#
+#   python daemon.py                         # WHATSAPP_SCHEDULER_DAEMON=127.0.0.1:8765
+#   curl -d '{"command": "Send john \"hi\" in 5 minutes"}' http://127.0.0.1:8765/messages
+#
+# Requests and responses are JSON objects; times are epoch milliseconds.
+# Errors are {"error": "..."} with status 400 (bad request) or 404 (unknown
+# contact, message or schedule).
+#
+# Every request except GET /metrics needs "Authorization: Bearer <token>",
+# with the token from daemon.token next to the database (see client.py).
+# POST bodies must be sent as application/json, and the Host header must
+# name a loopback address, so web pages cannot reach the API through
+# simple cross-origin requests or DNS rebinding.  Only listen on a
+# loopback address.
+
+LOOPBACK_HOSTS = {'127.0.0.1', 'localhost', '::1'}
+
+
+def load_or_create_token(db_path: str) -> str:
+    """The API token stored next to db_path, created (readable by this user only) if missing"""
+    path = token_path(db_path)
+    token = read_token(path)
+    if token:
+        return token
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token + "\n")
+    return token
+
+
+def _host_name(header: str) -> str:
+    """The host part of a Host header ('[::1]:8765' -> '::1')"""
+    host = header.strip().lower()
+    if host.startswith('['):
+        return host[1:host.find(']')]
+    return host.rpartition(':')[0] if ':' in host else host
+
+
+def _scheduled_json(scheduled: ScheduledMessage) -> Dict:
+    return {'recipient': scheduled.recipient, 'phone_number': scheduled.phone_number,
+            'message': scheduled.message, 'scheduled_time': to_epoch_ms(scheduled.scheduled_time),
+            'recurrence': scheduled.recurrence, 'schedule_id': scheduled.schedule_id}
+
+
+def _ids(body: Dict) -> List[int]:
+    ids = body.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        raise ValueError("'ids' must be a list of integers")
+    return ids
+
+
+def health(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'status': 'ok', 'pid': os.getpid(), 'dispatching': scheduler.running,
+            'database': os.path.abspath(scheduler.db_path), 'transport': scheduler.transport.name}
+
+
+def set_dispatching(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    if body.get('running') and not scheduler.running:
+        scheduler.start_scheduler()
+    elif not body.get('running') and scheduler.running:
+        scheduler.stop_scheduler()
+    return {'running': scheduler.running}
+
+
+def list_contacts(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'contacts': [{'name': name, 'phone_number': phone} for name, phone in scheduler.list_contacts()]}
+
+
+def get_contact(scheduler: WhatsAppScheduler, body, query, name: str) -> Dict:
+    phone_number = scheduler.get_contact_number(name)
+    if not phone_number:
+        raise LookupError(f"Contact '{name}' not found")
+    return {'name': name.lower(), 'phone_number': phone_number}
+
+
+def add_contact(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    phone_number = scheduler.save_contact(body['name'], body['phone_number'])
+    return {'name': body['name'].lower(), 'phone_number': phone_number}
+
+
+def remove_contact(scheduler: WhatsAppScheduler, body, query, name: str) -> Dict:
+    if not scheduler.remove_contact(name):
+        raise LookupError(f"Contact '{name}' not found")
+    return {'deleted': True}
+
+
+def list_messages(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    status = query.get('status', [None])[0]
+    return {'messages': [{'id': message_id, 'recipient': recipient, 'message': message,
+                          'scheduled_time': scheduled_time, 'status': status}
+                         for message_id, recipient, message, scheduled_time, status
+                         in scheduler.scheduled_messages(status)]}
+
+
+def schedule_message(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    if 'command' in body:
+        return _scheduled_json(scheduler.schedule_command(body['command']))
+    scheduled_time = body.get('scheduled_time')
+    return _scheduled_json(scheduler.schedule(
+        body['recipient'], body['message'],
+        scheduled_time=from_epoch_ms(scheduled_time) if scheduled_time is not None else None,
+        delay_minutes=body.get('delay_minutes'), recurrence=body.get('recurrence')))
+
+
+def schedule_batch(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    result = scheduler.schedule_many(body['commands'])
+    return {'scheduled': result.scheduled,
+            'errors': [{'line': error.line, 'command': error.command, 'reason': error.reason}
+                       for error in result.errors]}
+
+
+def cancel_messages(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'cancelled': scheduler.delete_messages(_ids(body))}
+
+
+def send_messages(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    skipped, results = scheduler.send_messages_now(_ids(body))
+    sent = sum(result.success for result in results)
+    return {'skipped': skipped, 'sent': sent, 'failed': len(results) - sent}
+
+
+def send_message(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'sent': scheduler.send_whatsapp_message(body['phone_number'], body['message'])}
+
+
+def list_recurring(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'schedules': [{'id': schedule_id, 'recipient': recipient, 'message': message, 'rule': rule,
+                           'next_run': next_run}
+                          for schedule_id, recipient, message, rule, next_run in scheduler.recurring_schedules()]}
+
+
+def end_recurring(scheduler: WhatsAppScheduler, body, query, schedule_id: str) -> Dict:
+    if not scheduler.end_recurring(int(schedule_id)):
+        raise LookupError(f"No active recurring schedule {schedule_id}")
+    return {'cancelled': True}
+
+
+def list_dead_letters(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    limit = int(query.get('limit', ['100'])[0])
+    return {'dead_letters': [{'id': dead_id, 'recipient': recipient, 'message': message,
+                              'scheduled_time': scheduled_time, 'attempts': attempts,
+                              'last_error': last_error, 'failed_at': failed_at}
+                             for dead_id, recipient, message, scheduled_time, attempts, last_error, failed_at
+                             in scheduler.dead_letters(limit)]}
+
+
+def replay_dead_letters(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'replayed': scheduler.replay_dead_letters(_ids(body) if body.get('ids') is not None else None)}
+
+
+def import_file(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'report': scheduler.import_file(body['kind'], body['path'])}
+
+
+def stats(scheduler: WhatsAppScheduler, body, query) -> Dict:
+    return {'summary': scheduler.stats_summary(), 'rate_limits': scheduler.rate_limit_levels()}
+
+
+# (method, path pattern, handler); handlers get the path groups as extra arguments
+ROUTES: List[Tuple[str, str, Callable[..., Dict]]] = [
+    ('GET', r'/health', health),
+    ('POST', r'/dispatcher', set_dispatching),
+    ('GET', r'/contacts', list_contacts),
+    ('POST', r'/contacts', add_contact),
+    ('GET', r'/contacts/([^/]+)', get_contact),
+    ('DELETE', r'/contacts/([^/]+)', remove_contact),
+    ('GET', r'/messages', list_messages),
+    ('POST', r'/messages', schedule_message),
+    ('POST', r'/messages/batch', schedule_batch),
+    ('POST', r'/messages/cancel', cancel_messages),
+    ('POST', r'/messages/send', send_messages),
+    ('POST', r'/send', send_message),
+    ('GET', r'/recurring', list_recurring),
+    ('DELETE', r'/recurring/(\d+)', end_recurring),
+    ('GET', r'/dead-letters', list_dead_letters),
+    ('POST', r'/dead-letters/replay', replay_dead_letters),
+    ('POST', r'/import', import_file),
+    ('GET', r'/stats', stats),
+]
+_COMPILED_ROUTES = [(method, re.compile(pattern), handler) for method, pattern, handler in ROUTES]
+
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    scheduler: Optional[WhatsAppScheduler] = None
+    token = ""
+    allowed_hosts = LOOPBACK_HOSTS
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] == '/metrics':
+            if not self._check_host():
+                return
+            try:
+                body = REGISTRY.render().encode('utf-8')
+            finally:
+                self.scheduler.storage.release_connection()
+            self._reply(200, body, 'text/plain; version=0.0.4; charset=utf-8')
+            return
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _check_host(self) -> bool:
+        if _host_name(self.headers.get('Host', '')) in self.allowed_hosts:
+            return True
+        self._reply_json(403, {'error': "Host not allowed"})
+        return False
+
+    def _check_request(self, method: str) -> bool:
+        """Reject requests a web page could forge: wrong Host, body not JSON, no token"""
+        if not self._check_host():
+            return False
+        if method == 'POST' and self.headers.get_content_type() != 'application/json':
+            self._reply_json(415, {'error': "Content-Type must be application/json"})
+            return False
+        scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+        if scheme != 'Bearer' or not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+            self._reply_json(403, {'error': "Missing or wrong API token"})
+            return False
+        return True
+
+    def _handle(self, method: str):
+        if not self._check_request(method):
+            return
+        path, _, query = self.path.partition('?')
+        for route_method, pattern, handler in _COMPILED_ROUTES:
+            match = pattern.fullmatch(path)
+            if match and route_method == method:
+                break
+        else:
+            self._reply_json(404, {'error': f"No such endpoint: {method} {path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            if not isinstance(body, dict):
+                raise ValueError("Request body must be a JSON object")
+            payload = handler(self.scheduler, body, parse_qs(query), *map(unquote, match.groups()))
+        except KeyError as e:
+            status, payload = 400, {'error': f"Missing field {e}"}
+        except LookupError as e:
+            status, payload = 404, {'error': str(e)}
+        except (TypeError, ValueError) as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            print(f"Error handling {method} {path}: {e}")
+            status, payload = 500, {'error': str(e)}
+        else:
+            status = 200
+        finally:
+            # Every request runs on a new thread; do not leave its connection open.
+            self.scheduler.storage.release_connection()
+        self._reply_json(status, payload)
+
+    def _reply_json(self, status: int, payload: Dict):
+        self._reply(status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # requests are not worth a line on the console
+
+
+def create_daemon_server(scheduler: WhatsAppScheduler, host: str = "127.0.0.1", port: int = 8765,
+                         token: Optional[str] = None) -> ThreadingHTTPServer:
+    """HTTP server for the API; call serve_forever() on it.
+
+    token defaults to the one stored next to the scheduler's database.
+    """
+    handler = type('DaemonHandler', (_DaemonHandler,), {
+        'scheduler': scheduler,
+        'token': token or load_or_create_token(scheduler.db_path),
+        'allowed_hosts': LOOPBACK_HOSTS | {host.lower()},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    host, port = split_address(daemon_address() or DEFAULT_DAEMON_ADDRESS)
+    scheduler = create_scheduler()
+    try:
+        server = create_daemon_server(scheduler, host, port)
+    except OSError as e:
+        # Most likely another daemon already listens there
+        print(f"Cannot listen on {host}:{port}: {e}")
+        scheduler.close()
+        raise SystemExit(1)
+
+    def shut_down(signum, frame):
+        # serve_forever() runs on this thread, so shut it down from another
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shut_down)
+    scheduler.start_scheduler()
+    print(f"WhatsApp scheduler daemon listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scheduler.close()
+        print("Daemon stopped.")
+
+
+if __name__ == "__main__":
+    run_entry_point(main, "WhatsApp Message Scheduler (daemon)", "daemon.prof")
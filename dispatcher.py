@@ -0,0 +1,400 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import LAG_BUCKETS, REGISTRY, MetricsRegistry
+from rate_limit import RateLimiter
+from recurrence import materialize_next_occurrences
+from retry import DEFAULT_RETRY_POLICY, RetryPolicy, count_dead_letters, move_to_dead_letters
+from storage import Storage, now_ms
+from tracing import TRACER
+from transport import OutgoingMessage, SendResult, Transport, deliver_batch
+from workers import SendPool
+
+TICK_SECONDS = REGISTRY.histogram(
+    'whatsapp_scheduler_tick_seconds', 'Duration of one dispatcher pass over due messages',
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+DISPATCH_LAG_SECONDS = REGISTRY.histogram(
+    'whatsapp_scheduler_dispatch_lag_seconds', 'Delay between scheduled_time and sent_at',
+    buckets=LAG_BUCKETS)
+MESSAGES_SENT = REGISTRY.counter('whatsapp_scheduler_messages_sent_total', 'Messages delivered')
+SEND_FAILURES = REGISTRY.counter(
+    'whatsapp_scheduler_send_failures_total', 'Failed delivery attempts by reason and outcome',
+    ('reason', 'outcome'))
+MESSAGES_DEFERRED = REGISTRY.counter(
+    'whatsapp_scheduler_messages_deferred_total', 'Messages deferred by the rate limiter')
+
+
+def new_owner_id() -> str:
+    """Identify this dispatcher process in claimed_by"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def register_queue_metrics(storage: Storage, registry: MetricsRegistry = REGISTRY):
+    """Gauges read from the database whenever metrics are rendered"""
+    def messages_by_status():
+        counts = {(status,): 0 for status in ('pending', 'sending', 'sent')}
+        counts.update(((status,), count) for status, count in storage.query(
+            "SELECT status, COUNT(*) FROM scheduled_messages GROUP BY status"))
+        return counts
+
+    def due_messages():
+        return {(): storage.query_one('''
+            SELECT COUNT(*) FROM scheduled_messages INDEXED BY idx_scheduled_messages_pending_due
+            WHERE status = 'pending' AND COALESCE(next_attempt_at, scheduled_time) <= ?
+        ''', (now_ms(),))[0]}
+
+    registry.gauge('whatsapp_scheduler_messages', 'Scheduled messages by status',
+                   ('status',), collect=messages_by_status)
+    registry.gauge('whatsapp_scheduler_due_messages', 'Pending messages that are already due (queue depth)',
+                   collect=due_messages)
+    registry.gauge('whatsapp_scheduler_dead_letters', 'Messages in the dead-letter table',
+                   collect=lambda: {(): count_dead_letters(storage)})
+
+
+def failure_reason(error: Optional[str]) -> str:
+    """Metric label for a send error: its exception type, or 'other'"""
+    head = (error or '').split(':', 1)[0].strip()
+    return head if head.isidentifier() else 'other'
+
+
+def claim_due_messages(storage: Storage, owner: str, lease_seconds: float = 900,
+                       limit: int = 100,
+                       on_scheduled: Optional[Callable[[float], None]] = None) -> List[List[OutgoingMessage]]:
+    """Atomically claim due messages and return them grouped by E.164 phone number.
+
+    In one transaction, leases that have expired (their dispatcher crashed)
+    are released back to 'pending', then up to limit due rows move to
+    'sending' under this owner; a row deferred to next_attempt_at is due
+    then instead of at its scheduled time.  Groups are ordered by their earliest
+    message and each group keeps scheduled order, so one chat session can
+    deliver it back to back.  Claiming an occurrence of a recurring
+    schedule materializes the next one; on_scheduled is called with its
+    due time (epoch seconds).
+    """
+    now = now_ms()
+    lease_expires_at = now + int(lease_seconds * 1000)
+
+    with TRACER.span('dispatch.claim', limit=limit) as span, storage.transaction() as cursor:
+        cursor.execute('''
+            UPDATE scheduled_messages
+            SET status = 'pending', claimed_by = NULL, lease_expires_at = NULL
+            WHERE status = 'sending' AND lease_expires_at <= ?
+        ''', (now,))
+
+        # Rows are read back by id: a claim made in the same millisecond
+        # (while earlier claims are still being sent) has the same owner
+        # and lease time.
+        # INDEXED BY: without ANALYZE statistics the planner prefers the
+        # (status, scheduled_time) index and sorts every pending row.
+        ids = [row[0] for row in cursor.execute('''
+            SELECT id FROM scheduled_messages INDEXED BY idx_scheduled_messages_pending_due
+            WHERE status = 'pending' AND COALESCE(next_attempt_at, scheduled_time) <= ?
+            ORDER BY COALESCE(next_attempt_at, scheduled_time), id
+            LIMIT ?
+        ''', (now, limit))]
+        cursor.executemany('''
+            UPDATE scheduled_messages
+            SET status = 'sending', claimed_by = ?, lease_expires_at = ?
+            WHERE id = ?
+        ''', [(owner, lease_expires_at, message_id) for message_id in ids])
+
+        rows = _claimed_rows(cursor, ids)
+        _materialize_recurring(cursor, rows, on_scheduled)
+        span.set(claimed=len(rows))
+
+    return group_by_recipient(OutgoingMessage(phone_number, message, msg_id, recipient, scheduled_time)
+                              for msg_id, recipient, phone_number, message, _, scheduled_time in rows)
+
+
+def _claimed_rows(cursor, ids: List[int]) -> List[tuple]:
+    """Rows for claimed ids, in scheduled order"""
+    if not ids:
+        return []
+    placeholders = ', '.join('?' * len(ids))
+    return cursor.execute(f'''
+        SELECT id, recipient_name, COALESCE(phone_e164, phone_number), message,
+               recurring_id, scheduled_time
+        FROM scheduled_messages
+        WHERE id IN ({placeholders})
+        ORDER BY scheduled_time, id
+    ''', ids).fetchall()
+
+
+def _materialize_recurring(cursor, rows, on_scheduled: Optional[Callable[[float], None]]):
+    occurrences = [(recurring_id, scheduled_time) for *_, recurring_id, scheduled_time in rows
+                   if recurring_id is not None]
+    if occurrences:
+        for scheduled_ms in materialize_next_occurrences(cursor, occurrences):
+            if on_scheduled:
+                on_scheduled(scheduled_ms / 1000)
+
+
+def group_by_recipient(messages: Iterable[OutgoingMessage]) -> List[List[OutgoingMessage]]:
+    """Group messages by (canonical) phone number, keeping first-seen order"""
+    batches: Dict[str, List[OutgoingMessage]] = {}
+    for message in messages:
+        batches.setdefault(message.phone_number, []).append(message)
+    return list(batches.values())
+
+
+def claim_messages(storage: Storage, owner: str, message_ids: List[int],
+                   lease_seconds: float = 900,
+                   on_scheduled: Optional[Callable[[float], None]] = None) -> List[OutgoingMessage]:
+    """Claim specific pending messages (e.g. for Send Now).
+
+    Rows that are already being sent, or were sent, are skipped.  As in
+    claim_due_messages, recurring schedules get their next occurrence.
+    """
+    lease_expires_at = now_ms() + int(lease_seconds * 1000)
+    with storage.transaction() as cursor:
+        claimed = [message_id for message_id in message_ids if cursor.execute('''
+            UPDATE scheduled_messages
+            SET status = 'sending', claimed_by = ?, lease_expires_at = ?
+            WHERE id = ? AND status = 'pending'
+        ''', (owner, lease_expires_at, message_id)).rowcount]
+        rows = _claimed_rows(cursor, claimed)
+        _materialize_recurring(cursor, rows, on_scheduled)
+
+    return [OutgoingMessage(phone_number, message, msg_id, recipient, scheduled_time)
+            for msg_id, recipient, phone_number, message, _, scheduled_time in rows]
+
+
+def renew_leases(storage: Storage, owner: str, lease_seconds: float = 900):
+    """Extend the leases on every row this owner still holds"""
+    storage.execute('''
+        UPDATE scheduled_messages SET lease_expires_at = ?
+        WHERE status = 'sending' AND claimed_by = ?
+    ''', (now_ms() + int(lease_seconds * 1000), owner))
+
+
+def record_results(storage: Storage, results: List[SendResult], owner: Optional[str] = None,
+                   retry: RetryPolicy = DEFAULT_RETRY_POLICY) -> Dict[int, Optional[float]]:
+    """Update the status of every message in a delivered batch in one transaction.
+
+    A failed message goes back to 'pending' with its attempt count, error
+    and a next_attempt_at chosen by the retry policy; after
+    retry.max_attempts attempts, or an error that is not retryable, it
+    moves to dead_letters.  Returns, for every failed message, its retry
+    due time (epoch seconds), or None if it was dead-lettered.
+
+    With an owner, only rows still claimed by that owner are updated, so a
+    dispatcher whose lease was taken over cannot overwrite the new owner.
+    """
+    now = now_ms()
+    sent = [(now, r.message.message_id) for r in results if r.success]
+    failed = [r for r in results if not r.success]
+    fence = " AND claimed_by = ?" if owner else ""
+    extra = (owner,) if owner else ()
+    outcomes: Dict[int, Optional[float]] = {}
+
+    with TRACER.span('dispatch.record', sent=len(sent), failed=len(failed)), \
+            storage.transaction() as cursor:
+        if sent:
+            cursor.executemany(f'''
+                UPDATE scheduled_messages
+                SET status = 'sent', sent_at = ?, claimed_by = NULL, lease_expires_at = NULL,
+                    next_attempt_at = NULL, last_error = NULL
+                WHERE id = ?{fence}
+            ''', [params + extra for params in sent])
+
+        dead = []
+        for result in failed:
+            message_id = result.message.message_id
+            row = cursor.execute(f"SELECT attempts FROM scheduled_messages WHERE id = ?{fence}",
+                                 (message_id,) + extra).fetchone()
+            if row is None:
+                continue
+            attempts = row[0] + 1
+            if result.retryable and attempts < retry.max_attempts:
+                next_attempt_at = now + int(retry.delay(attempts) * 1000)
+                outcomes[message_id] = next_attempt_at / 1000
+            else:
+                next_attempt_at = None
+                outcomes[message_id] = None
+                dead.append(message_id)
+            cursor.execute('''
+                UPDATE scheduled_messages
+                SET status = 'pending', claimed_by = NULL, lease_expires_at = NULL,
+                    attempts = ?, last_error = ?, next_attempt_at = ?
+                WHERE id = ?
+            ''', (attempts, result.error, next_attempt_at, message_id))
+        move_to_dead_letters(cursor, dead)
+
+    MESSAGES_SENT.inc(len(sent))
+    for result in results:
+        if result.success and result.message.scheduled_time is not None:
+            DISPATCH_LAG_SECONDS.observe(max(0.0, (now - result.message.scheduled_time) / 1000))
+        elif not result.success and result.message.message_id in outcomes:
+            outcome = 'retry' if outcomes[result.message.message_id] is not None else 'dead_letter'
+            SEND_FAILURES.inc(reason=failure_reason(result.error), outcome=outcome)
+    return outcomes
+
+
+def defer_messages(storage: Storage, owner: str,
+                   deferrals: List[Tuple[OutgoingMessage, float]]) -> List[float]:
+    """Release claimed messages back to 'pending', not due again for the given seconds.
+
+    Used for messages over the rate limit: they keep their scheduled time
+    and are not marked failed.  Returns the new due times (epoch seconds).
+    """
+    now = now_ms()
+    rows = [(now + int(seconds * 1000), message.message_id, owner) for message, seconds in deferrals]
+    with TRACER.span('dispatch.defer', messages=len(rows)), storage.transaction() as cursor:
+        cursor.executemany('''
+            UPDATE scheduled_messages
+            SET status = 'pending', claimed_by = NULL, lease_expires_at = NULL, next_attempt_at = ?
+            WHERE id = ? AND status = 'sending' AND claimed_by = ?
+        ''', rows)
+    return [next_attempt_at / 1000 for next_attempt_at, _, _ in rows]
+
+
+def record_batch(storage: Storage, owner: str, batch_results: List[SendResult],
+                 retry: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 on_scheduled: Optional[Callable[[float], None]] = None):
+    """record_results() for delivered messages, reporting each outcome.
+
+    on_scheduled is called with each retry's due time (epoch seconds).
+    """
+    outcomes = record_results(storage, batch_results, owner, retry)
+    for result in batch_results:
+        recipient = result.message.recipient_name
+        if result.success:
+            print(f"Message sent successfully to {recipient}")
+            continue
+        print(f"Failed to send message to {recipient}: {result.error}")
+        retry_at = outcomes.get(result.message.message_id)
+        if retry_at is not None:
+            print(f"Retrying in {retry_at - time.time():.0f}s")
+            if on_scheduled:
+                on_scheduled(retry_at)
+        elif result.message.message_id in outcomes:
+            print("Giving up; moved to dead letters")
+
+
+def deliver_messages(storage: Storage, transport: Transport, owner: str,
+                     batches: List[List[OutgoingMessage]], pool: Optional[SendPool] = None,
+                     lease_seconds: float = 900,
+                     on_results: Optional[Callable[[List[SendResult]], None]] = None,
+                     retry: RetryPolicy = DEFAULT_RETRY_POLICY,
+                     on_scheduled: Optional[Callable[[float], None]] = None) -> List[SendResult]:
+    """Send already claimed batches and record their results.
+
+    With a pool, recipients are delivered in parallel and this returns once
+    these batches (not everything else queued on the pool) are recorded.
+    on_results is called after each batch is recorded, from the thread
+    that sent it.  Failures are retried per the retry policy, and
+    on_scheduled is called with each retry's due time (epoch seconds).
+    """
+    results: List[SendResult] = []
+    results_lock = threading.Lock()
+    remaining = threading.Semaphore(0)
+
+    def record(batch_results: List[SendResult]):
+        try:
+            record_batch(storage, owner, batch_results, retry, on_scheduled)
+            renew_leases(storage, owner, lease_seconds)
+            with results_lock:
+                results.extend(batch_results)
+            if on_results:
+                on_results(batch_results)
+        finally:
+            remaining.release()
+
+    for batch in batches:
+        print(f"Sending {len(batch)} message(s) to {batch[0].recipient_name}")
+        if pool:
+            pool.submit(batch[0].phone_number, batch, record)
+        else:
+            record(deliver_batch(transport, batch))
+
+    for _ in batches:
+        remaining.acquire()
+    return results
+
+
+def claim_next_batches(storage: Storage, owner: str, lease_seconds: float = 900,
+                       claim_limit: int = 100,
+                       on_scheduled: Optional[Callable[[float], None]] = None,
+                       limiter: Optional[RateLimiter] = None) -> Optional[List[List[OutgoingMessage]]]:
+    """Claim the next due batches the rate limiter admits; None once nothing more is due.
+
+    With a limiter, no more rows are claimed than the global budget allows,
+    and claimed messages over a recipient's budget are deferred (see
+    defer_messages), so the result may be empty while more are due.
+    on_scheduled is called with the time the budget allows the rest, so
+    the dispatcher wakes up for them, and is passed to claim_due_messages.
+    """
+    limit = claim_limit
+    if limiter:
+        limit = min(claim_limit, limiter.available())
+        if not limit:
+            next_due = load_next_due_time(storage)
+            if on_scheduled and next_due is not None and next_due <= time.time():
+                on_scheduled(time.time() + limiter.global_wait_time())
+            return None
+
+    batches = claim_due_messages(storage, owner, lease_seconds, limit, on_scheduled)
+    if not batches:
+        return None
+    if limiter:
+        batches, deferred = limiter.admit(batches)
+        if deferred:
+            due_times = defer_messages(storage, owner, deferred)
+            MESSAGES_DEFERRED.inc(len(deferred))
+            print(f"Rate limit: deferred {len(deferred)} message(s)")
+            if on_scheduled:
+                for due_time in sorted(set(due_times)):
+                    on_scheduled(due_time)
+    return batches
+
+
+def deliver_due_messages(storage: Storage, transport: Transport, owner: str,
+                         pool: Optional[SendPool] = None, lease_seconds: float = 900,
+                         claim_limit: int = 100,
+                         on_scheduled: Optional[Callable[[float], None]] = None,
+                         limiter: Optional[RateLimiter] = None,
+                         retry: RetryPolicy = DEFAULT_RETRY_POLICY) -> List[SendResult]:
+    """Claim and send every due message, one transport session per recipient.
+
+    Rows are claimed claim_limit at a time (see claim_next_batches, which
+    applies the limiter); leases on rows still waiting to be sent are
+    renewed after every batch.  With a pool, recipients are delivered in
+    parallel and this returns once every claimed batch has been delivered
+    and recorded.  on_scheduled and retry are passed on.  The dispatcher
+    (async_dispatcher.py) runs the same steps on an event loop.
+    """
+    results: List[SendResult] = []
+    while True:
+        batches = claim_next_batches(storage, owner, lease_seconds, claim_limit, on_scheduled, limiter)
+        if batches is None:
+            break
+        results.extend(deliver_messages(storage, transport, owner, batches, pool, lease_seconds,
+                                        retry=retry, on_scheduled=on_scheduled))
+    return results
+
+
+def load_next_due_time(storage: Storage, after: float = 0) -> Optional[float]:
+    """Earliest due time (epoch seconds) of a pending message, or None.
+
+    With after, only due times later than it are considered.
+    """
+    row = storage.query_one('''
+        SELECT MIN(COALESCE(next_attempt_at, scheduled_time))
+        FROM scheduled_messages INDEXED BY idx_scheduled_messages_pending_due
+        WHERE status = 'pending' AND COALESCE(next_attempt_at, scheduled_time) > ?
+    ''', (after * 1000,))
+    return row[0] / 1000 if row[0] is not None else None
+
+
+def load_next_lease_expiry(storage: Storage, after: float = 0) -> Optional[float]:
+    """Earliest expiry (epoch seconds, later than after) of an outstanding claim lease, or None"""
+    row = storage.query_one('''
+        SELECT MIN(lease_expires_at)
+        FROM scheduled_messages INDEXED BY idx_scheduled_messages_sending_lease
+        WHERE status = 'sending' AND lease_expires_at > ?
+    ''', (after * 1000,))
+    return row[0] / 1000 if row[0] is not None else None
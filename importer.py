@@ -0,0 +1,195 @@
+import argparse
+import csv
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from storage import Storage, to_epoch_ms
+from phone_numbers import to_e164
+
+# Only the first few rejected rows are kept, so a bad file cannot use
+# unbounded memory.
+MAX_REPORTED_ERRORS = 20
+
+
+@dataclass
+class ImportReport:
+    """Summary of a bulk import"""
+    imported: int = 0
+    rejected: int = 0
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.imported / self.seconds if self.seconds else 0.0
+
+    def reject(self, line: int, reason: str):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"line {line}: {reason}")
+
+    def __str__(self):
+        summary = (f"Imported {self.imported} rows, rejected {self.rejected} "
+                   f"in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s)")
+        return "\n".join([summary] + self.errors)
+
+
+def iter_records(path: str, file_format: Optional[str] = None) -> Iterator[Tuple[int, Dict]]:
+    """Stream (line number, record) pairs from a CSV (with header) or JSONL file"""
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+        elif file_format == 'jsonl':
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        record = {'__error__': f"invalid JSON ({e.msg})"}
+                    if not isinstance(record, dict):
+                        record = {'__error__': f"expected a JSON object, got {type(record).__name__}"}
+                    yield line_number, record
+        else:
+            raise ValueError(f"Unsupported import format '{file_format}' (use csv or jsonl)")
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _valid_contacts(records: Iterable[Tuple[int, Dict]], report: ImportReport) -> Iterator[Tuple[str, str, str]]:
+    for line, record in records:
+        try:
+            if '__error__' in record:
+                raise ValueError(record['__error__'])
+            name = str(record.get('name') or '').strip().lower()
+            if not name:
+                raise ValueError("missing name")
+            phone_e164 = to_e164(record.get('phone_number') or record.get('phone') or '')
+            yield name, phone_e164, phone_e164
+        except ValueError as e:
+            report.reject(line, str(e))
+
+
+def import_contacts(storage: Storage, path: str, file_format: Optional[str] = None,
+                    chunk_size: int = 1000) -> ImportReport:
+    """Stream contacts (name, phone_number) from a file into the contacts table"""
+    report = ImportReport()
+    start = time.perf_counter()
+
+    for chunk in _chunks(_valid_contacts(iter_records(path, file_format), report), chunk_size):
+        with storage.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO contacts (name, phone_number, phone_e164) VALUES (?, ?, ?)", chunk)
+        report.imported += len(chunk)
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def _parse_scheduled_time(record: Dict, now: datetime) -> int:
+    value = record.get('scheduled_time')
+    if value not in (None, ''):
+        if isinstance(value, (int, float)) or str(value).isdigit():
+            return int(value)  # already epoch milliseconds
+        try:
+            return to_epoch_ms(datetime.fromisoformat(str(value)))
+        except ValueError:
+            raise ValueError(f"invalid scheduled_time '{value}'")
+
+    delay = record.get('delay_minutes')
+    if delay in (None, ''):
+        raise ValueError("missing scheduled_time or delay_minutes")
+    try:
+        return to_epoch_ms(now + timedelta(minutes=float(delay)))
+    except ValueError:
+        raise ValueError(f"invalid delay_minutes '{delay}'")
+
+
+def import_messages(storage: Storage, path: str, file_format: Optional[str] = None,
+                    chunk_size: int = 1000) -> ImportReport:
+    """Stream scheduled messages from a file into scheduled_messages.
+
+    Each record needs recipient_name, message and either scheduled_time
+    (ISO date/time or epoch milliseconds) or delay_minutes.  phone_number
+    is optional; when missing it is looked up from contacts.
+    """
+    report = ImportReport()
+    start = time.perf_counter()
+    now = datetime.now()
+
+    for chunk in _chunks(iter_records(path, file_format), chunk_size):
+        # Resolve every contact named in the chunk with one query.
+        names = {str(r.get('recipient_name') or '').strip().lower()
+                 for _, r in chunk if not r.get('phone_number')}
+        names.discard('')
+        contacts: Dict[str, str] = {}
+        if names:
+            contacts = dict(storage.query(
+                "SELECT name, COALESCE(phone_e164, phone_number) FROM contacts "
+                "WHERE name IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted(names)),)))
+
+        rows = []
+        for line, record in chunk:
+            try:
+                if '__error__' in record:
+                    raise ValueError(record['__error__'])
+                recipient = str(record.get('recipient_name') or '').strip().lower()
+                message = str(record.get('message') or '').strip()
+                if not recipient or not message:
+                    raise ValueError("missing recipient_name or message")
+
+                phone_number = record.get('phone_number') or contacts.get(recipient)
+                if not phone_number:
+                    raise ValueError(f"contact '{recipient}' not found")
+
+                phone_e164 = to_e164(phone_number)
+                rows.append((recipient, phone_e164, phone_e164, message,
+                             _parse_scheduled_time(record, now)))
+            except ValueError as e:
+                report.reject(line, str(e))
+
+        if rows:
+            with storage.transaction() as cursor:
+                cursor.executemany('''
+                    INSERT INTO scheduled_messages
+                    (recipient_name, phone_number, phone_e164, message, scheduled_time)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', rows)
+            report.imported += len(rows)
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import contacts or scheduled messages")
+    parser.add_argument('kind', choices=['contacts', 'messages'])
+    parser.add_argument('path', help="CSV (with header row) or JSONL file")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="default: from file extension")
+    parser.add_argument('--db', default="scheduler.db")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    storage = Storage(args.db)
+    storage.init_schema()
+    importer = import_contacts if args.kind == 'contacts' else import_messages
+    print(importer(storage, args.path, args.format, args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,372 +1,608 @@
-import sqlite3
-import schedule
-import time
-import threading
+import os
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-import re
-import pywhatkit as pwk
-from typing import Optional, Dict, List
-import json
+from typing import Callable, Optional, Dict, Iterable, List, Tuple
 
-class WhatsAppScheduler:
-    def __init__(self, db_path: str = "scheduler.db"):
-        self.db_path = db_path
-        self.init_database()
-        self.running = False
-        
-    def init_database(self):
-        """Initialize SQLite database for storing scheduled messages"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scheduled_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                recipient_name TEXT NOT NULL,
-                phone_number TEXT NOT NULL,
-                message TEXT NOT NULL,
-                scheduled_time DATETIME NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pending',
-                sent_at DATETIME NULL
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contacts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                phone_number TEXT NOT NULL
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+from async_dispatcher import AsyncDispatcher
+from client import DaemonError, SchedulerClient, connect_to_daemon
+from contact_directory import ContactDirectory
+from dispatcher import (claim_messages, deliver_due_messages, deliver_messages, group_by_recipient,
+                        new_owner_id, register_queue_metrics)
+from importer import import_contacts, import_messages
+from metrics import format_summary, start_metrics_server
+from nl_parser import parse_command, parse_command_cached
+from phone_numbers import to_e164
+from rate_limit import DEFAULT_RATE_LIMIT, RateLimiter, create_rate_limiter
+from recurrence import (add_recurring_schedule, cancel_recurring_schedule, list_recurring_schedules,
+                        parse_rule)
+from retry import (DEFAULT_RETRY_POLICY, RetryPolicy, create_retry_policy, list_dead_letters,
+                   replay_dead_letters)
+from send_timing import DEFAULT_SEND_TIMING, create_send_timing
+from storage import DataVersionWatcher, Storage, to_epoch_ms, from_epoch_ms
+from tracing import run_entry_point, span
+from transport import OutgoingMessage, SendResult, Transport, PyWhatKitTransport, create_transport
+from workers import SendPool
+
+@dataclass
+class ScheduleError:
+    """A command that schedule_many could not schedule"""
+    line: int
+    command: str
+    reason: str
+
+
+@dataclass
+class BatchScheduleResult:
+    """Outcome of schedule_many"""
+    scheduled: int = 0
+    errors: List[ScheduleError] = field(default_factory=list)
+
+
+@dataclass
+class ScheduledMessage:
+    """A message, or the first occurrence of a recurring schedule, saved by schedule()"""
+    recipient: str
+    phone_number: str
+    message: str
+    scheduled_time: datetime
+    recurrence: Optional[str] = None
+    schedule_id: Optional[int] = None
+
+
+def print_schedule_help():
+    """Examples shown when a schedule command cannot be parsed"""
+    print("\n❌ Could not parse the request. Here are some examples:")
+    print("✅ 'Send john \"test message\" in 2 minutes'")
+    print("✅ 'Message sarah \"meeting reminder\" tomorrow'")
+    print("✅ 'Remind you \"call back\" in 1 hour'")
+    print("✅ 'Send alex \"happy birthday\" in 2 days'")
+    print("✅ 'Send mom \"take your pills\" every day at 9pm'")
+    print("\nMake sure to:")
+    print("- Use quotes around the message")
+    print("- Specify a contact name")
+    print("- Include timing (in X minutes/hours/days, or every day/weekday/monday at HH:MM)")
+
+
+class SchedulerCommands:
+    """The CLI commands, with their printed output.
     
-    def add_contact(self, name: str, phone_number: str):
-        """Add a contact to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    Subclasses supply the data methods: WhatsAppScheduler works on the
+    database in this process, RemoteScheduler asks a running daemon.
+    Nothing here prompts unless schedule_message() is given ask.
+    """
+    
+    def add_contact(self, name: str, phone_number: str) -> Optional[str]:
+        """Add a contact; returns the stored E.164 number"""
         try:
-            cursor.execute(
-                "INSERT OR REPLACE INTO contacts (name, phone_number) VALUES (?, ?)",
-                (name.lower(), phone_number)
-            )
-            conn.commit()
+            phone_e164 = self.save_contact(name, phone_number)
             print(f"Contact {name} added successfully!")
+            return phone_e164
         except Exception as e:
             print(f"Error adding contact: {e}")
-        finally:
-            conn.close()
-    
-    def get_contact_number(self, name: str) -> Optional[str]:
-        """Get phone number for a contact name"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT phone_number FROM contacts WHERE name = ?",
-            (name.lower(),)
-        )
-        result = cursor.fetchone()
-        conn.close()
-        
-        return result[0] if result else None
+            return None
     
     def parse_natural_language(self, user_input: str) -> Dict:
         """Parse natural language input to extract scheduling information"""
-        # Enhanced pattern matching with better flexibility
-        patterns = {
-            'time_patterns': [
-                (r'in (\d+) days?', lambda x: int(x) * 24 * 60),
-                (r'in (\d+) hours?', lambda x: int(x) * 60),
-                (r'in (\d+) minutes?', lambda x: int(x)),
-                (r'tomorrow', lambda x: 24 * 60),
-                (r'after (\d+) days?', lambda x: int(x) * 24 * 60),
-                (r'after (\d+) hours?', lambda x: int(x) * 60),
-                (r'after (\d+) minutes?', lambda x: int(x)),
-            ],
-            'contact_patterns': [
-                r'(?:to|send|message|remind)\s+([A-Za-z]+)',
-                r'send\s+([A-Za-z]+)\s+',
-                r'^([A-Za-z]+)\s+',  # Name at the beginning
-                r'\s+([A-Za-z]+)\s+["\']',  # Name before quoted message
-            ],
-            'message_patterns': [
-                r'["\'](.+?)["\']',  # Quoted message
-                r'(?:saying|asking|about|that)\s+(.+?)(?:\s+in|\s+after|$)',
-                r'message\s+(.+?)(?:\s+in|\s+after|$)',
-            ]
-        }
+        with span('parse', chars=len(user_input)):
+            return parse_command(user_input).as_dict()
+    
+    def schedule_message(self, user_input: str, ask: Optional[Callable[[str], str]] = None) -> bool:
+        """Schedule a message based on natural language input.
         
-        result = {
-            'recipient': None,
-            'message': None,
-            'delay_minutes': None
-        }
+        With ask (e.g. input), an unknown recipient can be added on the spot.
+        """
+        parsed = self.parse_natural_language(user_input)
         
-        # Extract time delay
-        for pattern, converter in patterns['time_patterns']:
-            match = re.search(pattern, user_input.lower())
-            if match:
-                if match.group(1).isdigit():
-                    result['delay_minutes'] = converter(match.group(1))
-                else:
-                    result['delay_minutes'] = converter(1)
-                break
+        if not (parsed['recipient'] and parsed['message'] and (parsed['delay_minutes'] or parsed['recurrence'])):
+            print_schedule_help()
+            return False
         
-        # Extract recipient - try multiple patterns
-        for pattern in patterns['contact_patterns']:
-            contact_match = re.search(pattern, user_input.lower())
-            if contact_match:
-                result['recipient'] = contact_match.group(1)
-                break
+        # 'you' refers to the user's own number, stored as contact 'me'
+        recipient = 'me' if parsed['recipient'].lower() == 'you' else parsed['recipient']
         
-        # Extract message - try multiple patterns
-        for pattern in patterns['message_patterns']:
-            message_match = re.search(pattern, user_input)
-            if message_match:
-                result['message'] = message_match.group(1).strip()
-                break
+        if not self.get_contact_number(recipient):
+            if ask is None:
+                print(f"❌ Contact '{recipient}' not found.")
+                return False
+            if recipient == 'me':
+                phone_input = ask("Enter your phone number (with country code, e.g., +919876543210): ")
+            else:
+                print(f"❌ Contact '{recipient}' not found.")
+                if ask(f"Would you like to add {recipient} now? (y/n): ").lower() != 'y':
+                    return False
+                phone_input = ask(f"Enter phone number for {recipient} (with country code): ")
+            if not phone_input.strip() or not self.add_contact(recipient, phone_input.strip()):
+                return False
         
-        # Debug output
-        print(f"DEBUG - Parsed: recipient='{result['recipient']}', message='{result['message']}', delay={result['delay_minutes']}")
+        try:
+            scheduled = self.schedule(recipient, parsed['message'], delay_minutes=parsed['delay_minutes'],
+                                      recurrence=parsed['recurrence'])
+        except (LookupError, ValueError) as e:
+            print(f"❌ {e}")
+            return False
         
-        return result
+        if scheduled.recurrence:
+            print(f"✅ Recurring message scheduled! (id {scheduled.schedule_id})")
+        else:
+            print(f"✅ Message scheduled!")
+        print(f"📱 To: {scheduled.recipient} ({scheduled.phone_number})")
+        print(f"💬 Message: {scheduled.message}")
+        if scheduled.recurrence:
+            print(f"🔁 Repeats: {scheduled.recurrence}")
+            print(f"⏰ First send: {scheduled.scheduled_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        else:
+            print(f"⏰ Scheduled for: {scheduled.scheduled_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        return True
     
-    def schedule_message(self, user_input: str) -> bool:
-        """Schedule a message based on natural language input"""
-        parsed = self.parse_natural_language(user_input)
-        
-        if not all([parsed['recipient'], parsed['message'], parsed['delay_minutes']]):
-            print("\n❌ Could not parse the request. Here are some examples:")
-            print("✅ 'Send john \"test message\" in 2 minutes'")
-            print("✅ 'Message sarah \"meeting reminder\" tomorrow'")
-            print("✅ 'Remind you \"call back\" in 1 hour'")
-            print("✅ 'Send alex \"happy birthday\" in 2 days'")
-            print("\nMake sure to:")
-            print("- Use quotes around the message")
-            print("- Specify a contact name")
-            print("- Include timing (in X minutes/hours/days)")
+    def schedule_command(self, command: str) -> ScheduledMessage:
+        """Schedule a natural language command without prompting.
+        
+        Raises ValueError if it cannot be parsed, LookupError for an unknown contact.
+        """
+        parsed = self.parse_natural_language(command)
+        if not (parsed['recipient'] and parsed['message'] and (parsed['delay_minutes'] or parsed['recurrence'])):
+            raise ValueError("Could not parse recipient, message and timing")
+        recipient = 'me' if parsed['recipient'].lower() == 'you' else parsed['recipient']
+        return self.schedule(recipient, parsed['message'], delay_minutes=parsed['delay_minutes'],
+                             recurrence=parsed['recurrence'])
+    
+    def send_now(self, contact: str, message: str) -> bool:
+        """Send a message to a contact immediately"""
+        phone_number = self.get_contact_number(contact)
+        if not phone_number:
+            print(f"Contact '{contact}' not found")
             return False
         
-        # Handle "you" as a special case - ask for phone number
-        if parsed['recipient'].lower() == 'you':
-            phone_input = input("Enter your phone number (with country code, e.g., +919876543210): ")
-            if phone_input.strip():
-                # Add temporary contact
-                self.add_contact("me", phone_input.strip())
-                parsed['recipient'] = "me"
-            else:
-                print("Phone number required to send message to 'you'")
-                return False
+        print(f"Sending immediate message to {contact}...")
+        if self.send_whatsapp_message(phone_number, message):
+            print(f"✅ Message sent to {contact}")
+            return True
+        print(f"❌ Failed to send message to {contact}")
+        return False
+    
+    def import_records(self, kind: str, path: str):
+        """Bulk import contacts or messages from a CSV/JSONL file"""
+        print(self.import_file(kind, path))
+    
+    def list_scheduled_messages(self):
+        """List all scheduled messages"""
+        messages = self.scheduled_messages()
         
-        # Get contact number
-        phone_number = self.get_contact_number(parsed['recipient'])
-        if not phone_number:
-            print(f"❌ Contact '{parsed['recipient']}' not found.")
-            add_now = input(f"Would you like to add {parsed['recipient']} now? (y/n): ")
-            if add_now.lower() == 'y':
-                phone_input = input(f"Enter phone number for {parsed['recipient']} (with country code): ")
-                if phone_input.strip():
-                    self.add_contact(parsed['recipient'], phone_input.strip())
-                    phone_number = phone_input.strip()
-                else:
-                    return False
-            else:
-                return False
+        if not messages:
+            print("No scheduled messages found.")
+            return
         
-        # Calculate scheduled time
-        scheduled_time = datetime.now() + timedelta(minutes=parsed['delay_minutes'])
+        print("\n=== Scheduled Messages ===")
+        for message_id, recipient, message, scheduled_time, status in messages:
+            print(f"[{message_id}] To: {recipient}")
+            print(f"Message: {message}")
+            print(f"Scheduled: {from_epoch_ms(scheduled_time).strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"Status: {status}")
+            print("-" * 30)
+    
+    def cancel_messages(self, message_ids: List[int]) -> int:
+        """Delete scheduled messages; cancelling a recurring occurrence ends its schedule"""
+        cancelled = self.delete_messages(message_ids)
+        print(f"Cancelled {cancelled} message(s).")
+        return cancelled
+    
+    def list_recurring(self):
+        """List active recurring schedules"""
+        schedules = self.recurring_schedules()
+        if not schedules:
+            print("No recurring schedules found.")
+            return
         
-        # Store in database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        print("\n=== Recurring Schedules ===")
+        for schedule_id, recipient, message, rule, next_run in schedules:
+            print(f"[{schedule_id}] To: {recipient}")
+            print(f"Message: {message}")
+            print(f"Repeats: {rule}")
+            print(f"Next: {from_epoch_ms(next_run).strftime('%Y-%m-%d %H:%M:%S')}")
+            print("-" * 30)
+    
+    def cancel_recurring(self, schedule_id: int) -> bool:
+        """Stop a recurring schedule and remove its pending occurrence"""
+        if self.end_recurring(schedule_id):
+            print(f"Recurring schedule {schedule_id} cancelled.")
+            return True
+        print(f"No active recurring schedule {schedule_id}")
+        return False
+    
+    def show_dead_letters(self):
+        """List messages that gave up after their last retry"""
+        dead_letters = self.dead_letters()
+        if not dead_letters:
+            print("No dead letters.")
+            return
         
-        cursor.execute('''
-            INSERT INTO scheduled_messages 
-            (recipient_name, phone_number, message, scheduled_time)
-            VALUES (?, ?, ?, ?)
-        ''', (parsed['recipient'], phone_number, parsed['message'], scheduled_time))
+        print("\n=== Dead Letters ===")
+        for dead_id, recipient, message, scheduled_time, attempts, last_error, failed_at in dead_letters:
+            print(f"[{dead_id}] To: {recipient}")
+            print(f"Message: {message}")
+            print(f"Scheduled: {from_epoch_ms(scheduled_time).strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"Failed: {from_epoch_ms(failed_at).strftime('%Y-%m-%d %H:%M:%S')} after {attempts} attempt(s)")
+            print(f"Last error: {last_error or 'unknown'}")
+            print("-" * 30)
+    
+    def replay_failed_messages(self, ids: Optional[List[int]] = None) -> int:
+        """Reschedule dead letters (all, or the given ids) to be sent now"""
+        replayed = self.replay_dead_letters(ids)
+        print(f"Replayed {replayed} dead letter(s).")
+        return replayed
+    
+    def show_stats(self):
+        """Print the metrics registry (the same numbers the metrics endpoint serves)"""
+        print("\n=== Stats ===")
+        for line in self.stats_summary():
+            print(line)
+    
+    def show_rate_limits(self):
+        """Print the current token bucket levels"""
+        levels = self.rate_limit_levels()
+        if not levels:
+            print("Rate limiting is off.")
+            return
         
-        conn.commit()
-        conn.close()
+        print(f"Global: {levels['global']:.1f}/{levels['global_capacity']:g} tokens")
+        if not levels['recipients']:
+            print("Every recipient has a full budget.")
+        for phone_number, tokens in sorted(levels['recipients'].items(), key=lambda item: item[1]):
+            print(f"{phone_number}: {tokens:.1f}/{levels['recipient_capacity']:g} tokens")
+
+
+class WhatsAppScheduler(SchedulerCommands):
+    def __init__(self, db_path: str = "scheduler.db", transport: Optional[Transport] = None,
+                 workers: int = 4, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None):
+        self.db_path = db_path
+        self.transport = transport or PyWhatKitTransport()
+        self.send_pool = SendPool(self.transport, workers)
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.storage = Storage(db_path)
+        self.init_database()
+        self.contacts = ContactDirectory(self.storage)
+        register_queue_metrics(self.storage)
+        self.running = False
+        self.owner_id = new_owner_id()
+        self.dispatcher = AsyncDispatcher(self.storage, self.transport, self.owner_id, self.send_pool,
+                                          limiter=rate_limiter, retry=self.retry_policy,
+                                          has_external_changes=DataVersionWatcher(self.storage))
         
-        print(f"✅ Message scheduled!")
-        print(f"📱 To: {parsed['recipient']} ({phone_number})")
-        print(f"💬 Message: {parsed['message']}")
-        print(f"⏰ Scheduled for: {scheduled_time.strftime('%Y-%m-%d %H:%M:%S')}")
-        return True
+    def init_database(self):
+        """Initialize SQLite database for storing scheduled messages"""
+        self.storage.init_schema()
     
-    def send_whatsapp_message_alternative(self, phone_number: str, message: str) -> bool:
-        """Alternative method using instant send for more reliable sending"""
-        try:
-            # Use the instant send method from pywhatkit
-            phone_number = phone_number.replace('+', '').replace('-', '').replace(' ', '')
-            
-            if not phone_number.startswith('91') and len(phone_number) == 10:
-                phone_number = '91' + phone_number
-            
-            print(f"Using instant send to +{phone_number}")
-            
-            # Use sendwhatmsg_instantly which is more reliable
-            pwk.sendwhatmsg_instantly(f"+{phone_number}", message, 
-                                    wait_time=10,  # Wait for page load
-                                    tab_close=True,  # Close after sending
-                                    close_time=3)
-            
-            return True
-            
-        except Exception as e:
-            print(f"Alternative method failed: {e}")
-            return False
+    def save_contact(self, name: str, phone_number: str) -> str:
+        """Insert or update a contact; returns the stored E.164 number (ValueError if it is invalid)"""
+        phone_e164 = to_e164(phone_number)
+        self.storage.execute(
+            "INSERT OR REPLACE INTO contacts (name, phone_number, phone_e164) VALUES (?, ?, ?)",
+            (name.lower(), phone_e164, phone_e164)
+        )
+        self.contacts.invalidate()
+        return phone_e164
     
-    def send_whatsapp_message(self, phone_number: str, message: str) -> bool:
-        """Send WhatsApp message using pywhatkit with auto-send fix"""
-        try:
-            import pyautogui
-            import time as time_module
-            
-            # Remove '+' from phone number if present
-            phone_number = phone_number.replace('+', '').replace('-', '').replace(' ', '')
-            
-            # Add country code if not present (assuming India +91)
-            if not phone_number.startswith('91') and len(phone_number) == 10:
-                phone_number = '91' + phone_number
-            
-            # Calculate send time with proper buffer
-            now = datetime.now()
-            send_hour = now.hour
-            send_minute = now.minute + 2  # Add 2 minutes buffer for WhatsApp Web to load
-            
-            # Handle minute overflow
-            if send_minute >= 60:
-                send_minute -= 60
-                send_hour += 1
-                if send_hour >= 24:
-                    send_hour = 0
-            
-            print(f"Sending WhatsApp message to +{phone_number} at {send_hour:02d}:{send_minute:02d}")
-            
-            # Send message with proper timing - but don't close tab yet
-            pwk.sendwhatmsg(f"+{phone_number}", message, send_hour, send_minute, 
-                          wait_time=15,  # Wait 15 seconds for WhatsApp Web to load
-                          tab_close=False,  # Don't close tab yet - we need to press Enter
-                          close_time=2)
-            
-            # Wait a bit more for the message to be typed
-            time_module.sleep(3)
-            
-            # Press Enter to send the message
-            print("Pressing Enter to send the message...")
-            pyautogui.press('enter')
-            
-            # Wait a moment to confirm sending
-            time_module.sleep(2)
-            
-            # Now close the tab
-            pyautogui.hotkey('ctrl', 'w')
-            
-            print("✅ Message sent and tab closed!")
-            return True
-            
-        except Exception as e:
-            print(f"Failed to send message: {e}")
-            print("💡 Tip: Make sure WhatsApp Web is accessible and you're logged in")
-            return False
+    def remove_contact(self, name: str) -> bool:
+        """Delete a contact; False if there was none by that name"""
+        removed = self.storage.execute("DELETE FROM contacts WHERE name = ?", (name.lower(),)).rowcount
+        self.contacts.invalidate()
+        return bool(removed)
     
-    def check_and_send_messages(self):
-        """Check for pending messages and send them if it's time"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_contact_number(self, name: str) -> Optional[str]:
+        """Get the E.164 phone number for a contact name (cached in the contact directory)"""
+        return self.contacts.lookup(name)
+    
+    def list_contacts(self) -> List[tuple]:
+        """(name, phone_number) of every contact"""
+        return self.storage.query("SELECT name, phone_number FROM contacts ORDER BY name")
+    
+    def schedule(self, recipient: str, message: str, scheduled_time: Optional[datetime] = None,
+                 delay_minutes: Optional[int] = None, recurrence: Optional[str] = None) -> ScheduledMessage:
+        """Save a message for a contact, at scheduled_time, after delay_minutes or by a recurrence rule.
         
-        current_time = datetime.now()
+        Raises LookupError for an unknown contact, ValueError for a bad rule.
+        """
+        phone_number = self.get_contact_number(recipient)
+        if not phone_number:
+            raise LookupError(f"Contact '{recipient}' not found")
         
-        cursor.execute('''
-            SELECT id, recipient_name, phone_number, message 
-            FROM scheduled_messages 
-            WHERE status = 'pending' AND scheduled_time <= ?
-        ''', (current_time,))
+        if recurrence:
+            schedule_id, scheduled_time = add_recurring_schedule(
+                self.storage, recipient, phone_number, message, recurrence)
+            self.dispatcher.notify(scheduled_time.timestamp())
+            return ScheduledMessage(recipient, phone_number, message, scheduled_time,
+                                    parse_rule(recurrence).spec, schedule_id)
         
-        pending_messages = cursor.fetchall()
+        if scheduled_time is None:
+            scheduled_time = datetime.now() + timedelta(minutes=delay_minutes or 0)
         
-        for msg_id, recipient, phone_number, message in pending_messages:
-            print(f"Sending message to {recipient}: {message}")
-            
-            # Try both methods
-            success = False
-            try:
-                success = self.send_whatsapp_message_alternative(phone_number, message)
-            except:
-                success = self.send_whatsapp_message(phone_number, message)
-            
-            if success:
-                cursor.execute('''
-                    UPDATE scheduled_messages 
-                    SET status = 'sent', sent_at = ? 
-                    WHERE id = ?
-                ''', (current_time, msg_id))
-                print(f"Message sent successfully to {recipient}")
-            else:
-                cursor.execute('''
-                    UPDATE scheduled_messages 
-                    SET status = 'failed' 
-                    WHERE id = ?
-                ''', (msg_id,))
-                print(f"Failed to send message to {recipient}")
+        # Store in database
+        self.storage.execute('''
+            INSERT INTO scheduled_messages 
+            (recipient_name, phone_number, phone_e164, message, scheduled_time)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (recipient, phone_number, phone_number, message, to_epoch_ms(scheduled_time)))
         
-        conn.commit()
-        conn.close()
+        self.dispatcher.notify(scheduled_time.timestamp())
+        return ScheduledMessage(recipient, phone_number, message, scheduled_time)
+    
+    def schedule_many(self, commands: Iterable[str]) -> BatchScheduleResult:
+        """Schedule many natural language commands in one transaction.
+        
+        Parses go through a bounded LRU cache, recipients are resolved
+        through the contact directory (one query for all misses), and commands that cannot be scheduled are
+        returned as ScheduleError entries instead of prompting.
+        """
+        now = datetime.now()
+        result = BatchScheduleResult()
+        parsed_commands = []
+        
+        for line, command in enumerate(commands, 1):
+            with span('parse', chars=len(command)):
+                parsed = parse_command_cached(command)
+            if not parsed.is_complete:
+                result.errors.append(ScheduleError(line, command, "could not parse recipient, message and timing"))
+                continue
+            if parsed.recurrence:
+                try:
+                    parse_rule(parsed.recurrence)
+                except ValueError as e:
+                    result.errors.append(ScheduleError(line, command, str(e)))
+                    continue
+            # 'you' refers to the user's own number, stored as contact 'me'
+            recipient = 'me' if parsed.recipient == 'you' else parsed.recipient
+            parsed_commands.append((line, command, recipient, parsed))
+        
+        numbers = self.contacts.lookup_many(recipient for _, _, recipient, _ in parsed_commands)
+        
+        rows = []
+        recurring = []
+        for line, command, recipient, parsed in parsed_commands:
+            phone_number = numbers.get(recipient)
+            if not phone_number:
+                result.errors.append(ScheduleError(line, command, f"contact '{recipient}' not found"))
+                continue
+            if parsed.recurrence:
+                recurring.append((recipient, phone_number, parsed.message, parsed.recurrence))
+                continue
+            scheduled_time = now + timedelta(minutes=parsed.delay_minutes)
+            rows.append((recipient, phone_number, phone_number, parsed.message, to_epoch_ms(scheduled_time)))
+        
+        due_times = {row[4] / 1000 for row in rows}
+        if rows or recurring:
+            with self.storage.transaction() as cursor:
+                cursor.executemany('''
+                    INSERT INTO scheduled_messages 
+                    (recipient_name, phone_number, phone_e164, message, scheduled_time)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', rows)
+                for recipient, phone_number, message, rule in recurring:
+                    _, first = add_recurring_schedule(self.storage, recipient, phone_number, message, rule, now)
+                    due_times.add(first.timestamp())
+            for due_time in due_times:
+                self.dispatcher.notify(due_time)
+        
+        result.scheduled = len(rows) + len(recurring)
+        result.errors.sort(key=lambda error: error.line)
+        return result
+    
+    def send_whatsapp_message(self, phone_number: str, message: str) -> bool:
+        """Send a single WhatsApp message (to an E.164 number) through the send pool's lane"""
+        return self.send_pool.send(phone_number, [OutgoingMessage(phone_number, message)])[0].success
+    
+    def check_and_send_messages(self):
+        """Send every due message now, on this thread (the dispatcher does this on its own)"""
+        deliver_due_messages(self.storage, self.transport, self.owner_id, self.send_pool,
+                             on_scheduled=self.dispatcher.notify, limiter=self.rate_limiter,
+                             retry=self.retry_policy)
     
     def start_scheduler(self):
         """Start the background scheduler"""
-        def run_scheduler():
-            schedule.every(1).minutes.do(self.check_and_send_messages)
-            
-            while self.running:
-                schedule.run_pending()
-                time.sleep(1)
-        
         self.running = True
-        scheduler_thread = threading.Thread(target=run_scheduler)
-        scheduler_thread.daemon = True
-        scheduler_thread.start()
-        print("Scheduler started! Checking for messages every minute.")
+        self.dispatcher.start()
+        print("Scheduler started! Messages are sent as soon as they are due.")
     
     def stop_scheduler(self):
         """Stop the scheduler"""
         self.running = False
+        self.dispatcher.stop()
         print("Scheduler stopped.")
     
-    def list_scheduled_messages(self):
-        """List all scheduled messages"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT recipient_name, message, scheduled_time, status 
+    def send_messages_now(self, message_ids: List[int],
+                          on_results: Optional[Callable[[List[SendResult]], None]] = None
+                          ) -> Tuple[int, List[SendResult]]:
+        """Claim and send scheduled messages now; returns (skipped, results).
+        
+        Messages already being sent or sent are skipped.  on_results is
+        called with each recipient's results as they finish (e.g. for progress).
+        """
+        # Claim the rows first so the dispatcher cannot send them too
+        claimed = claim_messages(self.storage, self.owner_id, message_ids,
+                                 on_scheduled=self.dispatcher.notify)
+        results = deliver_messages(self.storage, self.transport, self.owner_id,
+                                   group_by_recipient(claimed), self.send_pool, on_results=on_results,
+                                   retry=self.retry_policy, on_scheduled=self.dispatcher.notify)
+        return len(message_ids) - len(claimed), results
+    
+    def import_file(self, kind: str, path: str) -> str:
+        """Bulk import 'contacts' or 'messages' from a CSV/JSONL file; returns the report"""
+        if kind not in ('contacts', 'messages'):
+            raise ValueError("Import kind must be 'contacts' or 'messages'")
+        importer = import_contacts if kind == 'contacts' else import_messages
+        report = importer(self.storage, path)
+        self.contacts.invalidate()
+        return str(report)
+    
+    def scheduled_messages(self, status: Optional[str] = None) -> List[tuple]:
+        """(id, recipient_name, message, scheduled_time, status) of scheduled messages, by time"""
+        if status:
+            return self.storage.query('''
+                SELECT id, recipient_name, message, scheduled_time, status
+                FROM scheduled_messages WHERE status = ?
+                ORDER BY scheduled_time
+            ''', (status,))
+        return self.storage.query('''
+            SELECT id, recipient_name, message, scheduled_time, status 
             FROM scheduled_messages 
             ORDER BY scheduled_time
         ''')
-        
-        messages = cursor.fetchall()
-        conn.close()
-        
-        if not messages:
-            print("No scheduled messages found.")
-            return
-        
-        print("\n=== Scheduled Messages ===")
-        for recipient, message, scheduled_time, status in messages:
-            print(f"To: {recipient}")
-            print(f"Message: {message}")
-            print(f"Scheduled: {scheduled_time}")
-            print(f"Status: {status}")
-            print("-" * 30)
+    
+    def delete_messages(self, message_ids: List[int]) -> int:
+        """Delete messages, ending the recurring schedules of pending occurrences; returns how many"""
+        params = [(message_id,) for message_id in message_ids]
+        with self.storage.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE recurring_schedules SET active = 0
+                WHERE id = (SELECT recurring_id FROM scheduled_messages WHERE id = ? AND status = 'pending')
+            ''', params)
+            deleted = 0
+            for param in params:
+                deleted += cursor.execute("DELETE FROM scheduled_messages WHERE id = ?", param).rowcount
+        return deleted
+    
+    def recurring_schedules(self) -> List[tuple]:
+        """(id, recipient_name, message, rule, next_run) of active recurring schedules"""
+        return list_recurring_schedules(self.storage)
+    
+    def end_recurring(self, schedule_id: int) -> bool:
+        """Stop a recurring schedule; False if it was not active"""
+        return cancel_recurring_schedule(self.storage, schedule_id)
+    
+    def dead_letters(self, limit: int = 100) -> List[tuple]:
+        """Newest dead letters, as retry.list_dead_letters returns them"""
+        return list_dead_letters(self.storage, limit)
+    
+    def replay_dead_letters(self, ids: Optional[List[int]] = None) -> int:
+        """Reschedule dead letters (all, or the given ids) to be sent now; returns how many"""
+        replayed, due_time = replay_dead_letters(self.storage, ids)
+        if due_time is not None:
+            self.dispatcher.notify(due_time)
+        return replayed
+    
+    def stats_summary(self) -> List[str]:
+        """The metrics registry as format_summary lines"""
+        return format_summary()
+    
+    def rate_limit_levels(self) -> Optional[Dict]:
+        """Current token bucket levels, or None when rate limiting is off"""
+        return self.rate_limiter.levels() if self.rate_limiter else None
+    
+    def close(self):
+        """Stop dispatching and release the transport (e.g. its browser sessions)"""
+        if self.running:
+            self.stop_scheduler()
+        self.transport.close()
+
+class RemoteScheduler(SchedulerCommands):
+    """The CLI commands carried out by a running daemon (see daemon.py), which does all sending"""
+    
+    def __init__(self, client: SchedulerClient):
+        self.client = client
+    
+    def save_contact(self, name: str, phone_number: str) -> str:
+        return self.client.add_contact(name, phone_number)
+    
+    def remove_contact(self, name: str) -> bool:
+        try:
+            return self.client.remove_contact(name)
+        except DaemonError as e:
+            if e.status == 404:
+                return False
+            raise
+    
+    def get_contact_number(self, name: str) -> Optional[str]:
+        return self.client.contact_number(name)
+    
+    def schedule(self, recipient: str, message: str, scheduled_time: Optional[datetime] = None,
+                 delay_minutes: Optional[int] = None, recurrence: Optional[str] = None) -> ScheduledMessage:
+        try:
+            scheduled = self.client.schedule(recipient, message, scheduled_time, delay_minutes, recurrence)
+        except DaemonError as e:
+            raise (LookupError if e.status == 404 else ValueError)(str(e)) from None
+        return ScheduledMessage(scheduled['recipient'], scheduled['phone_number'], scheduled['message'],
+                                from_epoch_ms(scheduled['scheduled_time']), scheduled['recurrence'],
+                                scheduled['schedule_id'])
+    
+    def schedule_many(self, commands: Iterable[str]) -> BatchScheduleResult:
+        outcome = self.client.schedule_many(list(commands))
+        return BatchScheduleResult(outcome['scheduled'], [ScheduleError(**error) for error in outcome['errors']])
+    
+    def send_whatsapp_message(self, phone_number: str, message: str) -> bool:
+        return self.client.send(phone_number, message)
+    
+    def import_file(self, kind: str, path: str) -> str:
+        # The daemon opens the file, possibly from another working directory
+        return self.client.import_file(kind, os.path.abspath(path))
+    
+    def scheduled_messages(self, status: Optional[str] = None) -> List[tuple]:
+        return [(m['id'], m['recipient'], m['message'], m['scheduled_time'], m['status'])
+                for m in self.client.messages(status)]
+    
+    def delete_messages(self, message_ids: List[int]) -> int:
+        return self.client.cancel(message_ids)
+    
+    def recurring_schedules(self) -> List[tuple]:
+        return [(s['id'], s['recipient'], s['message'], s['rule'], s['next_run'])
+                for s in self.client.recurring()]
+    
+    def end_recurring(self, schedule_id: int) -> bool:
+        return self.client.end_recurring(schedule_id)
+    
+    def dead_letters(self, limit: int = 100) -> List[tuple]:
+        return [(d['id'], d['recipient'], d['message'], d['scheduled_time'], d['attempts'], d['last_error'],
+                 d['failed_at']) for d in self.client.dead_letters(limit)]
+    
+    def replay_dead_letters(self, ids: Optional[List[int]] = None) -> int:
+        return self.client.replay(ids)
+    
+    def stats_summary(self) -> List[str]:
+        return self.client.stats()['summary']
+    
+    def rate_limit_levels(self) -> Optional[Dict]:
+        return self.client.stats()['rate_limits']
+    
+    def start_scheduler(self):
+        """Start the daemon's dispatcher"""
+        self.client.set_dispatching(True)
+        print("Daemon scheduler started! Messages are sent as soon as they are due.")
+    
+    def stop_scheduler(self):
+        """Stop the daemon's dispatcher (the daemon keeps running)"""
+        self.client.set_dispatching(False)
+        print("Daemon scheduler stopped.")
+    
+    def close(self):
+        pass
+
+
+def create_scheduler(db_path: str = "scheduler.db") -> WhatsAppScheduler:
+    """A WhatsAppScheduler configured from the WHATSAPP_SCHEDULER_* environment variables"""
+    # e.g. WHATSAPP_SCHEDULER_SEND_TIMING="file=send_timing.json,target=0.99" or "off"
+    timing = create_send_timing(os.environ.get("WHATSAPP_SCHEDULER_SEND_TIMING", DEFAULT_SEND_TIMING))
+    # e.g. WHATSAPP_SCHEDULER_TRANSPORT="fake:latency=0.5,failure_rate=0.1" for headless runs
+    transport = create_transport(os.environ.get("WHATSAPP_SCHEDULER_TRANSPORT", "pywhatkit"), timing)
+    workers = int(os.environ.get("WHATSAPP_SCHEDULER_WORKERS", "4"))
+    # e.g. WHATSAPP_SCHEDULER_RATE_LIMIT="global=30,burst=10,recipient=6" or "off"
+    rate_limiter = create_rate_limiter(os.environ.get("WHATSAPP_SCHEDULER_RATE_LIMIT", DEFAULT_RATE_LIMIT))
+    # e.g. WHATSAPP_SCHEDULER_RETRY="max_attempts=5,base_delay=30,max_delay=3600"
+    retry_policy = create_retry_policy(os.environ.get("WHATSAPP_SCHEDULER_RETRY", ""))
+    scheduler = WhatsAppScheduler(db_path, transport=transport, workers=workers, rate_limiter=rate_limiter,
+                                  retry_policy=retry_policy)
+    metrics_port = os.environ.get("WHATSAPP_SCHEDULER_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+        print(f"Metrics at http://127.0.0.1:{metrics_port}/metrics")
+    return scheduler
 
 def main():
-    scheduler = WhatsAppScheduler()
+    client = connect_to_daemon()
+    if client:
+        scheduler = RemoteScheduler(client)
+        print(f"Connected to the scheduler daemon at {client.address}; it sends the messages.")
+    else:
+        scheduler = create_scheduler()
     
     print("WhatsApp Message Scheduler AI Agent")
     print("====================================")
@@ -377,7 +613,16 @@ def main():
     print("4. 'list' - List scheduled messages")
     print("5. 'start' - Start the scheduler")
     print("6. 'stop' - Stop the scheduler")
-    print("7. 'quit' - Exit the program")
+    print("7. 'import contacts|messages <file>' - Bulk import from CSV or JSONL")
+    print("8. 'schedule file <file>' - Schedule one command per line")
+    print("9. 'recurring' - List recurring schedules")
+    print("10. 'cancel recurring <id>' - Stop a recurring schedule")
+    print("11. 'limits' - Show rate limit budgets")
+    print("12. 'dead letters' - List messages that failed every retry")
+    print("13. 'replay dead letters [<id> ...]' - Resend them (all by default)")
+    print("14. 'stats' - Show queue, latency and failure metrics")
+    print("15. 'cancel <id> [<id> ...]' - Cancel scheduled messages (ids from 'list')")
+    print("16. 'quit' - Exit the program")
     print()
     
     while True:
@@ -385,7 +630,6 @@ def main():
             user_input = input("Enter command: ").strip()
             
             if user_input.lower() == 'quit':
-                scheduler.stop_scheduler()
                 break
             
             elif user_input.lower().startswith('add contact'):
@@ -397,31 +641,68 @@ def main():
                 else:
                     print("Usage: add contact <n> <phone>")
             
+            elif user_input.lower().startswith('import '):
+                parts = user_input.split(maxsplit=2)
+                if len(parts) == 3 and parts[1].lower() in ('contacts', 'messages'):
+                    scheduler.import_records(parts[1].lower(), parts[2])
+                else:
+                    print("Usage: import contacts|messages <file.csv|file.jsonl>")
+            
             elif user_input.lower().startswith('send now'):
                 # Extract contact and message for immediate sending
                 parts = user_input[8:].strip().split('"')
                 if len(parts) >= 2:
-                    contact = parts[0].strip()
-                    message = parts[1]
-                    phone_number = scheduler.get_contact_number(contact)
-                    if phone_number:
-                        print(f"Sending immediate message to {contact}...")
-                        if scheduler.send_whatsapp_message_alternative(phone_number, message):
-                            print(f"✅ Message sent to {contact}")
-                        else:
-                            print(f"❌ Failed to send message to {contact}")
-                    else:
-                        print(f"Contact '{contact}' not found")
+                    scheduler.send_now(parts[0].strip(), parts[1])
                 else:
                     print("Usage: send now <contact> \"<message>\"")
             
+            elif user_input.lower().startswith('schedule file '):
+                with open(user_input[len('schedule file '):].strip(), encoding='utf-8') as f:
+                    result = scheduler.schedule_many(line for line in f if line.strip())
+                print(f"✅ Scheduled {result.scheduled} message(s), {len(result.errors)} failed")
+                for error in result.errors:
+                    print(f"❌ Line {error.line}: {error.reason} ({error.command.strip()})")
+            
             elif user_input.lower().startswith('schedule'):
                 message_text = user_input[8:].strip()  # Remove 'schedule' prefix
-                scheduler.schedule_message(message_text)
+                scheduler.schedule_message(message_text, ask=input)
             
             elif user_input.lower() == 'list':
                 scheduler.list_scheduled_messages()
             
+            elif user_input.lower() == 'recurring':
+                scheduler.list_recurring()
+            
+            elif user_input.lower().startswith('cancel recurring'):
+                schedule_id = user_input[len('cancel recurring'):].strip()
+                if schedule_id.isdigit():
+                    scheduler.cancel_recurring(int(schedule_id))
+                else:
+                    print("Usage: cancel recurring <id>")
+            
+            elif user_input.lower().startswith('cancel'):
+                ids = user_input[len('cancel'):].split()
+                if ids and all(message_id.isdigit() for message_id in ids):
+                    scheduler.cancel_messages([int(message_id) for message_id in ids])
+                else:
+                    print("Usage: cancel <id> [<id> ...]")
+            
+            elif user_input.lower() == 'dead letters':
+                scheduler.show_dead_letters()
+            
+            elif user_input.lower().startswith('replay dead letters'):
+                ids = user_input[len('replay dead letters'):].split()
+                if all(dead_id.isdigit() for dead_id in ids):
+                    scheduler.replay_failed_messages([int(dead_id) for dead_id in ids] or None)
+                else:
+                    print("Usage: replay dead letters [<id> ...]")
+            
+            elif user_input.lower() == 'stats':
+                scheduler.show_stats()
+            
+            elif user_input.lower() == 'limits':
+                scheduler.show_rate_limits()
+            
             elif user_input.lower() == 'start':
                 scheduler.start_scheduler()
             
@@ -433,10 +714,11 @@ def main():
         
         except KeyboardInterrupt:
             print("\nExiting...")
-            scheduler.stop_scheduler()
             break
         except Exception as e:
             print(f"Error: {e}")
+    
+    scheduler.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_entry_point(main, "WhatsApp Message Scheduler (CLI)", "main.prof")
\ No newline at end of file
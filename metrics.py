@@ -0,0 +1,308 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Metrics are kept in-process and exposed in the Prometheus text format:
+#
+#   WHATSAPP_SCHEDULER_METRICS_PORT=9464 python main.py
+#   curl http://127.0.0.1:9464/metrics
+#
+# The CLI 'stats' command and the GUI Stats tab read the same registry.
+
+LabelValues = Tuple[str, ...]
+
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+SEND_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+LAG_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 21600.0, 86400.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Base class: a named metric with optional labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    """Current value, either set directly or read from collect() when rendered.
+
+    collect returns {label values: value}; it runs on the scraping thread.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def values(self) -> Dict[LabelValues, float]:
+        if self.collect:
+            return dict(self.collect())
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class HistogramSeries:
+    """Bucket counts, sum and count of one label combination"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def quantile(self, q: float, buckets: Sequence[float]) -> float:
+        """Estimate of the q-quantile, interpolated within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                low = buckets[index - 1] if index else 0.0
+                if index == len(buckets):
+                    return low  # beyond the last bucket
+                return low + (buckets[index] - low) * (rank - seen) / count
+            seen += count
+        return buckets[-1]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed upper-bound buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, HistogramSeries] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = HistogramSeries(self.buckets)
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the with block, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def series(self) -> Dict[LabelValues, HistogramSeries]:
+        """A copy of every label combination's series"""
+        with self._lock:
+            copies = {}
+            for key, series in self._series.items():
+                copy = HistogramSeries(self.buckets)
+                copy.counts, copy.sum, copy.count = list(series.counts), series.sum, series.count
+                copies[key] = copy
+            return copies
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, series in sorted(self.series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of this process.
+
+    counter(), gauge() and histogram() return the existing metric when the
+    name is already registered, so modules can declare what they record
+    at import time.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+              collect: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        gauge = self._register(Gauge, name, help_text, labelnames)
+        if collect:
+            gauge.collect = collect
+        return gauge
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames, buckets)
+
+    def metrics(self) -> List[Metric]:
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for metric in self.metrics():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # e.g. a gauge whose database query failed; skip it
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _label_text(labelnames: Sequence[str], key: LabelValues) -> str:
+    return " ".join(f"{name}={value}" for name, value in zip(labelnames, key))
+
+
+def format_summary(registry: MetricsRegistry = REGISTRY) -> List[str]:
+    """Human-readable lines for the CLI 'stats' command and the GUI Stats tab"""
+    lines: List[str] = []
+    for metric in registry.metrics():
+        title = metric.name.replace('whatsapp_scheduler_', '')
+        try:
+            if isinstance(metric, Histogram):
+                for key, series in sorted(metric.series().items()):
+                    if not series.count:
+                        continue
+                    lines.append(
+                        f"{title} {_label_text(metric.labelnames, key)}".rstrip()
+                        + f": n={series.count} avg={series.sum / series.count:.4g}"
+                        + f" p50={series.quantile(0.5, metric.buckets):.4g}"
+                        + f" p95={series.quantile(0.95, metric.buckets):.4g}")
+            else:
+                for key, value in sorted(metric.values().items()):
+                    lines.append(f"{title} {_label_text(metric.labelnames, key)}".rstrip()
+                                 + f": {_format_value(value)}")
+        except Exception as e:
+            lines.append(f"{title}: unavailable ({e})")
+    return lines
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+    # Scrapes are served one at a time; a stalled client cannot hold the server.
+    timeout = 10
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a line on the console
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1",
+                         registry: MetricsRegistry = REGISTRY) -> HTTPServer:
+    """Serve registry at http://host:port/metrics from a daemon thread.
+
+    Scrapes all run on that one thread, so gauges that query the database
+    (see dispatcher.register_queue_metrics) reuse a single connection.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = HTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,164 @@
+import re
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Dict, Optional
+
+from metrics import REGISTRY
+
+_UNIT_MINUTES = {'minute': 1, 'min': 1, 'hour': 60, 'hr': 60, 'day': 24 * 60}
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Time of day used when a weekly recurrence gives none ("every monday").
+DEFAULT_RECURRENCE_TIME = (9, 0)
+
+# One alternation, compiled once.  Earlier alternatives win at the same
+# position, so a verb followed by a name beats a bare word.
+_TOKEN = re.compile(r'''
+    (?P<quote>["'])(?P<quoted>.+?)(?P=quote)
+  | \b(?:in|after)\s+(?P<amount>\d+)\s*(?P<unit>minute|min|hour|hr|day)s?\b
+  | \b(?P<recurrence>
+        (?:every\s+(?:(?P<every_amount>\d+)\s*)?
+           (?P<every_unit>minute|min|hour|hr|day|weekday|week|monday|tuesday|wednesday|thursday|friday|saturday|sunday)s?
+         | (?P<every_keyword>daily|weekdays))
+        (?:\s+at\s+(?P<at_hour>\d{1,2})(?::(?P<at_minute>\d{2}))?\s*(?P<at_ampm>am|pm)?)?)\b
+  | (?P<tomorrow>\btomorrow\b)
+  | \b(?:to|send|message|remind)\s+(?P<name>[a-z]+)
+  | \b(?P<intro>saying|asking|about|that|message)\s+
+  | (?P<word>[a-z]+)
+''', re.IGNORECASE | re.VERBOSE)
+
+
+# Number of distinct normalized commands kept by parse_command_cached.
+PARSE_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class ParsedCommand:
+    """Scheduling information extracted from a natural language command"""
+    recipient: Optional[str] = None
+    message: Optional[str] = None
+    delay_minutes: Optional[int] = None
+    # Recurrence rule in recurrence.parse_rule syntax, e.g. 'daily at 09:00'
+    recurrence: Optional[str] = None
+
+    @property
+    def is_complete(self) -> bool:
+        return bool(self.recipient and self.message and (self.delay_minutes or self.recurrence))
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _recurrence_rule(match) -> Optional[str]:
+    """Translate a matched recurrence phrase into a recurrence rule"""
+    unit = (match.group('every_unit') or match.group('every_keyword')).lower()
+    amount = int(match.group('every_amount') or 1)
+
+    at = None
+    if match.group('at_hour'):
+        hour, minute = int(match.group('at_hour')), int(match.group('at_minute') or 0)
+        ampm = (match.group('at_ampm') or '').lower()
+        if ampm:
+            hour = hour % 12 + (12 if ampm == 'pm' else 0)
+        if hour > 23 or minute > 59:
+            return None
+        at = f"{hour:02d}:{minute:02d}"
+
+    if unit in ('minute', 'min'):
+        return f"every {amount} minutes"
+    if unit in ('hour', 'hr'):
+        return f"every {amount} hours"
+    if unit in ('day', 'daily', 'week'):
+        if unit != 'week' and amount == 1 and at:
+            return f"daily at {at}"
+        days = amount * (7 if unit == 'week' else 1)
+        return f"every {days} days at {at}" if at else f"every {days} days"
+
+    at = at or "%02d:%02d" % DEFAULT_RECURRENCE_TIME
+    if unit in ('weekday', 'weekdays'):
+        return f"weekdays at {at}"
+    return f"weekly on {unit[:3]} at {at}"
+
+
+def parse_command(text: str) -> ParsedCommand:
+    """Extract recipient, message and delay or recurrence from text in a single tokenizing pass.
+
+    Examples: 'Send john "meeting at 3pm" in 2 hours',
+    'Message sarah "happy birthday" tomorrow', 'remind alex about the call after 30 minutes',
+    'Send mom "take your pills" every day at 9pm'.
+    """
+    recipient = message = delay_minutes = recurrence = None
+    first_word = word_before_quote = None
+    last_word = None
+    intro_end = None
+    delay_start = None
+
+    for match in _TOKEN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'quoted':
+            if message is None:
+                message = match.group('quoted').strip()
+                word_before_quote = last_word
+        elif kind == 'unit':
+            if delay_minutes is None:
+                delay_minutes = int(match.group('amount')) * _UNIT_MINUTES[match.group('unit').lower()]
+                delay_start = match.start()
+        elif kind == 'tomorrow':
+            if delay_minutes is None:
+                delay_minutes = 24 * 60
+                delay_start = match.start()
+        elif kind == 'recurrence':
+            if recurrence is None:
+                recurrence = _recurrence_rule(match)
+                if delay_start is None:
+                    delay_start = match.start()
+        elif kind == 'name':
+            if recipient is None:
+                recipient = match.group('name').lower()
+            last_word = match.group('name')
+        elif kind == 'intro':
+            if intro_end is None:
+                intro_end = match.end()
+        else:
+            last_word = match.group('word')
+            if first_word is None:
+                first_word = last_word
+
+    if recipient is None:
+        fallback = word_before_quote or first_word
+        recipient = fallback.lower() if fallback else None
+
+    if message is None and intro_end is not None:
+        end = delay_start if delay_start is not None and delay_start > intro_end else len(text)
+        message = text[intro_end:end].strip() or None
+
+    return ParsedCommand(recipient, message, delay_minutes, recurrence)
+
+
+def normalize_command(text: str) -> str:
+    """Collapse whitespace so near-identical commands share a cache entry"""
+    return ' '.join(text.split())
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_normalized(text: str) -> ParsedCommand:
+    return parse_command(text)
+
+
+def parse_command_cached(text: str) -> ParsedCommand:
+    """parse_command with a bounded LRU cache keyed on the normalized text"""
+    return _parse_normalized(normalize_command(text))
+
+
+def parse_cache_info():
+    """Hit/miss statistics of parse_command_cached"""
+    return _parse_normalized.cache_info()
+
+
+def _parse_cache_counts() -> Dict:
+    info = parse_cache_info()
+    return {('hit',): info.hits, ('miss',): info.misses}
+
+
+REGISTRY.gauge('whatsapp_scheduler_parse_cache_lookups', 'Batch scheduling parse cache lookups by result',
+               ('result',), collect=_parse_cache_counts)
@@ -0,0 +1,47 @@
+import os
+import re
+from typing import Optional
+
+# Country calling code added to numbers entered without one; override with
+# the WHATSAPP_SCHEDULER_COUNTRY_CODE environment variable (e.g. "44").
+DEFAULT_COUNTRY_CODE = os.environ.get("WHATSAPP_SCHEDULER_COUNTRY_CODE", "91")
+
+# Length of a national number (without trunk prefix) in the default country.
+NATIONAL_NUMBER_LENGTH = 10
+
+_FORMATTING = re.compile(r'[\s().\-/]')
+
+
+def to_e164(phone_number: str, country_code: Optional[str] = None) -> str:
+    """Canonical E.164 form (+<country code><number>) of a phone number as typed.
+
+    Accepts '+44 20 7946 0018', '0044...', '098765 43210' (trunk prefix)
+    and bare national numbers, which get country_code (default
+    DEFAULT_COUNTRY_CODE).  Raises ValueError if the result is not a
+    plausible E.164 number.
+    """
+    country_code = (country_code or DEFAULT_COUNTRY_CODE).lstrip('+')
+    number = _FORMATTING.sub('', str(phone_number))
+
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        digits = number[2:]
+    elif number.startswith('0') and len(number) == NATIONAL_NUMBER_LENGTH + 1:
+        digits = country_code + number[1:]
+    elif len(number) == NATIONAL_NUMBER_LENGTH:
+        digits = country_code + number
+    else:
+        digits = number  # already includes the country code
+
+    if not digits.isdigit() or not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        raise ValueError(f"invalid phone number '{phone_number}'")
+    return '+' + digits
+
+
+def to_e164_or_none(phone_number: str, country_code: Optional[str] = None) -> Optional[str]:
+    """to_e164, returning None instead of raising for invalid numbers"""
+    try:
+        return to_e164(phone_number, country_code)
+    except ValueError:
+        return None
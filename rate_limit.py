@@ -0,0 +1,151 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from transport import OutgoingMessage
+
+# Rate limiting is opt-in, as it changes when a backlog goes out; e.g.
+# "global=20,burst=5,recipient=6,recipient_burst=3" allows 20 messages a
+# minute in bursts of up to 5, and 6 a minute (bursts of 3) to any one
+# recipient.
+DEFAULT_RATE_LIMIT = "off"
+
+# Recipient buckets are forgotten once full (a new bucket starts full), as
+# soon as more than this many are tracked.
+MAX_TRACKED_RECIPIENTS = 1024
+
+
+class TokenBucket:
+    """Holds up to capacity tokens, refilled continuously at rate_per_minute.
+
+    Not thread-safe on its own; RateLimiter serializes access.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def level(self) -> float:
+        """Tokens currently available"""
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._tokens
+
+    def take(self, tokens: float = 1.0):
+        self.level()
+        self._tokens -= tokens
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` tokens are available"""
+        missing = tokens - self.level()
+        return max(0.0, missing / self.rate) if self.rate else float('inf')
+
+
+class RateLimiter:
+    """Global and per-recipient send budgets for the dispatch pipeline.
+
+    Every message needs a token from the global bucket and from its
+    recipient's bucket.  Messages over budget are returned with the number
+    of seconds to defer them by, rather than being sent.
+    """
+
+    def __init__(self, global_per_minute: float = 20, global_burst: float = 5,
+                 recipient_per_minute: float = 6, recipient_burst: float = 3,
+                 clock: Callable[[], float] = time.monotonic):
+        self.recipient_per_minute = recipient_per_minute
+        self.recipient_burst = recipient_burst
+        self._clock = clock
+        self._global = TokenBucket(global_per_minute, global_burst, clock)
+        self._recipients: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> int:
+        """Messages the global budget allows right now"""
+        with self._lock:
+            return int(self._global.level())
+
+    def global_wait_time(self) -> float:
+        """Seconds until the global budget allows one more message"""
+        with self._lock:
+            return self._global.wait_time()
+
+    def admit(self, batches: List[List[OutgoingMessage]]
+              ) -> Tuple[List[List[OutgoingMessage]], List[Tuple[OutgoingMessage, float]]]:
+        """Take tokens for the messages that fit the budgets.
+
+        Returns the admitted batches and (message, seconds to defer) for
+        the rest.  Later messages to a throttled recipient are spread out
+        by one refill interval each.
+        """
+        admitted: List[List[OutgoingMessage]] = []
+        deferred: List[Tuple[OutgoingMessage, float]] = []
+        with self._lock:
+            global_backlog = 0
+            for batch in batches:
+                bucket = self._bucket(batch[0].phone_number)
+                sendable: List[OutgoingMessage] = []
+                backlog = 0
+                for message in batch:
+                    # Once one message to a recipient is deferred, later ones stay behind it.
+                    if not backlog and bucket.level() >= 1 and self._global.level() >= 1:
+                        bucket.take()
+                        self._global.take()
+                        sendable.append(message)
+                        continue
+                    backlog += 1
+                    global_backlog += 1
+                    wait = max(bucket.wait_time(backlog), self._global.wait_time(global_backlog))
+                    deferred.append((message, wait))
+                if sendable:
+                    admitted.append(sendable)
+            self._prune()
+        return admitted, deferred
+
+    def levels(self) -> Dict:
+        """Current bucket levels: global, and every recipient whose bucket is not full"""
+        with self._lock:
+            recipients = {phone: round(bucket.level(), 2) for phone, bucket in self._recipients.items()
+                          if bucket.level() < bucket.capacity}
+            return {
+                'global': round(self._global.level(), 2),
+                'global_capacity': self._global.capacity,
+                'recipients': recipients,
+                'recipient_capacity': self.recipient_burst,
+            }
+
+    def _bucket(self, phone_number: str) -> TokenBucket:
+        bucket = self._recipients.get(phone_number)
+        if bucket is None:
+            bucket = TokenBucket(self.recipient_per_minute, self.recipient_burst, self._clock)
+            self._recipients[phone_number] = bucket
+        return bucket
+
+    def _prune(self):
+        if len(self._recipients) > MAX_TRACKED_RECIPIENTS:
+            self._recipients = {phone: bucket for phone, bucket in self._recipients.items()
+                                if bucket.level() < bucket.capacity}
+
+
+def create_rate_limiter(spec: str) -> Optional[RateLimiter]:
+    """Build a rate limiter from a spec such as 'global=20,burst=5,recipient=6,recipient_burst=3'.
+
+    'off' (or an empty spec) disables rate limiting.
+    """
+    spec = spec.strip()
+    if spec in ('', 'off', 'none'):
+        return None
+
+    names = {'global': 'global_per_minute', 'burst': 'global_burst',
+             'recipient': 'recipient_per_minute', 'recipient_burst': 'recipient_burst'}
+    options = {}
+    for option in spec.split(','):
+        key, _, value = option.partition('=')
+        if key.strip() not in names:
+            raise ValueError(f"Unknown rate limit option '{key.strip()}' (choose from {', '.join(names)})")
+        options[names[key.strip()]] = float(value)
+    return RateLimiter(**options)
@@ -0,0 +1,240 @@
+import re
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+
+from storage import Storage, from_epoch_ms, now_ms, to_epoch_ms
+
+# Recurrence rules are stored as text in recurring_schedules.rule:
+#
+#   every 30 minutes | every 2 hours | every 3 days [at 09:00] | every 2 weeks [at 09:00]
+#   daily at 09:00 | weekdays at 09:00 | weekly on mon,thu at 18:30
+#   cron 0 9 * * 1-5            (minute hour day-of-month month day-of-week)
+
+_UNIT_MINUTES = {'minute': 1, 'hour': 60, 'day': 24 * 60, 'week': 7 * 24 * 60}
+_DAY_NAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+_INTERVAL = re.compile(r'every\s+(\d+)\s+(minute|hour|day|week)s?(?:\s+at\s+(\d{1,2}):(\d{2}))?$')
+_AT_TIME = re.compile(r'(daily|weekdays)\s+at\s+(\d{1,2}):(\d{2})$')
+_WEEKLY = re.compile(r'weekly\s+on\s+([a-z,\s]+?)\s+at\s+(\d{1,2}):(\d{2})$')
+
+# A cron rule that never matches (e.g. 30 February) is rejected after
+# searching this many days ahead.
+MAX_SEARCH_DAYS = 5 * 366
+
+
+def _check_time(hour: str, minute: str) -> Tuple[int, int]:
+    hour, minute = int(hour), int(minute)
+    if hour > 23 or minute > 59:
+        raise ValueError(f"invalid time {hour}:{minute:02d}")
+    return hour, minute
+
+
+@dataclass(frozen=True)
+class IntervalRule:
+    """Fires every `minutes`, optionally starting at a time of day"""
+    spec: str
+    minutes: int
+    at: Optional[Tuple[int, int]] = None
+
+    def next_fire(self, after: datetime, previous: Optional[datetime] = None) -> datetime:
+        """First fire time strictly after `after`, continuing from the previous occurrence"""
+        step = timedelta(minutes=self.minutes)
+        if previous is None:
+            if self.at is None:
+                return after.replace(second=0, microsecond=0) + step
+            first = after.replace(hour=self.at[0], minute=self.at[1], second=0, microsecond=0)
+            return first if first > after else first + timedelta(days=1)
+
+        # Skip occurrences that were missed (e.g. while the machine was off).
+        if previous > after:
+            return previous + step
+        missed = (after - previous) // step
+        return previous + (missed + 1) * step
+
+
+def _cron_field(field: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in field.split(','):
+        value_range, _, step = part.partition('/')
+        if value_range == '*':
+            start, end = low, high
+        elif '-' in value_range:
+            start, end = (int(v) for v in value_range.split('-', 1))
+        else:
+            start = end = int(value_range)
+            if step:
+                end = high
+        if not low <= start <= end <= high:
+            raise ValueError(f"cron field '{field}' is outside {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return frozenset(values)
+
+
+@dataclass(frozen=True)
+class CronRule:
+    """Fires at every minute matching a five-field cron expression"""
+    spec: str
+    minutes: FrozenSet[int]
+    hours: FrozenSet[int]
+    days: FrozenSet[int]
+    months: FrozenSet[int]
+    weekdays: FrozenSet[int]  # 0 = Sunday
+    any_day: bool
+    any_weekday: bool
+
+    @classmethod
+    def parse(cls, spec: str, expression: str) -> 'CronRule':
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression '{expression}' needs 5 fields")
+        minute, hour, day, month, weekday = fields
+        weekdays = frozenset(d % 7 for d in _cron_field(weekday, 0, 7))
+        return cls(spec, _cron_field(minute, 0, 59), _cron_field(hour, 0, 23),
+                   _cron_field(day, 1, 31), _cron_field(month, 1, 12), weekdays,
+                   day == '*', weekday == '*')
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays
+        # As in cron: when both are restricted, either may match.
+        if not self.any_day and not self.any_weekday:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_fire(self, after: datetime, previous: Optional[datetime] = None) -> datetime:
+        """First matching minute strictly after `after`; walks days, not minutes"""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        hours, minutes = sorted(self.hours), sorted(self.minutes)
+
+        for _ in range(MAX_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in hours:
+                    for minute in minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"'{self.spec}' never fires")
+
+
+@lru_cache(maxsize=256)
+def parse_rule(spec: str):
+    """Parse a recurrence rule (see the grammar above); raises ValueError if invalid"""
+    spec = ' '.join(spec.lower().split())
+
+    match = _INTERVAL.match(spec)
+    if match:
+        amount, unit, hour, minute = match.groups()
+        if int(amount) < 1:
+            raise ValueError("the interval must be at least 1")
+        at = _check_time(hour, minute) if hour else None
+        if at and unit in ('minute', 'hour'):
+            raise ValueError("'at' only applies to day and week intervals")
+        return IntervalRule(spec, int(amount) * _UNIT_MINUTES[unit], at)
+
+    match = _AT_TIME.match(spec)
+    if match:
+        kind, hour, minute = match.groups()
+        hour, minute = _check_time(hour, minute)
+        return CronRule.parse(spec, f"{minute} {hour} * * {'*' if kind == 'daily' else '1-5'}")
+
+    match = _WEEKLY.match(spec)
+    if match:
+        names, hour, minute = match.groups()
+        hour, minute = _check_time(hour, minute)
+        try:
+            days = sorted({_DAY_NAMES.index(name.strip()[:3]) for name in names.split(',')})
+        except ValueError:
+            raise ValueError(f"unknown day in '{names}'")
+        return CronRule.parse(spec, f"{minute} {hour} * * {','.join(map(str, days))}")
+
+    if spec.startswith('cron '):
+        return CronRule.parse(spec, spec[5:])
+
+    raise ValueError(f"unrecognized recurrence '{spec}'")
+
+
+def add_recurring_schedule(storage: Storage, recipient_name: str, phone_e164: str, message: str,
+                           rule: str, now: Optional[datetime] = None) -> Tuple[int, datetime]:
+    """Store a recurring schedule and materialize its first occurrence.
+
+    Returns the schedule id and the first fire time.
+    """
+    spec = parse_rule(rule).spec
+    first = parse_rule(spec).next_fire(now or datetime.now())
+    with storage.transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO recurring_schedules (recipient_name, phone_number, message, rule, next_run)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (recipient_name, phone_e164, message, spec, to_epoch_ms(first)))
+        schedule_id = cursor.lastrowid
+        _insert_occurrence(cursor, schedule_id, recipient_name, phone_e164, message, to_epoch_ms(first))
+    return schedule_id, first
+
+
+def _insert_occurrence(cursor: sqlite3.Cursor, schedule_id: int, recipient_name: str,
+                       phone_e164: str, message: str, scheduled_time: int):
+    cursor.execute('''
+        INSERT INTO scheduled_messages
+        (recipient_name, phone_number, phone_e164, message, scheduled_time, recurring_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (recipient_name, phone_e164, phone_e164, message, scheduled_time, schedule_id))
+
+
+def materialize_next_occurrences(cursor: sqlite3.Cursor,
+                                 occurrences: List[Tuple[int, int]]) -> List[int]:
+    """Insert the next occurrence of each schedule whose occurrence was just claimed.
+
+    occurrences are (recurring_id, scheduled_time) pairs; run inside the
+    claiming transaction.  A schedule that is inactive, or already has a
+    later pending occurrence, is skipped.  Returns the new scheduled times (ms).
+    """
+    scheduled = []
+    now = now_ms()
+    for schedule_id, scheduled_time in occurrences:
+        schedule = cursor.execute('''
+            SELECT recipient_name, phone_number, message, rule FROM recurring_schedules
+            WHERE id = ? AND active = 1
+        ''', (schedule_id,)).fetchone()
+        if not schedule:
+            continue
+        # A later occurrence already exists (this one was deferred or retried).
+        if cursor.execute('''
+            SELECT 1 FROM scheduled_messages
+            WHERE recurring_id = ? AND status = 'pending' AND scheduled_time > ? LIMIT 1
+        ''', (schedule_id, scheduled_time)).fetchone():
+            continue
+
+        recipient_name, phone_e164, message, rule = schedule
+        next_fire = to_epoch_ms(parse_rule(rule).next_fire(
+            from_epoch_ms(max(now, scheduled_time)), previous=from_epoch_ms(scheduled_time)))
+        _insert_occurrence(cursor, schedule_id, recipient_name, phone_e164, message, next_fire)
+        cursor.execute("UPDATE recurring_schedules SET next_run = ? WHERE id = ?", (next_fire, schedule_id))
+        scheduled.append(next_fire)
+    return scheduled
+
+
+def cancel_recurring_schedule(storage: Storage, schedule_id: int) -> bool:
+    """Stop a recurring schedule and delete its pending occurrence"""
+    with storage.transaction() as cursor:
+        cursor.execute("UPDATE recurring_schedules SET active = 0 WHERE id = ? AND active = 1", (schedule_id,))
+        if not cursor.rowcount:
+            return False
+        cursor.execute('''
+            DELETE FROM scheduled_messages WHERE recurring_id = ? AND status = 'pending'
+        ''', (schedule_id,))
+    return True
+
+
+def list_recurring_schedules(storage: Storage) -> List[tuple]:
+    """(id, recipient_name, message, rule, next_run) of every active schedule"""
+    return storage.query('''
+        SELECT id, recipient_name, message, rule, next_run FROM recurring_schedules
+        WHERE active = 1 ORDER BY next_run
+    ''')
@@ -0,0 +1,91 @@
+import json
+import random
+import sqlite3
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from storage import Storage, now_ms
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with jitter for messages whose delivery failed.
+
+    The delay before attempt n + 1 is base_delay * 2 ** (n - 1), capped at
+    max_delay, of which the second half is random ("equal jitter") so
+    messages that failed together do not all retry together.  After
+    max_attempts failed attempts a message moves to the dead-letter table.
+    """
+    max_attempts: int = 5
+    base_delay: float = 30.0
+    max_delay: float = 3600.0
+    rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    def delay(self, attempts: int) -> float:
+        """Seconds to wait after the given number of failed attempts"""
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return backoff / 2 + self.rng.uniform(0, backoff / 2)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def create_retry_policy(spec: str) -> RetryPolicy:
+    """Build a retry policy from a spec such as 'max_attempts=5,base_delay=30,max_delay=3600'"""
+    options = {}
+    for option in filter(None, spec.split(',')):
+        key, _, value = option.partition('=')
+        key = key.strip()
+        if key not in ('max_attempts', 'base_delay', 'max_delay'):
+            raise ValueError(f"Unknown retry option '{key}' (choose from max_attempts, base_delay, max_delay)")
+        options[key] = int(value) if key == 'max_attempts' else float(value)
+    return RetryPolicy(**options)
+
+
+def move_to_dead_letters(cursor: sqlite3.Cursor, message_ids: List[int]):
+    """Move messages (with their attempt count and last error) to dead_letters; run in a transaction"""
+    failed_at = now_ms()
+    for message_id in message_ids:
+        cursor.execute('''
+            INSERT INTO dead_letters
+            (message_id, recipient_name, phone_number, phone_e164, message, scheduled_time,
+             attempts, last_error, failed_at)
+            SELECT id, recipient_name, phone_number, phone_e164, message, scheduled_time,
+                   attempts, last_error, ?
+            FROM scheduled_messages WHERE id = ?
+        ''', (failed_at, message_id))
+        cursor.execute("DELETE FROM scheduled_messages WHERE id = ?", (message_id,))
+
+
+def list_dead_letters(storage: Storage, limit: int = 100) -> List[tuple]:
+    """(id, recipient_name, message, scheduled_time, attempts, last_error, failed_at), newest first"""
+    return storage.query('''
+        SELECT id, recipient_name, message, scheduled_time, attempts, last_error, failed_at
+        FROM dead_letters ORDER BY failed_at DESC, id DESC LIMIT ?
+    ''', (limit,))
+
+
+def count_dead_letters(storage: Storage) -> int:
+    """Number of messages in the dead-letter table"""
+    return storage.query_one("SELECT COUNT(*) FROM dead_letters")[0]
+
+
+def replay_dead_letters(storage: Storage, ids: Optional[List[int]] = None) -> Tuple[int, Optional[float]]:
+    """Reschedule dead letters (all of them without ids) as new pending messages, due now.
+
+    Replayed messages start again with no attempts.  Returns how many were
+    replayed and their due time (epoch seconds), or None if there were none.
+    """
+    due = now_ms()
+    selection = "" if ids is None else "WHERE id IN (SELECT value FROM json_each(?))"
+    params = () if ids is None else (json.dumps([int(message_id) for message_id in ids]),)
+    with storage.transaction() as cursor:
+        cursor.execute(f'''
+            INSERT INTO scheduled_messages (recipient_name, phone_number, phone_e164, message, scheduled_time)
+            SELECT recipient_name, phone_number, phone_e164, message, ?
+            FROM dead_letters {selection} ORDER BY scheduled_time, id
+        ''', (due, *params))
+        replayed = cursor.rowcount
+        cursor.execute(f"DELETE FROM dead_letters {selection}", params)
+    return replayed, (due / 1000 if replayed else None)
+
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from metrics import REGISTRY
+
+# Waits in the send path (seconds): (default, minimum, maximum).
+# page_load / scheduled_page_load are pywhatkit's wait_time, which must stay
+# above the 4 s pywhatkit itself sleeps before focusing the page.
+PHASES = {
+    'page_load': (10.0, 5.0, 30.0),            # instant send: open chat until typing
+    'scheduled_page_load': (15.0, 5.0, 45.0),  # booked send: open chat until typing
+    'typed_wait': (3.0, 0.5, 9.0),             # booked send: text typed -> press Enter
+    'confirm_wait': (2.0, 0.5, 6.0),           # booked send: Enter -> close the tab
+    'message_gap': (1.0, 0.2, 3.0),            # between messages in one open chat
+    'chat_switch': (4.0, 1.0, 15.0),           # pooled session: load another chat in the tab
+}
+
+# Learned waits are kept in file between runs.  Override with e.g.
+# WHATSAPP_SCHEDULER_SEND_TIMING="file=timings.json,target=0.99,window=50",
+# or "off" for the fixed default waits.
+DEFAULT_SEND_TIMING = "file=send_timing.json,target=0.95,window=20"
+
+
+@dataclass
+class PhaseTiming:
+    """Current wait of one phase and the outcomes observed with it"""
+    seconds: float
+    minimum: float
+    maximum: float
+    successes: int = 0
+    failures: int = 0
+    recent: Deque[bool] = field(default_factory=deque, repr=False)
+
+
+class AdaptiveTiming:
+    """Per-machine send-path waits, learned from recorded outcomes.
+
+    Every `window` consecutive successes at a phase's current wait shrink
+    it by `shrink` (down to its minimum), as long as the success rate
+    stays at or above `target`; when it drops below, the wait grows by
+    `grow` and a new window starts.  Learned waits are saved to `path`
+    after every change and loaded on start.  With learn=False the
+    defaults are kept as they are.  Safe to use from several threads.
+    """
+
+    def __init__(self, path: Optional[str] = None, target: float = 0.95, window: int = 20,
+                 shrink: float = 0.9, grow: float = 1.5, learn: bool = True):
+        self.path = path
+        self.learn = learn
+        self.target = target
+        self.window = window
+        self.shrink = shrink
+        self.grow = grow
+        self._lock = threading.Lock()
+        self.phases: Dict[str, PhaseTiming] = {
+            name: PhaseTiming(default, minimum, maximum)
+            for name, (default, minimum, maximum) in PHASES.items()
+        }
+        if path:
+            self._load()
+        REGISTRY.gauge('whatsapp_scheduler_send_phase_seconds', 'Current (learned) wait of each send phase',
+                       ('phase',), collect=lambda: {(name,): seconds for name, seconds in self.waits().items()})
+
+    def get(self, phase: str) -> float:
+        """Current wait of phase, in seconds"""
+        with self._lock:
+            return self.phases[phase].seconds
+
+    def waits(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: timing.seconds for name, timing in self.phases.items()}
+
+    def wait(self, phase: str, ready: Optional[Callable[[], bool]] = None,
+             poll: float = 0.1) -> Optional[bool]:
+        """Wait for phase; with a readiness check, only until it passes (the wait is then the timeout).
+
+        Returns True if the check passed in time, False if it timed out
+        and None without a check.
+        """
+        limit = self.get(phase)
+        start = time.monotonic()
+        if ready is None:
+            time.sleep(limit)
+            return None
+        while time.monotonic() - start < limit:
+            if ready():
+                return True
+            time.sleep(poll)
+        return ready()
+
+    def wait_and_record(self, phase: str, ready: Optional[Callable[[], bool]] = None,
+                        poll: float = 0.1) -> Optional[bool]:
+        """wait(), then record its outcome if a readiness check decided it"""
+        passed = self.wait(phase, ready, poll)
+        if passed is not None:
+            self.record((phase,), passed)
+        return passed
+
+    def record(self, phases: Iterable[str], success: bool):
+        """Record whether these phases' waits were long enough.
+
+        Only record outcomes a readiness check decided (it passed, or it
+        timed out).  A send that raised nothing does not show the wait
+        was enough, and one that raised (an invalid number, no network)
+        does not show it was too short; either would move the wait
+        without evidence.
+        """
+        if not self.learn:
+            return
+        changed = False
+        with self._lock:
+            for name in phases:
+                timing = self.phases[name]
+                if success:
+                    timing.successes += 1
+                else:
+                    timing.failures += 1
+                timing.recent.append(success)
+
+                rate = sum(timing.recent) / len(timing.recent)
+                if rate < self.target:
+                    new_seconds = min(timing.maximum, timing.seconds * self.grow)
+                elif len(timing.recent) >= self.window:
+                    new_seconds = max(timing.minimum, timing.seconds * self.shrink)
+                else:
+                    continue
+                timing.recent.clear()
+                if new_seconds != timing.seconds:
+                    timing.seconds = round(new_seconds, 3)
+                    changed = True
+        if changed:
+            self.save()
+
+    def save(self):
+        """Write the learned waits to path (atomically)"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {name: {'seconds': timing.seconds, 'successes': timing.successes,
+                           'failures': timing.failures}
+                    for name, timing in self.phases.items()}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temporary, self.path)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring send timings in {self.path}: {e}")
+            return
+        for name, saved in data.items():
+            timing = self.phases.get(name)
+            if timing is None:
+                continue
+            timing.seconds = min(timing.maximum, max(timing.minimum, float(saved['seconds'])))
+            timing.successes = int(saved.get('successes', 0))
+            timing.failures = int(saved.get('failures', 0))
+
+
+def create_send_timing(spec: str) -> AdaptiveTiming:
+    """Build send timings from a spec such as 'file=send_timing.json,target=0.95,window=20'.
+
+    'off' (or an empty spec) keeps the fixed default waits.
+    """
+    spec = spec.strip()
+    if spec in ('', 'off', 'none'):
+        return AdaptiveTiming(learn=False)
+
+    options = {}
+    for option in spec.split(','):
+        key, _, value = option.partition('=')
+        key, value = key.strip(), value.strip()
+        if key == 'file':
+            options['path'] = value
+        elif key == 'window':
+            options['window'] = int(value)
+        elif key in ('target', 'shrink', 'grow'):
+            options[key] = float(value)
+        else:
+            raise ValueError(f"Unknown send timing option '{key}' (choose from file, target, window, shrink, grow)")
+    return AdaptiveTiming(**options)
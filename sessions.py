@@ -0,0 +1,281 @@
+import itertools
+import random
+import threading
+import time
+import webbrowser
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote
+
+from send_timing import AdaptiveTiming
+from tracing import span
+
+WHATSAPP_WEB_URL = "https://web.whatsapp.com"
+
+
+def chat_url(phone_number: str, text: str = "") -> str:
+    """WhatsApp Web URL opening the chat with phone_number, text as the draft"""
+    url = f"{WHATSAPP_WEB_URL}/send?phone={quote(phone_number.lstrip('+'))}"
+    return f"{url}&text={quote(text)}" if text else url
+
+
+def paste_text(text: str):
+    """Type text into the focused window by pasting it from the clipboard.
+
+    pyautogui.write() silently drops characters it has no key for (Arabic,
+    emoji, accents) and presses Enter at a line break; a paste keeps the
+    text intact.
+    """
+    import pyautogui
+    import pyperclip
+
+    pyperclip.copy(text)
+    pyautogui.hotkey('ctrl', 'v')
+
+
+def screen_probe(image: str) -> Callable[[], bool]:
+    """Readiness check that passes while image (e.g. a screenshot of the chat input) is on screen"""
+    def ready() -> bool:
+        import pyautogui
+
+        try:
+            return pyautogui.locateOnScreen(image) is not None
+        except pyautogui.ImageNotFoundException:
+            return False
+
+    return ready
+
+
+class BrowserDriver:
+    """One logged-in WhatsApp Web session; subclasses drive a real or fake browser"""
+
+    # How many of these sessions can be open at once (None: no limit).
+    max_sessions: Optional[int] = None
+
+    def __init__(self, timing: Optional[AdaptiveTiming] = None):
+        self.timing = timing or AdaptiveTiming(learn=False)
+
+    def open(self):
+        """Start the session: open WhatsApp Web and wait until it has loaded"""
+        raise NotImplementedError
+
+    def open_chat(self, phone_number: str, text: str):
+        """Switch the session to the chat with phone_number, with text as the draft"""
+        raise NotImplementedError
+
+    def type_text(self, text: str):
+        """Type text into the open chat's input"""
+        raise NotImplementedError
+
+    def submit(self):
+        """Send the draft in the open chat"""
+        raise NotImplementedError
+
+    def close(self):
+        """End the session"""
+
+
+class WhatsAppWebDriver(BrowserDriver):
+    """A WhatsApp Web tab in the default browser, driven with pyautogui keystrokes.
+
+    Chats are switched by loading the chat URL into the same tab through
+    the address bar.  That is a full page reload, not a switch inside the
+    running app: what the session keeps warm is the browser window, the
+    tab and the login, and the reload is served from the browser cache
+    instead of being a cold start.  The in-app search is not driven
+    because it cannot open a number that is not a saved contact.
+    With a ready check (ready, or a screenshot of the chat input as
+    ready_image, see screen_probe) the waits end as soon as the chat is
+    on screen and the chat-switch wait is learned.  Keystrokes go to the
+    focused window, so only one session can be driven at a time.
+    """
+
+    max_sessions = 1
+
+    def __init__(self, timing: Optional[AdaptiveTiming] = None,
+                 ready: Optional[Callable[[], bool]] = None, ready_image: Optional[str] = None):
+        super().__init__(timing)
+        self.ready = ready or (screen_probe(ready_image) if ready_image else None)
+
+    def open(self):
+        webbrowser.open(WHATSAPP_WEB_URL)
+        self.timing.wait('page_load', self.ready)
+
+    def open_chat(self, phone_number: str, text: str):
+        """Reload the tab at the chat URL; the app restarts, the login is kept"""
+        import pyautogui
+
+        pyautogui.hotkey('ctrl', 'l')  # address bar of this tab
+        pyautogui.write(chat_url(phone_number, text))  # quoted, so ASCII only
+        pyautogui.press('enter')
+        self.timing.wait_and_record('chat_switch', self.ready)
+
+    def type_text(self, text: str):
+        paste_text(text)
+
+    def submit(self):
+        import pyautogui
+
+        pyautogui.press('enter')
+        self.timing.wait_and_record('message_gap', self.ready)
+
+    def close(self):
+        import pyautogui
+
+        pyautogui.hotkey('ctrl', 'w')
+
+
+class FakeBrowserDriver(BrowserDriver):
+    """In-process stand-in for a WhatsApp Web session, for headless pool tests.
+
+    open_latency is paid when the session starts (the cold page load),
+    switch_latency per chat switch and send_latency per message;
+    failure_rate is the probability that a step raises.
+    """
+
+    def __init__(self, timing: Optional[AdaptiveTiming] = None, open_latency: float = 0.0,
+                 switch_latency: float = 0.0, send_latency: float = 0.0, failure_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        super().__init__(timing)
+        self.open_latency = open_latency
+        self.switch_latency = switch_latency
+        self.send_latency = send_latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.chat: Optional[str] = None
+        self.draft = ""
+        self.sent: List[tuple] = []
+        self.closed = False
+
+    def _step(self, latency: float, what: str):
+        if latency:
+            time.sleep(latency)
+        if self._random.random() < self.failure_rate:
+            raise RuntimeError(f"simulated browser failure while {what}")
+
+    def open(self):
+        self._step(self.open_latency, "loading WhatsApp Web")
+
+    def open_chat(self, phone_number: str, text: str):
+        self._step(self.switch_latency, "switching chats")
+        self.chat, self.draft = phone_number, text
+
+    def type_text(self, text: str):
+        self.draft += text
+
+    def submit(self):
+        self._step(self.send_latency, "sending")
+        self.sent.append((self.chat, self.draft))
+        self.draft = ""
+
+    def close(self):
+        self.closed = True
+
+
+DRIVERS = {
+    'whatsapp_web': WhatsAppWebDriver,
+    'fake': FakeBrowserDriver,
+}
+
+
+class PooledSession:
+    """A driver checked out of a SessionPool, with the chat it has open"""
+
+    def __init__(self, session_id: int, driver: BrowserDriver):
+        self.session_id = session_id
+        self.driver = driver
+        self.chat: Optional[str] = None
+        self.sends = 0
+
+
+class SessionPool:
+    """Keeps up to size browser sessions open between sends.
+
+    acquire() hands out an idle session, preferring one whose open chat
+    is the requested recipient, and opens a new one while fewer than
+    size exist.  A session is recycled (closed, to be replaced on
+    demand) after max_sends messages or when released after an error.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, new_driver: Callable[[], BrowserDriver], size: int = 1, max_sends: int = 50):
+        self.new_driver = new_driver
+        self.size = max(1, size)
+        self.max_sends = max_sends
+        self._idle: List[PooledSession] = []
+        self._open = 0
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+        self.opened = 0
+        self.recycled = 0
+
+    def acquire(self, chat: Optional[str] = None, timeout: Optional[float] = None) -> PooledSession:
+        """An idle or newly opened session; blocks while size sessions are busy"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("session pool is closed")
+                if self._idle:
+                    for index, session in enumerate(self._idle):
+                        if session.chat == chat:
+                            return self._idle.pop(index)
+                    return self._idle.pop()
+                if self._open < self.size:
+                    self._open += 1
+                    session_id = next(self._ids)
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"no browser session free within {timeout} s")
+                self._condition.wait(remaining)
+
+        # Open outside the lock: a cold page load takes seconds.
+        try:
+            driver = self.new_driver()
+            with span('session.open', session=session_id):
+                driver.open()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.opened += 1
+        return PooledSession(session_id, driver)
+
+    def release(self, session: PooledSession, healthy: bool = True):
+        """Return a session; unhealthy or worn-out sessions are closed instead"""
+        if healthy and session.sends < self.max_sends:
+            with self._condition:
+                if not self._closed:
+                    self._idle.append(session)
+                    self._condition.notify()
+                    return
+        self._close_session(session, recycled=not self._closed)
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {'open': self._open, 'idle': len(self._idle), 'opened': self.opened,
+                    'recycled': self.recycled}
+
+    def close(self):
+        """Close the idle sessions; busy ones are closed when released"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for session in idle:
+            self._close_session(session, recycled=False)
+
+    def _close_session(self, session: PooledSession, recycled: bool):
+        with span('session.close', session=session.session_id, sends=session.sends, recycled=recycled):
+            try:
+                session.driver.close()
+            except Exception as e:
+                print(f"Error closing browser session {session.session_id}: {e}")
+        with self._condition:
+            self._open -= 1
+            if recycled:
+                self.recycled += 1
+            self._condition.notify()
@@ -0,0 +1,368 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from metrics import REGISTRY
+from phone_numbers import to_e164_or_none
+from tracing import TRACER
+
+# Bump together with a new entry in MIGRATIONS.
+SCHEMA_VERSION = 8
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'whatsapp_scheduler_db_query_seconds', 'Time spent in SQLite statements and write transactions',
+    ('operation',))
+
+
+def _statement_span(operation: str, sql: str):
+    # Normalizing the SQL is only worth it while tracing.
+    if not TRACER.enabled:
+        return TRACER.span(operation)
+    return TRACER.span(operation, sql=' '.join(sql.split())[:200])
+
+
+def to_epoch_ms(dt: datetime) -> int:
+    """Convert a (local, naive) datetime to integer epoch milliseconds"""
+    return int(round(dt.timestamp() * 1000))
+
+
+def from_epoch_ms(epoch_ms: int) -> datetime:
+    """Convert integer epoch milliseconds back to a local datetime"""
+    return datetime.fromtimestamp(epoch_ms / 1000)
+
+
+def now_ms() -> int:
+    """Current time in integer epoch milliseconds"""
+    return int(time.time() * 1000)
+
+
+def _migrate_epoch_times(cursor: sqlite3.Cursor):
+    """Store scheduled/sent times as epoch milliseconds and index the due scan"""
+    # Older versions stored str(datetime) in local time; the 'utc' modifier
+    # tells SQLite to treat those values as local time.
+    for column in ('scheduled_time', 'sent_at'):
+        cursor.execute(f'''
+            UPDATE scheduled_messages
+            SET {column} = CAST(ROUND((julianday({column}, 'utc') - 2440587.5) * 86400000) AS INTEGER)
+            WHERE typeof({column}) = 'text'
+        ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_pending_due
+        ON scheduled_messages (scheduled_time)
+        WHERE status = 'pending'
+    ''')
+
+
+def _migrate_claim_leases(cursor: sqlite3.Cursor):
+    """Let dispatchers claim rows ('sending') under an expiring lease"""
+    cursor.execute("ALTER TABLE scheduled_messages ADD COLUMN claimed_by TEXT NULL")
+    cursor.execute("ALTER TABLE scheduled_messages ADD COLUMN lease_expires_at INTEGER NULL")
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_sending_lease
+        ON scheduled_messages (lease_expires_at)
+        WHERE status = 'sending'
+    ''')
+
+
+def _migrate_list_indexes(cursor: sqlite3.Cursor):
+    """Index the keyset-paginated message list, unfiltered and per filter"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_messages_time ON scheduled_messages (scheduled_time)")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_status_time
+        ON scheduled_messages (status, scheduled_time)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_recipient_time
+        ON scheduled_messages (recipient_name COLLATE NOCASE, scheduled_time)
+    ''')
+
+
+def _migrate_change_log(cursor: sqlite3.Cursor):
+    """Record the latest revision of every changed row for incremental readers"""
+    # One entry per row: REPLACE moves a row's entry to a fresh revision, so
+    # the log never grows beyond the rows ever stored.  Entries whose row is
+    # gone mark deletions.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            revision INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            UNIQUE (table_name, row_id)
+        )
+    ''')
+
+    for table in ('scheduled_messages', 'contacts'):
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_log
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT OR REPLACE INTO change_log (table_name, row_id) VALUES ('{table}', {row}.id);
+                END
+            ''')
+
+
+def _migrate_phone_e164(cursor: sqlite3.Cursor):
+    """Store every phone number once more in canonical E.164 form, indexed"""
+    # Numbers that cannot be normalized stay NULL; readers fall back to
+    # phone_number for them.
+    cursor.connection.create_function("to_e164", 1, to_e164_or_none, deterministic=True)
+    for table in ('contacts', 'scheduled_messages'):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN phone_e164 TEXT NULL")
+        cursor.execute(f"UPDATE {table} SET phone_e164 = to_e164(phone_number)")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_phone_e164 ON contacts (phone_e164)")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_phone_e164
+        ON scheduled_messages (phone_e164, scheduled_time)
+    ''')
+
+
+def _migrate_recurring_schedules(cursor: sqlite3.Cursor):
+    """Recurrence rules; only each schedule's next occurrence is a scheduled_messages row"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient_name TEXT NOT NULL,
+            phone_number TEXT NOT NULL,
+            message TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            next_run INTEGER NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        ALTER TABLE scheduled_messages ADD COLUMN recurring_id INTEGER NULL
+        REFERENCES recurring_schedules (id) ON DELETE SET NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_recurring_pending
+        ON scheduled_messages (recurring_id)
+        WHERE status = 'pending' AND recurring_id IS NOT NULL
+    ''')
+
+
+def _migrate_next_attempt(cursor: sqlite3.Cursor):
+    """Let a pending message be deferred past its scheduled time"""
+    # The due scan orders by COALESCE(next_attempt_at, scheduled_time); the
+    # expression index replaces the scheduled_time one.
+    cursor.execute("ALTER TABLE scheduled_messages ADD COLUMN next_attempt_at INTEGER NULL")
+    cursor.execute("DROP INDEX IF EXISTS idx_scheduled_messages_pending_due")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_pending_due
+        ON scheduled_messages (COALESCE(next_attempt_at, scheduled_time))
+        WHERE status = 'pending'
+    ''')
+
+
+def _migrate_retries(cursor: sqlite3.Cursor):
+    """Count delivery attempts, keep the last error, and add the dead-letter table"""
+    cursor.execute("ALTER TABLE scheduled_messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE scheduled_messages ADD COLUMN last_error TEXT NULL")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER NOT NULL,
+            recipient_name TEXT NOT NULL,
+            phone_number TEXT NOT NULL,
+            phone_e164 TEXT NULL,
+            message TEXT NOT NULL,
+            scheduled_time INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT NULL,
+            failed_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dead_letters_failed_at ON dead_letters (failed_at)")
+
+    # Messages that already failed (once, with no retries) are dead letters now.
+    cursor.execute('''
+        INSERT INTO dead_letters
+        (message_id, recipient_name, phone_number, phone_e164, message, scheduled_time,
+         attempts, last_error, failed_at)
+        SELECT id, recipient_name, phone_number, phone_e164, message, scheduled_time,
+               1, NULL, COALESCE(sent_at, scheduled_time)
+        FROM scheduled_messages WHERE status = 'failed'
+    ''')
+    cursor.execute("DELETE FROM scheduled_messages WHERE status = 'failed'")
+
+
+# MIGRATIONS[i] upgrades a database from user_version i to i + 1.
+MIGRATIONS = [
+    _migrate_epoch_times,
+    _migrate_claim_leases,
+    _migrate_list_indexes,
+    _migrate_change_log,
+    _migrate_phone_e164,
+    _migrate_recurring_schedules,
+    _migrate_next_attempt,
+    _migrate_retries,
+]
+
+
+def _create_tables(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient_name TEXT NOT NULL,
+            phone_number TEXT NOT NULL,
+            message TEXT NOT NULL,
+            scheduled_time INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            sent_at INTEGER NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            phone_number TEXT NOT NULL
+        )
+    ''')
+
+
+def init_schema(conn: sqlite3.Connection):
+    """Create the tables if needed and apply any pending migrations"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        _create_tables(cursor)
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for migrate in MIGRATIONS[version:]:
+            migrate(cursor)
+        if version < SCHEMA_VERSION:
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+class Storage:
+    """Owns one long-lived SQLite connection per thread.
+
+    Connections run in WAL mode with synchronous=NORMAL, so readers (the Tk
+    thread) never wait on the dispatcher's writes, and each connection keeps
+    its own prepared-statement cache.  Statements run in autocommit mode;
+    use transaction() to group writes.
+    """
+
+    def __init__(self, db_path: str = "scheduler.db", cached_statements: int = 256,
+                 busy_timeout: float = 10.0):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               isolation_level=None, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use"""
+        conn: Optional[sqlite3.Connection] = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def release_connection(self):
+        """Close the calling thread's connection, e.g. before a short-lived thread exits"""
+        conn: Optional[sqlite3.Connection] = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def init_schema(self):
+        """Create the tables if needed and apply any pending migrations"""
+        init_schema(self.connection())
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        """Run a single statement (committed immediately unless in a transaction)"""
+        with DB_QUERY_SECONDS.time(operation='execute'), _statement_span('db.execute', sql):
+            return self.connection().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        with DB_QUERY_SECONDS.time(operation='execute'), _statement_span('db.executemany', sql):
+            return self.connection().executemany(sql, seq_of_params)
+
+    def query(self, sql: str, params=()) -> List[tuple]:
+        """Run a SELECT and return all rows"""
+        with DB_QUERY_SECONDS.time(operation='query'), _statement_span('db.query', sql):
+            return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params=()) -> Optional[tuple]:
+        """Run a SELECT and return the first row, or None"""
+        with DB_QUERY_SECONDS.time(operation='query'), _statement_span('db.query', sql):
+            return self.connection().execute(sql, params).fetchone()
+
+    def data_version(self) -> int:
+        """PRAGMA data_version of this thread's connection; it changes when
+        another connection (or process) commits to the database"""
+        return self.connection().execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Group statements into one write transaction on this thread's connection"""
+        conn = self.connection()
+        if conn.in_transaction:
+            # Nested use joins the outer transaction.
+            yield conn.cursor()
+            return
+        start = time.perf_counter()
+        with TRACER.span('db.transaction'):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation='transaction')
+
+    def close(self):
+        """Close every connection opened by this storage"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class DataVersionWatcher:
+    """Reports whether other connections have committed since the last call.
+
+    PRAGMA data_version is per connection, so always call it from the same
+    thread.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._version: Optional[int] = None
+
+    def __call__(self) -> bool:
+        version = self.storage.data_version()
+        changed = self._version is not None and version != self._version
+        self._version = version
+        return changed
@@ -0,0 +1,47 @@
+import os
+import sys
+import types
+
+import pytest
+
+# The modules live at the repository root, next to this directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import send_timing  # noqa: E402
+from storage import Storage  # noqa: E402
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """A fresh scheduler database"""
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def desktop(monkeypatch):
+    """Stand-ins for pywhatkit, pyautogui and pyperclip that log what would be typed"""
+    log = []
+    clipboard = []
+    monkeypatch.setitem(sys.modules, 'pywhatkit', types.SimpleNamespace(
+        sendwhatmsg_instantly=lambda phone, text, **kwargs: log.append(('url', text))))
+    monkeypatch.setitem(sys.modules, 'pyperclip', types.SimpleNamespace(copy=clipboard.append))
+    monkeypatch.setitem(sys.modules, 'pyautogui', types.SimpleNamespace(
+        write=lambda text: log.append(('write', text)),
+        hotkey=lambda *keys: log.append(('paste', clipboard[-1]) if keys == ('ctrl', 'v') else ('hotkey', keys)),
+        press=lambda key: log.append(('press', key))))
+    return log
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake clock for send_timing: sleeping advances it instantly"""
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(send_timing, 'time', types.SimpleNamespace(monotonic=lambda: now[0], sleep=sleep))
+    return now
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import async_dispatcher
+from async_dispatcher import AsyncDispatcher
+from dispatcher import new_owner_id
+from storage import DataVersionWatcher, Storage, now_ms
+from transport import FakeTransport, OutgoingMessage, SendResult, Transport
+from workers import SendPool
+
+
+def add_due_messages(storage, count, start=0, delay=-1):
+    with storage.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO scheduled_messages
+                (recipient_name, phone_number, phone_e164, message, scheduled_time, status)
+            VALUES (?, ?, ?, ?, ?, 'pending')
+        ''', [(f"r{i}", f"+1555{i:07d}", f"+1555{i:07d}", f"Message {i}", now_ms() + int(delay * 1000))
+              for i in range(start, start + count)])
+
+
+def count(storage, status):
+    return storage.query_one("SELECT COUNT(*) FROM scheduled_messages WHERE status = ?", (status,))[0]
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def test_stop_and_start_with_a_slow_record(tmp_path, monkeypatch):
+    record_batch = async_dispatcher.record_batch
+
+    def slow_record_batch(*args, **kwargs):
+        time.sleep(0.3)
+        record_batch(*args, **kwargs)
+
+    monkeypatch.setattr(async_dispatcher, 'record_batch', slow_record_batch)
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    transport = FakeTransport(latency=0.05)
+    dispatcher = AsyncDispatcher(storage, transport, new_owner_id(), concurrency=4)
+
+    add_due_messages(storage, 8)
+    dispatcher.start()
+    assert wait_for(lambda: len(transport.sent) >= 2)
+    dispatcher.stop()
+    # The loop finishes what it claimed, records it and exits.
+    assert wait_for(lambda: not dispatcher._loop_active)
+    assert count(storage, 'sending') == 0
+
+    add_due_messages(storage, 3, start=100)
+    dispatcher.start()
+    assert wait_for(lambda: count(storage, 'pending') == 0 and count(storage, 'sending') == 0)
+    assert count(storage, 'sent') == 11
+    dispatcher.stop()
+    assert wait_for(lambda: not dispatcher._loop_active)
+    storage.close()
+
+
+class OneDesktopTransport(Transport):
+    """Blocking transport that records how many sends ever overlapped"""
+
+    def __init__(self):
+        self.active = 0
+        self.most_active = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send(self, batch):
+        with self._lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(0.01)
+        with self._lock:
+            self.active -= 1
+            self.sent += len(batch)
+        return [SendResult(message, True) for message in batch]
+
+
+def test_blocking_sends_share_the_send_pool_lane(tmp_path):
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    transport = OneDesktopTransport()
+    pool = SendPool(transport, workers=4)
+    dispatcher = AsyncDispatcher(storage, transport, new_owner_id(), pool)
+    assert dispatcher.concurrency == 1
+
+    add_due_messages(storage, 20)
+    dispatcher.start()
+    # A manual send (Send Now) while the dispatcher is sending
+    for i in range(5):
+        pool.submit(f"+1999{i}", [OutgoingMessage(f"+1999{i}", "manual")])
+    assert wait_for(lambda: count(storage, 'sent') == 20)
+    pool.join()
+    dispatcher.stop()
+    assert wait_for(lambda: not dispatcher._loop_active)
+    assert transport.sent == 25
+    assert transport.most_active == 1
+    pool.close()
+    storage.close()
+
+
+def test_only_the_next_due_time_is_armed(tmp_path):
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    transport = FakeTransport()
+    dispatcher = AsyncDispatcher(storage, transport, new_owner_id(),
+                                 has_external_changes=DataVersionWatcher(storage), poll_interval=0.05)
+    add_due_messages(storage, 1000, start=1000, delay=3600)
+    dispatcher.start()
+    assert wait_for(lambda: dispatcher._loop is not None)
+
+    # Another process schedules two messages due in a moment
+    other = Storage(storage.db_path)
+    add_due_messages(other, 1, start=1, delay=0.2)
+    add_due_messages(other, 1, start=2, delay=0.6)
+    other.close()
+    assert wait_for(lambda: count(storage, 'sent') == 2)
+    # Each pass re-armed the next due time; the far ones were never armed one by one
+    assert len(dispatcher._timers) <= 2
+    assert count(storage, 'pending') == 1000
+
+    dispatcher.stop()
+    assert wait_for(lambda: not dispatcher._loop_active)
+    storage.close()
+
+
+def test_a_notified_message_is_sent_when_it_comes_due(tmp_path):
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    transport = FakeTransport()
+    # No external change polling: only the timer can wake the dispatcher
+    dispatcher = AsyncDispatcher(storage, transport, new_owner_id())
+    dispatcher.start()
+    assert wait_for(lambda: dispatcher._loop is not None)
+
+    add_due_messages(storage, 1, delay=0.3)
+    due_time = storage.query_one("SELECT scheduled_time FROM scheduled_messages")[0]
+    dispatcher.notify(due_time / 1000)
+    time.sleep(0.1)
+    assert not transport.sent
+    assert wait_for(lambda: count(storage, 'sent') == 1, timeout=5)
+    sent_at = storage.query_one("SELECT sent_at FROM scheduled_messages")[0]
+    assert 0 <= sent_at - due_time < 1000
+
+    dispatcher.stop()
+    assert wait_for(lambda: not dispatcher._loop_active)
+    storage.close()
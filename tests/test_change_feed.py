@@ -0,0 +1,53 @@
+import pytest
+
+from change_feed import ChangeFeed
+from storage import Storage
+
+
+@pytest.fixture
+def writer(storage):
+    """Another connection to the database, like a second process"""
+    writer = Storage(storage.db_path)
+    yield writer
+    writer.close()
+
+
+def add_message(storage, text):
+    return storage.execute('''
+        INSERT INTO scheduled_messages (recipient_name, phone_number, phone_e164, message, scheduled_time)
+        VALUES ('john', '+15551234567', '+15551234567', ?, 1700000000000)
+    ''', (text,)).lastrowid
+
+
+def test_feed_reports_changed_and_deleted_rows(storage, writer):
+    kept = add_message(writer, "kept")
+    feed = ChangeFeed(storage)
+    assert feed.poll() is None
+
+    changed = add_message(writer, "new")
+    writer.execute("UPDATE scheduled_messages SET status = 'sent' WHERE id = ?", (changed,))
+    writer.execute("INSERT INTO contacts (name, phone_number) VALUES ('sarah', '+15557654321')")
+    changes = feed.poll()
+    # A row inserted and then updated is reported once, as it is now
+    assert [(row[0], row[4]) for row in changes.messages] == [(changed, 'sent')]
+    assert [contact[1:] for contact in changes.contacts] == [('sarah', '+15557654321')]
+    assert feed.poll() is None
+
+    writer.execute("DELETE FROM scheduled_messages WHERE id = ?", (kept,))
+    writer.execute("DELETE FROM contacts WHERE name = 'sarah'")
+    changes = feed.poll()
+    assert changes.deleted_messages == [kept] and not changes.messages
+    assert len(changes.deleted_contacts) == 1
+
+
+def test_too_many_changes_ask_for_a_reload(storage, writer):
+    feed = ChangeFeed(storage, limit=5)
+    for i in range(6):
+        add_message(writer, f"m{i}")
+    changes = feed.poll()
+    assert changes.truncated and len(changes) == 0
+
+    # The feed carries on from the latest revision
+    add_message(writer, "after")
+    changes = feed.poll()
+    assert not changes.truncated and [row[2] for row in changes.messages] == ["after"]
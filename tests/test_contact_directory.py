@@ -0,0 +1,42 @@
+from contact_directory import CACHE_HITS, CACHE_MISSES, ContactDirectory
+from storage import Storage
+
+
+def add_contact(storage, name, phone_number):
+    storage.execute("INSERT OR REPLACE INTO contacts (name, phone_number, phone_e164) VALUES (?, ?, ?)",
+                    (name, phone_number, phone_number))
+
+
+def counts():
+    return sum(CACHE_HITS.values().values()), sum(CACHE_MISSES.values().values())
+
+
+def test_lookups_are_counted_in_the_registry(storage):
+    add_contact(storage, "john", "+15551234567")
+    contacts = ContactDirectory(storage)
+    hits, misses = counts()
+
+    assert contacts.lookup("John") == "+15551234567"
+    assert contacts.lookup("john") == "+15551234567"
+    assert contacts.lookup_many(["john", "nobody"]) == {"john": "+15551234567", "nobody": None}
+    # Unknown names are cached too
+    assert contacts.lookup("nobody") is None
+
+    assert counts() == (hits + 3, misses + 2)
+    assert contacts.stats()['hits'] == 3 and contacts.stats()['misses'] == 2
+
+
+def test_changes_from_another_connection_drop_the_cache(storage, monkeypatch):
+    monkeypatch.setattr(ContactDirectory, 'CHECK_INTERVAL', 0)
+    add_contact(storage, "john", "+15551234567")
+    contacts = ContactDirectory(storage)
+    assert contacts.lookup("john") == "+15551234567"
+
+    other = Storage(storage.db_path)
+    try:
+        add_contact(other, "john", "+15557654321")
+    finally:
+        other.close()
+
+    assert contacts.lookup("john") == "+15557654321"
+    assert contacts.stats()['invalidations'] == 1
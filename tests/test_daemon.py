@@ -0,0 +1,112 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from client import SchedulerClient, connect_to_daemon
+from daemon import create_daemon_server
+from main import RemoteScheduler, WhatsAppScheduler
+from test_async_dispatcher import OneDesktopTransport
+from transport import FakeTransport, OutgoingMessage
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    scheduler = WhatsAppScheduler(str(tmp_path / "scheduler.db"), transport=FakeTransport())
+    server = create_daemon_server(scheduler, "127.0.0.1", 0, token="secret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield scheduler, f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    scheduler.close()
+    scheduler.storage.close()
+
+
+def test_requests_do_not_leak_connections(daemon):
+    scheduler, address = daemon
+    client = SchedulerClient(address, "secret")
+    client.add_contact("john", "+15551234567")
+    for _ in range(100):
+        client.contacts()
+        client.messages()
+        with urllib.request.urlopen(f"http://{address}/metrics") as response:
+            response.read()
+    # Each request ran on its own thread; none of them kept a connection.
+    assert len(scheduler.storage._connections) <= 2
+
+
+def status_of(address, path, data=None, headers=None):
+    request = urllib.request.Request(f"http://{address}{path}", data=data, headers=headers or {},
+                                     method='POST' if data is not None else 'GET')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_rejects_requests_a_web_page_could_forge(daemon):
+    scheduler, address = daemon
+    body = json.dumps({'name': 'eve', 'phone_number': '+15550000000'}).encode('utf-8')
+    json_type = {'Content-Type': 'application/json'}
+    auth = {'Authorization': 'Bearer secret'}
+
+    assert status_of(address, "/contacts", body, json_type) == 403
+    assert status_of(address, "/contacts", body, {**json_type, 'Authorization': 'Bearer wrong'}) == 403
+    assert status_of(address, "/contacts", body, {**auth, 'Content-Type': 'text/plain'}) == 415
+    assert status_of(address, "/contacts", body, {**auth, **json_type, 'Host': 'evil.example:8765'}) == 403
+    assert status_of(address, "/metrics", headers={'Host': 'evil.example'}) == 403
+    assert scheduler.get_contact_number('eve') is None
+
+    assert status_of(address, "/contacts", body, {**auth, **json_type}) == 200
+    assert status_of(address, "/metrics") == 200
+
+
+def test_clients_need_the_token_file(tmp_path, daemon):
+    _, address = daemon
+    db_path = str(tmp_path / "scheduler.db")
+    assert connect_to_daemon(address, db_path=db_path) is None
+    (tmp_path / "daemon.token").write_text("secret\n")
+    assert connect_to_daemon(address, db_path=db_path).health()['status'] == 'ok'
+
+
+def test_single_sends_share_the_send_pool_lane(tmp_path):
+    transport = OneDesktopTransport()
+    scheduler = WhatsAppScheduler(str(tmp_path / "scheduler.db"), transport=transport)
+    server = create_daemon_server(scheduler, "127.0.0.1", 0, token="secret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = SchedulerClient(f"127.0.0.1:{server.server_address[1]}", "secret")
+    # A manual send while /send requests arrive on their own threads
+    scheduler.send_pool.submit("+19990", [OutgoingMessage("+19990", "manual")])
+
+    threads = [threading.Thread(target=client.send, args=(f"+1555000{i:04d}", "hello")) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.send_pool.join()
+
+    assert transport.sent == 9
+    assert transport.most_active == 1
+    server.shutdown()
+    server.server_close()
+    scheduler.close()
+    scheduler.storage.close()
+
+
+def test_remote_scheduler_matches_the_local_one(daemon):
+    # The GUI drives either one through the same methods
+    scheduler, address = daemon
+    remote = RemoteScheduler(SchedulerClient(address, "secret"))
+    remote.save_contact("john", "+15551234567")
+
+    scheduled = remote.schedule("john", "hi", delay_minutes=5)
+    assert scheduled.phone_number == "+15551234567"
+    with pytest.raises(LookupError):
+        remote.schedule("nobody", "hi", delay_minutes=5)
+
+    assert remote.remove_contact("john") is True
+    assert remote.remove_contact("john") is False
+    assert scheduler.remove_contact("john") is False
@@ -0,0 +1,109 @@
+import threading
+
+from dispatcher import (claim_due_messages, deliver_messages, load_next_due_time, new_owner_id,
+                        record_results, renew_leases)
+from storage import Storage, now_ms
+from transport import FakeTransport, SendResult
+
+
+def add_message(storage, phone_number, text, due_in=-1.0, phone_e164=None):
+    return storage.execute('''
+        INSERT INTO scheduled_messages (recipient_name, phone_number, phone_e164, message, scheduled_time)
+        VALUES ('r', ?, ?, ?, ?)
+    ''', (phone_number, phone_e164 or phone_number, text, now_ms() + int(due_in * 1000))).lastrowid
+
+
+def statuses(storage):
+    return dict(storage.query("SELECT message, status FROM scheduled_messages"))
+
+
+def test_due_scans_use_the_pending_due_index(tmp_path):
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    now = now_ms()
+    with storage.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO scheduled_messages
+                (recipient_name, phone_number, phone_e164, message, scheduled_time, status)
+            VALUES ('r', '+15550000000', '+15550000000', 'm', ?, ?)
+        ''', [(now + i * 1000, 'sent' if i % 2 else 'pending') for i in range(-50, 50)])
+
+    statements = []
+    conn = storage.connection()
+    conn.set_trace_callback(statements.append)
+    claim_due_messages(storage, new_owner_id())
+    load_next_due_time(storage)
+    conn.set_trace_callback(None)
+
+    due_scans = [sql for sql in statements
+                 if sql.lstrip().startswith('SELECT') and 'COALESCE(next_attempt_at' in sql]
+    assert len(due_scans) == 2
+    for sql in due_scans:
+        plan = ' | '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+        assert 'idx_scheduled_messages_pending_due' in plan
+        assert 'TEMP B-TREE' not in plan
+    storage.close()
+
+
+def test_due_messages_are_coalesced_per_recipient(storage):
+    add_message(storage, "+15550000001", "first", due_in=-3)
+    add_message(storage, "+15550000002", "other", due_in=-2)
+    # Stored in another format, but the same canonical number
+    add_message(storage, "555-000-0001", "second", due_in=-1, phone_e164="+15550000001")
+    add_message(storage, "+15550000001", "later", due_in=3600)
+    owner = new_owner_id()
+
+    batches = claim_due_messages(storage, owner)
+    assert [[message.text for message in batch] for batch in batches] == [["first", "second"], ["other"]]
+    assert {message.phone_number for message in batches[0]} == {"+15550000001"}
+
+    transport = FakeTransport()
+    deliver_messages(storage, transport, owner, batches)
+    # One chat session per recipient
+    assert transport.sessions == 2
+    assert statuses(storage) == {"first": "sent", "other": "sent", "second": "sent", "later": "pending"}
+
+
+def test_concurrent_dispatchers_never_claim_a_row_twice(storage):
+    for i in range(40):
+        add_message(storage, f"+1555000{i:04d}", f"m{i}")
+    claimed = []
+
+    def dispatch():
+        owner = new_owner_id()
+        while True:
+            batches = claim_due_messages(storage, owner, limit=3)
+            if not batches:
+                break
+            claimed.extend(message.message_id for batch in batches for message in batch)
+
+    threads = [threading.Thread(target=dispatch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed) == len(set(claimed)) == 40
+
+
+def test_an_expired_lease_is_taken_over_and_fenced(storage):
+    message_id = add_message(storage, "+15550000001", "hi")
+    crashed, survivor = new_owner_id(), new_owner_id()
+    [[message]] = claim_due_messages(storage, crashed, lease_seconds=0)
+
+    # The lease has run out, so another dispatcher may send the message
+    [[taken]] = claim_due_messages(storage, survivor)
+    assert taken.message_id == message_id
+    renew_leases(storage, crashed)
+    assert storage.query_one("SELECT claimed_by FROM scheduled_messages")[0] == survivor
+
+    # The first owner's late result does not overwrite the new owner's claim
+    record_results(storage, [SendResult(message, True)], owner=crashed)
+    assert statuses(storage) == {"hi": "sending"}
+    record_results(storage, [SendResult(taken, True)], owner=survivor)
+    assert statuses(storage) == {"hi": "sent"}
+
+
+def test_a_live_lease_is_not_taken_over(storage):
+    add_message(storage, "+15550000001", "hi")
+    assert claim_due_messages(storage, new_owner_id())
+    assert claim_due_messages(storage, new_owner_id()) == []
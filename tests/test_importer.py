@@ -0,0 +1,58 @@
+import json
+
+from importer import import_contacts, import_messages
+
+
+def write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return str(path)
+
+
+def test_imports_contacts_from_csv(storage, tmp_path):
+    path = write_lines(tmp_path / "contacts.csv", [
+        "name,phone_number",
+        "John,+1 555 123 4567",
+        ",+15550000000",
+        "Jane,not a number",
+    ])
+
+    report = import_contacts(storage, path)
+
+    assert (report.imported, report.rejected) == (1, 2)
+    assert storage.query("SELECT name, phone_e164 FROM contacts") == [('john', '+15551234567')]
+
+
+def test_imports_messages_resolving_contacts(storage, tmp_path):
+    storage.execute("INSERT INTO contacts (name, phone_number, phone_e164) VALUES ('john', '+15551234567', '+15551234567')")
+    path = write_lines(tmp_path / "messages.jsonl", [
+        json.dumps({'recipient_name': 'John', 'message': 'Hi', 'scheduled_time': 1700000000000}),
+        json.dumps({'recipient_name': 'Jane', 'phone_number': '+15557654321', 'message': 'Hey',
+                    'scheduled_time': '2030-01-01T09:00:00'}),
+        json.dumps({'recipient_name': 'nobody', 'message': 'Hi', 'delay_minutes': 5}),
+    ])
+
+    report = import_messages(storage, path)
+
+    assert (report.imported, report.rejected) == (2, 1)
+    assert "line 3: contact 'nobody' not found" in report.errors
+    assert storage.query("SELECT recipient_name, phone_e164, message FROM scheduled_messages ORDER BY id") == [
+        ('john', '+15551234567', 'Hi'), ('jane', '+15557654321', 'Hey')]
+
+
+def test_lines_that_are_not_json_objects_are_rejected(storage, tmp_path):
+    path = write_lines(tmp_path / "messages.jsonl", [
+        "[1, 2]",
+        '"x"',
+        "3",
+        "{not json",
+        json.dumps({'recipient_name': 'jane', 'phone_number': '+15557654321', 'message': 'Hey',
+                    'delay_minutes': 5}),
+    ])
+
+    report = import_messages(storage, path)
+
+    assert (report.imported, report.rejected) == (1, 4)
+    assert report.errors[:3] == ["line 1: expected a JSON object, got list",
+                                 "line 2: expected a JSON object, got str",
+                                 "line 3: expected a JSON object, got int"]
+    assert import_contacts(storage, path).rejected == 5
@@ -0,0 +1,54 @@
+import pytest
+
+from main import WhatsAppScheduler
+from storage import now_ms
+from transport import FakeTransport
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    scheduler = WhatsAppScheduler(str(tmp_path / "scheduler.db"), transport=FakeTransport())
+    scheduler.save_contact("john", "+15551234567")
+    scheduler.save_contact("me", "+15550000000")
+    yield scheduler
+    scheduler.close()
+    scheduler.storage.close()
+
+
+def test_schedule_many_reports_what_it_could_not_schedule(scheduler):
+    start = now_ms()
+    result = scheduler.schedule_many([
+        'Send john "meeting" in 2 hours',
+        'Send nobody "hi" in 5 minutes',
+        'Send john "hello"',
+        'Remind you "drink water" in 20 minutes',
+        'Send john "standup" every weekday at 9:30',
+    ])
+
+    assert result.scheduled == 3
+    assert [(error.line, error.reason) for error in result.errors] == [
+        (2, "contact 'nobody' not found"), (3, "could not parse recipient, message and timing")]
+
+    rows = scheduler.storage.query('''
+        SELECT recipient_name, phone_e164, message, scheduled_time, recurring_id IS NOT NULL
+        FROM scheduled_messages ORDER BY id
+    ''')
+    assert [row[:3] for row in rows] == [("john", "+15551234567", "meeting"),
+                                         ("me", "+15550000000", "drink water"),
+                                         ("john", "+15551234567", "standup")]
+    assert abs(rows[0][3] - (start + 120 * 60000)) < 5000
+    assert abs(rows[1][3] - (start + 20 * 60000)) < 5000
+    assert [row[4] for row in rows] == [0, 0, 1]
+    assert [schedule[3] for schedule in scheduler.recurring_schedules()] == ["weekdays at 09:30"]
+
+
+def test_schedule_many_resolves_contacts_with_one_query(scheduler):
+    statements = []
+    conn = scheduler.storage.connection()
+    conn.set_trace_callback(statements.append)
+    result = scheduler.schedule_many([f'Send john "message {i}" in {i + 1} minutes' for i in range(50)])
+    conn.set_trace_callback(None)
+
+    assert result.scheduled == 50 and not result.errors
+    assert len([sql for sql in statements if 'FROM contacts' in sql]) == 1
+
@@ -0,0 +1,24 @@
+import urllib.request
+
+from dispatcher import register_queue_metrics
+from metrics import MetricsRegistry, start_metrics_server
+from storage import Storage
+
+
+def test_scrapes_reuse_one_connection(tmp_path):
+    storage = Storage(str(tmp_path / "scheduler.db"))
+    storage.init_schema()
+    registry = MetricsRegistry()
+    register_queue_metrics(storage, registry)
+    server = start_metrics_server(0, registry=registry)
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    try:
+        for _ in range(100):
+            with urllib.request.urlopen(url) as response:
+                assert b'whatsapp_scheduler_due_messages 0' in response.read()
+        # The schema connection plus the serving thread's
+        assert len(storage._connections) <= 2
+    finally:
+        server.shutdown()
+        server.server_close()
+        storage.close()
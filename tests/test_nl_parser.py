@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from metrics import REGISTRY
+from nl_parser import ParsedCommand, parse_cache_info, parse_command, parse_command_cached
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "benchmarks", "parser_corpus.txt")
+
+# (recipient, message, delay_minutes) per corpus line, as the original
+# regex parser returned them.  It raised IndexError on 'tomorrow' and did
+# not know 'mins' / 'hrs'; those lines have the intended values.
+EXPECTED = [
+    ('john', 'meeting at 3pm', 120),
+    ('sarah', 'happy birthday', 1440),
+    ('alex', 'call mom', 30),
+    ('you', 'take medicine', 60),
+    ('alex', 'happy birthday', 2880),
+    ('bob', 'pick up the kids', 45),
+    ('mom', 'the dentist appointment', 180),
+    ('priya', 'standup moved to 10', 15),
+    ('ravi', 'rent is due', 2880),
+    ('team', 'the release is tonight', 60),
+    ('dad', 'landing at 6, see you soon', 300),
+    ('neha', 'don\\', 1440),
+    ('alice', 'reminder', 1),
+    ('carol', 'weekly report', 10080),
+    ('you', 'drink water', 20),
+    ('john', 'quick check-in', 10),
+    ('sam', 'lunch?', 120),
+    ('anna', 'whether she booked the tickets', 240),
+    ('kiran', 'congrats on the new job!', 1440),
+    ('vikram', 'server maintenance at midnight', 360),
+]
+
+
+def corpus():
+    with open(CORPUS, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+@pytest.mark.parametrize('command, expected', list(zip(corpus(), EXPECTED)))
+def test_corpus_parses_like_the_original_parser(command, expected):
+    parsed = parse_command(command)
+    assert (parsed.recipient, parsed.message, parsed.delay_minutes) == expected
+    assert parsed.recurrence is None and parsed.is_complete
+
+
+def test_corpus_is_fully_covered():
+    assert len(corpus()) == len(EXPECTED)
+
+
+@pytest.mark.parametrize('command, recurrence', [
+    ('Send mom "take your pills" every day at 9pm', 'daily at 21:00'),
+    ('Send team "standup" every weekday at 9:30', 'weekdays at 09:30'),
+    ('Remind bob "gym" every monday', 'weekly on mon at 09:00'),
+    ('Message ana "water the plants" every 3 days', 'every 3 days'),
+    ('Send joe "sync" every 2 weeks at 10am', 'every 14 days at 10:00'),
+    ('Send joe "ping" every 30 minutes', 'every 30 minutes'),
+    ('Send joe "report" daily at 18:00', 'daily at 18:00'),
+    ('Send joe "late" every day at 25:00', None),
+])
+def test_recurrences(command, recurrence):
+    parsed = parse_command(command)
+    assert parsed.recurrence == recurrence
+    assert parsed.delay_minutes is None
+
+
+def test_incomplete_commands():
+    assert parse_command('Send john "hello"') == ParsedCommand('john', 'hello')
+    assert not parse_command('Send john "hello"').is_complete
+    assert parse_command('') == ParsedCommand()
+
+
+def test_cached_parse_shares_entries_across_whitespace():
+    before = parse_cache_info()
+    first = parse_command_cached('Send  zoe "cached"   in 5 minutes')
+    second = parse_command_cached('Send zoe "cached" in 5 minutes')
+    after = parse_cache_info()
+
+    assert first is second == parse_command('Send zoe "cached" in 5 minutes')
+    assert (after.misses - before.misses, after.hits - before.hits) == (1, 1)
+    assert f'whatsapp_scheduler_parse_cache_lookups{{result="hit"}} {after.hits}' in REGISTRY.render()
@@ -0,0 +1,51 @@
+import pytest
+
+import phone_numbers
+from main import WhatsAppScheduler
+from phone_numbers import to_e164, to_e164_or_none
+from transport import FakeTransport
+
+
+@pytest.fixture(autouse=True)
+def india(monkeypatch):
+    """The default country code, whatever WHATSAPP_SCHEDULER_COUNTRY_CODE says"""
+    monkeypatch.setattr(phone_numbers, 'DEFAULT_COUNTRY_CODE', "91")
+
+
+@pytest.mark.parametrize('typed, expected', [
+    ('+44 20 7946 0018', '+442079460018'),
+    ('0044 20 7946 0018', '+442079460018'),
+    ('(555) 123-4567', '+915551234567'),
+    ('098765 43210', '+919876543210'),
+    ('98765.43210', '+919876543210'),
+    ('15551234567', '+15551234567'),
+    ('+1-555-123-4567', '+15551234567'),
+])
+def test_numbers_as_typed_become_e164(typed, expected):
+    assert to_e164(typed) == expected
+
+
+def test_country_code_for_national_numbers():
+    assert to_e164('020 7946 0018', country_code='44') == '+442079460018'
+    assert to_e164('2079460018', country_code='+44') == '+442079460018'
+
+
+@pytest.mark.parametrize('typed', ['', 'call me', '+12', '+1234567890123456', '+0123456789', '555-CALL-NOW'])
+def test_implausible_numbers_are_rejected(typed):
+    with pytest.raises(ValueError, match="invalid phone number"):
+        to_e164(typed)
+    assert to_e164_or_none(typed) is None
+
+
+def test_numbers_are_canonical_from_the_time_they_are_written(tmp_path):
+    scheduler = WhatsAppScheduler(str(tmp_path / "scheduler.db"), transport=FakeTransport())
+    try:
+        assert scheduler.save_contact("John", "098765 43210") == "+919876543210"
+        with pytest.raises(ValueError):
+            scheduler.save_contact("eve", "not a number")
+        scheduler.schedule("john", "hi", delay_minutes=5)
+        assert scheduler.storage.query("SELECT phone_e164 FROM contacts") == [("+919876543210",)]
+        assert scheduler.storage.query("SELECT phone_e164 FROM scheduled_messages") == [("+919876543210",)]
+    finally:
+        scheduler.close()
+        scheduler.storage.close()
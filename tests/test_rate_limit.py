@@ -0,0 +1,127 @@
+import pytest
+
+import rate_limit
+from dispatcher import claim_next_batches
+from rate_limit import DEFAULT_RATE_LIMIT, RateLimiter, TokenBucket, create_rate_limiter
+from storage import now_ms
+from transport import OutgoingMessage
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def messages(phone_number, count):
+    return [OutgoingMessage(phone_number, f"Message {i}") for i in range(count)]
+
+
+def test_bucket_refills_continuously_up_to_its_capacity():
+    clock = Clock()
+    bucket = TokenBucket(rate_per_minute=20, capacity=5, clock=clock)
+    for _ in range(5):
+        bucket.take()
+    assert bucket.level() == 0
+    assert bucket.wait_time() == pytest.approx(3.0)
+
+    clock.now += 6
+    assert bucket.level() == pytest.approx(2.0)
+    clock.now += 600
+    assert bucket.level() == 5
+
+
+def test_recipient_budget_defers_only_that_recipient():
+    clock = Clock()
+    limiter = RateLimiter(global_per_minute=60, global_burst=100, recipient_per_minute=6,
+                          recipient_burst=3, clock=clock)
+
+    admitted, deferred = limiter.admit([messages("+1555000001", 5), messages("+1555000002", 2)])
+
+    assert [len(batch) for batch in admitted] == [3, 2]
+    # The recipient refills one token every 10 s; later messages queue up behind each other
+    assert [message.text for message, _ in deferred] == ["Message 3", "Message 4"]
+    assert [wait for _, wait in deferred] == pytest.approx([10.0, 20.0])
+
+    clock.now += 10
+    admitted, deferred = limiter.admit([messages("+1555000001", 2)])
+    assert [len(batch) for batch in admitted] == [1] and len(deferred) == 1
+
+
+def test_global_budget_is_shared_by_every_recipient():
+    clock = Clock()
+    limiter = RateLimiter(global_per_minute=30, global_burst=4, recipient_per_minute=60,
+                          recipient_burst=10, clock=clock)
+
+    admitted, deferred = limiter.admit([messages(f"+155500000{i}", 2) for i in range(3)])
+
+    assert [len(batch) for batch in admitted] == [2, 2]
+    assert [wait for _, wait in deferred] == pytest.approx([2.0, 4.0])
+    assert limiter.available() == 0
+    clock.now += 4
+    assert limiter.available() == 2
+
+
+def test_full_recipient_buckets_are_forgotten(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'MAX_TRACKED_RECIPIENTS', 2)
+    clock = Clock()
+    limiter = RateLimiter(global_burst=100, clock=clock)
+    limiter.admit([messages(f"+155500000{i}", 1) for i in range(3)])
+    clock.now += 60
+
+    limiter.admit([messages("+1555000009", 1)])
+
+    assert list(limiter.levels()['recipients']) == ["+1555000009"]
+
+
+def test_create_rate_limiter():
+    assert create_rate_limiter(DEFAULT_RATE_LIMIT) is None
+    assert create_rate_limiter("off") is None
+    limiter = create_rate_limiter("global=30, burst=10,recipient=6")
+    assert limiter.levels()['global_capacity'] == 10
+    with pytest.raises(ValueError):
+        create_rate_limiter("per_hour=100")
+
+
+def add_due(storage, phone_number, count):
+    due = now_ms() - 1000
+    with storage.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO scheduled_messages (recipient_name, phone_number, phone_e164, message, scheduled_time)
+            VALUES ('r', ?, ?, ?, ?)
+        ''', [(phone_number, phone_number, f"Message {i}", due + i) for i in range(count)])
+
+
+def test_messages_over_budget_are_deferred_not_dropped(storage):
+    add_due(storage, "+1555000001", 5)
+    limiter = RateLimiter(global_per_minute=60, global_burst=100, recipient_per_minute=6, recipient_burst=3)
+    scheduled = []
+
+    [batch] = claim_next_batches(storage, "owner", on_scheduled=scheduled.append, limiter=limiter)
+
+    assert [message.text for message in batch] == ["Message 0", "Message 1", "Message 2"]
+    rows = storage.query('''
+        SELECT message, status, claimed_by, next_attempt_at, attempts FROM scheduled_messages
+        WHERE status != 'sending' ORDER BY id
+    ''')
+    assert [row[:3] + row[4:] for row in rows] == [("Message 3", 'pending', None, 0),
+                                                   ("Message 4", 'pending', None, 0)]
+    later = now_ms()
+    assert later + 5_000 < rows[0][3] < rows[1][3] <= later + 21_000
+    assert scheduled == [rows[0][3] / 1000, rows[1][3] / 1000]
+    # Not due again until then
+    assert claim_next_batches(storage, "owner", limiter=limiter) is None
+
+
+def test_nothing_is_claimed_while_the_global_budget_is_spent(storage):
+    add_due(storage, "+1555000001", 3)
+    clock = Clock()
+    limiter = RateLimiter(global_per_minute=6, global_burst=1, clock=clock)
+    assert len(claim_next_batches(storage, "owner", limiter=limiter)[0]) == 1
+    scheduled = []
+
+    assert claim_next_batches(storage, "owner", on_scheduled=scheduled.append, limiter=limiter) is None
+    assert storage.query_one("SELECT COUNT(*) FROM scheduled_messages WHERE status = 'pending'")[0] == 2
+    assert len(scheduled) == 1
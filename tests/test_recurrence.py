@@ -0,0 +1,157 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from dispatcher import claim_due_messages
+from recurrence import (add_recurring_schedule, cancel_recurring_schedule, list_recurring_schedules,
+                        materialize_next_occurrences, parse_rule)
+from storage import from_epoch_ms, to_epoch_ms
+
+MONDAY = datetime(2024, 1, 1, 10, 0)
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    """Local time in a zone with daylight saving (clocks change on 2024-03-10 and 2024-11-03)"""
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def fires(rule, after, count):
+    rule = parse_rule(rule)
+    times, previous = [], None
+    for _ in range(count):
+        previous = rule.next_fire(after if previous is None else previous, previous)
+        times.append(previous)
+    return times
+
+
+def test_interval_rules():
+    assert fires("every 30 minutes", MONDAY, 3) == [MONDAY + timedelta(minutes=30 * n) for n in (1, 2, 3)]
+    assert fires("every 2 hours", MONDAY, 2) == [datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 14)]
+    # 'at' sets the first fire time; today's has passed
+    assert fires("every 3 days at 09:00", MONDAY, 2) == [datetime(2024, 1, 2, 9), datetime(2024, 1, 5, 9)]
+    assert fires("Every 2  Weeks at 11:15", MONDAY, 2) == [datetime(2024, 1, 1, 11, 15),
+                                                           datetime(2024, 1, 15, 11, 15)]
+
+
+def test_interval_skips_missed_occurrences():
+    rule = parse_rule("every 1 hour")
+    previous = datetime(2024, 1, 1, 8, 0)
+    # The machine was off from 08:00 to 11:20: the next fire is 12:00, not 09:00
+    assert rule.next_fire(datetime(2024, 1, 1, 11, 20), previous) == datetime(2024, 1, 1, 12, 0)
+
+
+def test_daily_weekdays_and_weekly_rules():
+    assert fires("daily at 09:00", MONDAY, 2) == [datetime(2024, 1, 2, 9), datetime(2024, 1, 3, 9)]
+    friday = datetime(2024, 1, 5, 18, 0)
+    assert fires("weekdays at 09:00", friday, 2) == [datetime(2024, 1, 8, 9), datetime(2024, 1, 9, 9)]
+    assert fires("weekly on mon,thu at 18:30", MONDAY, 3) == [
+        datetime(2024, 1, 1, 18, 30), datetime(2024, 1, 4, 18, 30), datetime(2024, 1, 8, 18, 30)]
+    assert fires("weekly on sunday at 07:00", MONDAY, 1) == [datetime(2024, 1, 7, 7)]
+
+
+def test_cron_rules():
+    assert fires("cron */15 9-10 * * *", MONDAY, 3) == [
+        datetime(2024, 1, 1, 10, 15), datetime(2024, 1, 1, 10, 30), datetime(2024, 1, 1, 10, 45)]
+    # 7 is Sunday, like 0
+    assert fires("cron 0 8 * * 7", MONDAY, 1) == [datetime(2024, 1, 7, 8)]
+    # The next fire is strictly after the given time
+    assert parse_rule("cron 0 10 * * *").next_fire(MONDAY) == datetime(2024, 1, 2, 10)
+
+
+def test_cron_month_and_day_edges():
+    # Months without a 31st are skipped
+    assert fires("cron 0 9 31 * *", datetime(2024, 1, 31, 12), 3) == [
+        datetime(2024, 3, 31, 9), datetime(2024, 5, 31, 9), datetime(2024, 7, 31, 9)]
+    # 29 February only in leap years
+    assert fires("cron 0 9 29 2 *", datetime(2024, 3, 1), 1) == [datetime(2028, 2, 29, 9)]
+    # The year rolls over
+    assert fires("cron 0 0 1 1 *", datetime(2024, 6, 1), 1) == [datetime(2025, 1, 1)]
+    # Day of month and day of week both restricted: either matches (the 15th, or Mondays)
+    assert fires("cron 0 9 15 * 1", datetime(2024, 1, 9), 3) == [
+        datetime(2024, 1, 15, 9), datetime(2024, 1, 22, 9), datetime(2024, 1, 29, 9)]
+    assert fires("cron 0 9 13 * 5", datetime(2024, 9, 1), 2) == [datetime(2024, 9, 6, 9), datetime(2024, 9, 13, 9)]
+
+
+def test_daylight_saving_keeps_the_wall_clock_time(new_york):
+    assert fires("daily at 09:00", datetime(2024, 3, 9, 12), 2) == [datetime(2024, 3, 10, 9),
+                                                                    datetime(2024, 3, 11, 9)]
+    # ... so the day the clocks go forward is 23 hours long, the day they go back 25
+    assert to_epoch_ms(datetime(2024, 3, 10, 9)) - to_epoch_ms(datetime(2024, 3, 9, 9)) == 23 * 3600_000
+    assert to_epoch_ms(datetime(2024, 11, 3, 9)) - to_epoch_ms(datetime(2024, 11, 2, 9)) == 25 * 3600_000
+
+    # 02:30 does not exist on 10 March; the occurrence goes out at 03:30 and the rule continues
+    skipped = parse_rule("daily at 02:30").next_fire(datetime(2024, 3, 9, 12))
+    assert skipped == datetime(2024, 3, 10, 2, 30)
+    assert from_epoch_ms(to_epoch_ms(skipped)) == datetime(2024, 3, 10, 3, 30)
+    assert parse_rule("daily at 02:30").next_fire(datetime(2024, 3, 10, 3, 30), skipped) == \
+        datetime(2024, 3, 11, 2, 30)
+
+    # 01:30 happens twice on 3 November; it fires once
+    assert fires("cron 30 1 * * *", datetime(2024, 11, 2, 12), 2) == [datetime(2024, 11, 3, 1, 30),
+                                                                     datetime(2024, 11, 4, 1, 30)]
+
+
+@pytest.mark.parametrize('rule', [
+    "every 0 minutes", "every 2 hours at 09:00", "daily at 25:00", "weekly on funday at 09:00",
+    "cron 0 9 * *", "cron 60 9 * * *", "cron 0 9 32 * *", "sometimes",
+])
+def test_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        parse_rule(rule)
+
+
+def test_a_rule_that_never_fires_is_rejected():
+    with pytest.raises(ValueError, match="never fires"):
+        parse_rule("cron 0 9 30 2 *").next_fire(MONDAY)
+
+
+def pending_occurrences(storage):
+    return storage.query('''
+        SELECT recurring_id, scheduled_time FROM scheduled_messages WHERE status = 'pending' ORDER BY id
+    ''')
+
+
+def test_claiming_an_occurrence_materializes_the_next(storage):
+    now = datetime.now().replace(second=0, microsecond=0)
+    schedule_id, first = add_recurring_schedule(storage, 'john', '+15551234567', 'Stand-up',
+                                                "every 30 minutes", now - timedelta(hours=2))
+    assert first == now - timedelta(minutes=90)
+    assert pending_occurrences(storage) == [(schedule_id, to_epoch_ms(first))]
+
+    scheduled = []
+    [[message]] = claim_due_messages(storage, 'owner', on_scheduled=scheduled.append)
+
+    assert message.text == 'Stand-up' and message.scheduled_time == to_epoch_ms(first)
+    # Missed occurrences are skipped; the next one is the first future slot
+    next_fire = now + timedelta(minutes=30)
+    assert pending_occurrences(storage) == [(schedule_id, to_epoch_ms(next_fire))]
+    assert scheduled == [next_fire.timestamp()]
+    assert list_recurring_schedules(storage) == [
+        (schedule_id, 'john', 'Stand-up', 'every 30 minutes', to_epoch_ms(next_fire))]
+    assert claim_due_messages(storage, 'owner') == []
+
+
+def test_an_occurrence_is_materialized_once(storage):
+    schedule_id, first = add_recurring_schedule(storage, 'john', '+15551234567', 'Hi', "daily at 09:00")
+    with storage.transaction() as cursor:
+        assert len(materialize_next_occurrences(cursor, [(schedule_id, to_epoch_ms(first))])) == 1
+        # Again, e.g. after the occurrence was retried: the next one exists already
+        assert materialize_next_occurrences(cursor, [(schedule_id, to_epoch_ms(first))]) == []
+    assert len(pending_occurrences(storage)) == 2
+
+
+def test_cancel_ends_the_schedule(storage):
+    schedule_id, _ = add_recurring_schedule(storage, 'john', '+15551234567', 'Hi', "weekdays at 09:00")
+
+    assert cancel_recurring_schedule(storage, schedule_id)
+    assert not cancel_recurring_schedule(storage, schedule_id)
+    assert pending_occurrences(storage) == []
+    assert list_recurring_schedules(storage) == []
+    with storage.transaction() as cursor:
+        assert materialize_next_occurrences(cursor, [(schedule_id, 0)]) == []
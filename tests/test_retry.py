@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from dispatcher import claim_messages, record_results, register_queue_metrics
+from metrics import MetricsRegistry
+from retry import (RetryPolicy, count_dead_letters, create_retry_policy, list_dead_letters,
+                   move_to_dead_letters, replay_dead_letters)
+from storage import now_ms
+from transport import OutgoingMessage, SendResult
+
+
+def add_message(storage, recipient="john", status='pending', attempts=0):
+    return storage.execute('''
+        INSERT INTO scheduled_messages
+            (recipient_name, phone_number, phone_e164, message, scheduled_time, status, attempts)
+        VALUES (?, '+15551234567', '+15551234567', 'Hi', ?, ?, ?)
+    ''', (recipient, now_ms() - 1000, status, attempts)).lastrowid
+
+
+def fail(message_id, error="TimeoutError: chat not loaded", retryable=True):
+    return SendResult(OutgoingMessage('+15551234567', 'Hi', message_id), False, error, retryable)
+
+
+def test_backoff_doubles_up_to_the_cap_with_equal_jitter():
+    policy = RetryPolicy(base_delay=30, max_delay=200, rng=random.Random(7))
+    for attempts, backoff in [(1, 30), (2, 60), (3, 120), (4, 200), (10, 200)]:
+        delays = [policy.delay(attempts) for _ in range(200)]
+        assert all(backoff / 2 <= delay <= backoff for delay in delays)
+        # The jittered half spreads retries out
+        assert max(delays) - min(delays) > backoff / 4
+
+
+def test_create_retry_policy():
+    policy = create_retry_policy("max_attempts=3, base_delay=10,max_delay=60")
+    assert (policy.max_attempts, policy.base_delay, policy.max_delay) == (3, 10.0, 60.0)
+    with pytest.raises(ValueError):
+        create_retry_policy("jitter=1")
+
+
+def test_failed_sends_are_retried_then_dead_lettered(storage):
+    message_id = add_message(storage)
+    policy = RetryPolicy(max_attempts=3, base_delay=30, rng=random.Random(1))
+
+    for attempt in (1, 2):
+        claim_messages(storage, "owner", [message_id])
+        before = now_ms()
+        retry_at = record_results(storage, [fail(message_id)], "owner", policy)[message_id]
+        status, attempts, next_attempt_at, last_error = storage.query_one(
+            "SELECT status, attempts, next_attempt_at, last_error FROM scheduled_messages WHERE id = ?",
+            (message_id,))
+        assert (status, attempts, last_error) == ('pending', attempt, "TimeoutError: chat not loaded")
+        assert next_attempt_at == retry_at * 1000
+        assert before + 15_000 * 2 ** (attempt - 1) <= next_attempt_at <= now_ms() + 30_000 * 2 ** (attempt - 1)
+
+    claim_messages(storage, "owner", [message_id])
+    assert record_results(storage, [fail(message_id)], "owner", policy) == {message_id: None}
+    assert storage.query_one("SELECT COUNT(*) FROM scheduled_messages")[0] == 0
+    [(_, recipient, _, _, attempts, last_error, _)] = list_dead_letters(storage)
+    assert (recipient, attempts, last_error) == ('john', 3, "TimeoutError: chat not loaded")
+
+
+def test_errors_that_retrying_cannot_fix_are_dead_lettered_at_once(storage):
+    message_id = add_message(storage)
+    claim_messages(storage, "owner", [message_id])
+
+    outcomes = record_results(storage, [fail(message_id, "ValueError: invalid phone number", retryable=False)],
+                              "owner")
+
+    assert outcomes == {message_id: None}
+    assert count_dead_letters(storage) == 1
+
+
+def test_move_and_replay_dead_letters(storage):
+    ids = [add_message(storage, f"r{i}", attempts=5) for i in range(3)]
+    with storage.transaction() as cursor:
+        move_to_dead_letters(cursor, ids)
+    assert count_dead_letters(storage) == 3
+    dead_ids = sorted(row[0] for row in list_dead_letters(storage))
+
+    replayed, due_time = replay_dead_letters(storage, dead_ids[:1])
+    assert replayed == 1 and abs(due_time - now_ms() / 1000) < 5
+    assert storage.query("SELECT recipient_name, status, attempts FROM scheduled_messages") == [
+        ('r0', 'pending', 0)]
+
+    assert replay_dead_letters(storage)[0] == 2
+    assert count_dead_letters(storage) == 0
+    assert replay_dead_letters(storage) == (0, None)
+
+
+def test_send_now_claims_only_pending_messages(storage):
+    pending = add_message(storage, "a")
+    sent = add_message(storage, "b", status='sent')
+
+    claimed = claim_messages(storage, "owner", [pending, sent])
+
+    assert [message.message_id for message in claimed] == [pending]
+
+
+def test_dead_letters_are_counted_in_the_stats(storage):
+    registry = MetricsRegistry()
+    register_queue_metrics(storage, registry)
+    with storage.transaction() as cursor:
+        move_to_dead_letters(cursor, [add_message(storage)])
+
+    assert "whatsapp_scheduler_dead_letters 1" in registry.render()
@@ -0,0 +1,82 @@
+import sys
+import types
+
+from send_timing import PHASES, AdaptiveTiming
+from sessions import screen_probe
+from transport import BrowserTransport, OutgoingMessage, PyWhatKitTransport
+
+
+def batch(count, per_recipient=1):
+    return [OutgoingMessage(f"+1555{i // per_recipient:07d}", f"Message {i}") for i in range(count)]
+
+
+def defaults():
+    return {name: default for name, (default, _, _) in PHASES.items()}
+
+
+def test_pywhatkit_waits_do_not_move_without_a_readiness_check(desktop, clock):
+    timing = AdaptiveTiming(window=5)
+    transport = PyWhatKitTransport(timing=timing)
+
+    results = transport.send(batch(60, per_recipient=3))
+
+    assert all(result.success for result in results)
+    assert timing.waits() == defaults()
+
+
+def test_browser_chat_switches_do_not_move_without_a_readiness_check():
+    timing = AdaptiveTiming(window=5)
+    transport = BrowserTransport(driver='fake', timing=timing)
+
+    results = transport.send(batch(40))
+    transport.close()
+
+    assert all(result.success for result in results)
+    assert timing.get('chat_switch') == PHASES['chat_switch'][0]
+
+
+def test_an_unrelated_send_failure_does_not_inflate_page_load(desktop, clock, monkeypatch, tmp_path):
+    def invalid_number(phone, text, **kwargs):
+        raise ValueError("Country Code Missing in Phone Number!")
+
+    monkeypatch.setitem(sys.modules, 'pywhatkit', types.SimpleNamespace(
+        sendwhatmsg_instantly=invalid_number, sendwhatmsg=invalid_number))
+    path = str(tmp_path / 'send_timing.json')
+    transport = PyWhatKitTransport(timing=AdaptiveTiming(path=path), ready=lambda: True)
+
+    results = transport.send(batch(1))
+
+    assert not results[0].success
+    assert AdaptiveTiming(path=path).waits() == defaults()
+
+
+def test_confirmed_waits_shrink_and_timed_out_waits_grow(desktop, clock):
+    confirmed = AdaptiveTiming(window=5)
+    PyWhatKitTransport(timing=confirmed, ready=lambda: True).send(batch(60, per_recipient=3))
+    timed_out = AdaptiveTiming(window=5)
+    PyWhatKitTransport(timing=timed_out, ready=lambda: False).send(batch(3, per_recipient=3))
+
+    assert confirmed.get('message_gap') < PHASES['message_gap'][0]
+    assert timed_out.get('message_gap') > PHASES['message_gap'][0]
+    # pywhatkit's own page-load wait has no readiness signal either way.
+    assert confirmed.get('page_load') == timed_out.get('page_load') == PHASES['page_load'][0]
+
+
+def test_screen_probe_passes_while_the_image_is_on_screen(monkeypatch):
+    class ImageNotFoundException(Exception):
+        pass
+
+    on_screen = []
+
+    def locate_on_screen(image):
+        if image not in on_screen:
+            raise ImageNotFoundException(image)
+        return (0, 0, 10, 10)
+
+    monkeypatch.setitem(sys.modules, 'pyautogui', types.SimpleNamespace(
+        locateOnScreen=locate_on_screen, ImageNotFoundException=ImageNotFoundException))
+    ready = screen_probe('chat_input.png')
+
+    assert not ready()
+    on_screen.append('chat_input.png')
+    assert ready()
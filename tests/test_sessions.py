@@ -0,0 +1,59 @@
+from send_timing import PHASES, AdaptiveTiming
+from sessions import FakeBrowserDriver, SessionPool, WhatsAppWebDriver
+from transport import BrowserTransport
+
+
+def test_whatsapp_web_driver_pastes_text(desktop):
+    driver = WhatsAppWebDriver(AdaptiveTiming(learn=False))
+    driver.type_text("مرحبا 👋\nçà")
+    assert desktop == [('paste', "مرحبا 👋\nçà")]
+
+
+def test_chat_switch_ends_when_the_chat_is_ready(desktop, clock):
+    timing = AdaptiveTiming(window=5)
+    polls = []
+
+    def ready():
+        polls.append(clock[0])
+        return len(polls) % 5 == 0  # the chat shows up after 0.4 s
+
+    driver = WhatsAppWebDriver(timing, ready=ready)
+    start = clock[0]
+    driver.open_chat("+15551234567", "Hi")
+
+    assert clock[0] - start < 0.5
+    assert desktop[-1] == ('press', 'enter')
+    for _ in range(4):
+        driver.open_chat("+15551234567", "Hi")
+    # Five confirmed switches in a row: the wait (now the timeout) shrinks
+    assert timing.get('chat_switch') < PHASES['chat_switch'][0]
+
+
+def test_browser_transport_passes_the_ready_image_to_the_driver():
+    transport = BrowserTransport(ready_image="chat_input.png")
+    driver = transport.pool.new_driver()
+    assert driver.ready is not None and driver.timing is transport.timing
+
+
+def test_pool_prefers_the_session_with_the_chat_open():
+    pool = SessionPool(FakeBrowserDriver, size=2)
+    first, second = pool.acquire(), pool.acquire()
+    first.chat, second.chat = "+1555000001", "+1555000002"
+    pool.release(first)
+    pool.release(second)
+
+    assert pool.acquire("+1555000001") is first
+    assert pool.acquire("+1555000003") is second
+    assert pool.stats()['opened'] == 2
+
+
+def test_pool_recycles_worn_out_and_failed_sessions():
+    pool = SessionPool(FakeBrowserDriver, size=1, max_sends=2)
+    session = pool.acquire()
+    session.sends = 2
+    pool.release(session)
+    session = pool.acquire()
+    pool.release(session, healthy=False)
+
+    assert pool.stats() == {'open': 0, 'idle': 0, 'opened': 2, 'recycled': 2}
+    assert session.driver.closed
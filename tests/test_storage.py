@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+import pytest
+
+from storage import DataVersionWatcher, Storage, from_epoch_ms, to_epoch_ms
+
+
+def test_epoch_ms_round_trip():
+    moment = datetime(2024, 3, 10, 8, 30, 15, 250000)
+    assert from_epoch_ms(to_epoch_ms(moment)) == moment
+    assert to_epoch_ms(datetime(2024, 3, 10, 8, 30)) % 60000 == 0
+
+
+def test_text_times_of_an_old_database_become_epoch_ms(tmp_path):
+    path = str(tmp_path / "scheduler.db")
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE scheduled_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient_name TEXT NOT NULL,
+            phone_number TEXT NOT NULL,
+            message TEXT NOT NULL,
+            scheduled_time TIMESTAMP NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            sent_at TIMESTAMP NULL
+        );
+        CREATE TABLE contacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            phone_number TEXT NOT NULL
+        );
+    ''')
+    conn.executemany('''
+        INSERT INTO scheduled_messages (recipient_name, phone_number, message, scheduled_time, status, sent_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [("john", "+15551234567", "pending", str(datetime(2024, 1, 5, 9, 30)), 'pending', None),
+          ("john", "+15551234567", "sent", str(datetime(2024, 1, 4, 18, 0)), 'sent',
+           str(datetime(2024, 1, 4, 18, 0, 7)))])
+    conn.commit()
+    conn.close()
+
+    storage = Storage(path)
+    storage.init_schema()
+    rows = storage.query("SELECT scheduled_time, sent_at FROM scheduled_messages ORDER BY id")
+    assert rows == [(to_epoch_ms(datetime(2024, 1, 5, 9, 30)), None),
+                    (to_epoch_ms(datetime(2024, 1, 4, 18, 0)), to_epoch_ms(datetime(2024, 1, 4, 18, 0, 7)))]
+
+    # Migrating is done once; opening the database again changes nothing
+    storage.init_schema()
+    assert storage.query("SELECT scheduled_time, sent_at FROM scheduled_messages ORDER BY id") == rows
+    storage.close()
+
+
+def test_each_thread_keeps_one_wal_connection(storage):
+    conn = storage.connection()
+    assert storage.connection() is conn
+    assert storage.query_one("PRAGMA journal_mode") == ('wal',)
+
+    others = []
+    thread = threading.Thread(target=lambda: others.extend([storage.connection(), storage.connection()]))
+    thread.start()
+    thread.join()
+    assert others[0] is others[1] is not conn
+    assert len(storage._connections) == 2
+
+
+def test_a_failed_transaction_is_rolled_back(storage):
+    with pytest.raises(RuntimeError):
+        with storage.transaction() as cursor:
+            cursor.execute("INSERT INTO contacts (name, phone_number) VALUES ('john', '+15551234567')")
+            with storage.transaction() as inner:  # joins the outer transaction
+                inner.execute("INSERT INTO contacts (name, phone_number) VALUES ('jane', '+15557654321')")
+            raise RuntimeError("abort")
+    assert storage.query("SELECT name FROM contacts") == []
+    assert not storage.connection().in_transaction
+
+
+def test_watcher_sees_commits_from_other_connections_only(storage):
+    watcher = DataVersionWatcher(storage)
+    assert not watcher()
+    storage.execute("INSERT INTO contacts (name, phone_number) VALUES ('john', '+15551234567')")
+    assert not watcher()
+
+    other = Storage(storage.db_path)
+    other.execute("INSERT INTO contacts (name, phone_number) VALUES ('jane', '+15557654321')")
+    other.close()
+    assert watcher()
+    assert not watcher()
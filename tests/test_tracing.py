@@ -0,0 +1,73 @@
+import json
+import pstats
+import threading
+
+import pytest
+
+from tracing import TRACER, Tracer, run_entry_point, span
+
+
+def read_spans(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spans_are_free_and_unwritten_while_tracing_is_off(tmp_path):
+    tracer = Tracer()
+    with tracer.span('idle', size=1) as idle:
+        idle.set(more=2)
+    # One shared do-nothing span
+    assert tracer.span('other') is idle
+
+    tracer.enable(str(tmp_path / "trace.jsonl"))
+    tracer.disable()
+    with tracer.span('after'):
+        pass
+    assert read_spans(tmp_path / "trace.jsonl") == []
+
+
+def other_thread_work(tracer):
+    with tracer.span('other'):
+        pass
+
+
+def test_spans_nest_per_thread_and_keep_errors(tmp_path):
+    tracer = Tracer()
+    tracer.enable(str(tmp_path / "trace.jsonl"))
+    with tracer.span('outer', kind='test') as outer:
+        with pytest.raises(KeyError):
+            with tracer.span('inner'):
+                raise KeyError('missing')
+        outer.set(done=True)
+        # A span on another thread does not nest under this one
+        thread = threading.Thread(target=other_thread_work, args=(tracer,))
+        thread.start()
+        thread.join()
+    tracer.disable()
+
+    spans = {record['name']: record for record in read_spans(tmp_path / "trace.jsonl")}
+    assert spans['inner']['parent'] == spans['outer']['span']
+    assert spans['inner']['error'] == "KeyError: 'missing'"
+    assert spans['outer']['parent'] is None and spans['other']['parent'] is None
+    assert spans['outer']['kind'] == 'test' and spans['outer']['done'] is True
+    assert spans['outer']['duration_ms'] >= spans['inner']['duration_ms']
+
+
+def test_entry_point_traces_and_profiles(tmp_path):
+    trace, profile = str(tmp_path / "trace.jsonl"), str(tmp_path / "run.prof")
+
+    def busy():
+        return sum(range(10000))
+
+    def main():
+        with span('main.work'):
+            thread = threading.Thread(target=busy)
+            thread.start()
+            thread.join()
+
+    run_entry_point(main, "test", "unused.prof", ['--trace', trace, '--profile', profile])
+
+    assert not TRACER.enabled
+    assert [record['name'] for record in read_spans(trace)] == ['main.work']
+    functions = {name for _, _, name in pstats.Stats(profile).stats}
+    assert {'main', 'busy'} <= functions
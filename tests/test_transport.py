@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from transport import (FakeTransport, OutgoingMessage, PyWhatKitTransport, Transport, create_transport,
+                       deliver_batch, deliver_batch_async)
+
+
+def test_messages_in_an_open_chat_keep_non_ascii_text(desktop):
+    texts = ["مرحبا", "🎉 Glückwunsch", "line one\nline two"]
+    batch = [OutgoingMessage("+15551234567", text) for text in texts]
+
+    results = PyWhatKitTransport().send(batch)
+
+    assert all(result.success for result in results)
+    assert ('url', texts[0]) in desktop
+    assert [text for kind, text in desktop if kind == 'paste'] == texts[1:]
+    assert not [entry for entry in desktop if entry[0] == 'write']
+
+
+def test_create_transport_parses_options():
+    transport = create_transport("fake:latency=0.5,failure_rate=0.25,seed=7")
+    assert isinstance(transport, FakeTransport)
+    assert (transport.latency, transport.failure_rate) == (0.5, 0.25)
+    assert isinstance(create_transport("pywhatkit"), PyWhatKitTransport)
+    with pytest.raises(ValueError, match="Unknown transport"):
+        create_transport("carrier-pigeon")
+
+
+def test_fake_transport_records_what_it_sent():
+    batch = [OutgoingMessage("+15550000001", "a"), OutgoingMessage("+15550000001", "b"),
+             OutgoingMessage("+15550000002", "c")]
+    transport = FakeTransport()
+
+    assert all(result.success for result in deliver_batch(transport, batch))
+    assert asyncio.run(deliver_batch_async(transport, batch[2:]))[0].success
+    assert [message.text for message in transport.sent] == ["a", "b", "c", "c"]
+    # One session per run of messages to the same number
+    assert transport.sessions == 3
+
+
+def test_fake_failures_are_seeded():
+    batch = [OutgoingMessage(f"+1555000{i:04d}", "hi") for i in range(50)]
+
+    def outcomes():
+        return [result.success for result in FakeTransport(failure_rate=0.5, seed=3).send(batch)]
+
+    assert outcomes() == outcomes()
+    assert 0 < outcomes().count(False) < 50
+    assert not any(result.success for result in FakeTransport(failure_rate=1).send(batch))
+
+
+def test_a_raising_transport_fails_the_whole_batch():
+    class Broken(Transport):
+        name = "broken"
+
+        def send(self, batch):
+            raise ConnectionError("offline")
+
+    results = deliver_batch(Broken(), [OutgoingMessage("+15550000001", "a"), OutgoingMessage("+15550000001", "b")])
+    assert [(result.success, result.error) for result in results] == [(False, "ConnectionError: offline")] * 2
@@ -0,0 +1,47 @@
+from whatsapp_scheduler_gui import fetch_message_page
+
+
+def add_messages(storage, count, start=0, recipient="john", status='pending'):
+    storage.executemany('''
+        INSERT INTO scheduled_messages
+            (recipient_name, phone_number, phone_e164, message, scheduled_time, status)
+        VALUES (?, '+15551234567', '+15551234567', ?, ?, ?)
+    ''', [(recipient, f"m{i}", 1_700_000_000_000 + i * 60000, status) for i in range(start, start + count)])
+
+
+def page_ids(rows):
+    return [key[1] for key, _ in rows]
+
+
+def test_pages_run_newest_first_until_the_cursor_is_none(storage):
+    add_messages(storage, 25)
+    seen = []
+    cursor = None
+    for _ in range(3):
+        rows, cursor = fetch_message_page(storage, cursor, page_size=10)
+        seen.extend(page_ids(rows))
+    assert cursor is None
+    assert seen == list(range(25, 0, -1))
+
+    (key, (values, tags)), *_ = fetch_message_page(storage, page_size=10)[0]
+    assert values[0] == "John" and values[1] == "m24" and values[3] == "Pending"
+    assert tags == ("25",)
+
+
+def test_rows_added_after_a_page_do_not_shift_the_next_one(storage):
+    add_messages(storage, 20)
+    _, cursor = fetch_message_page(storage, page_size=10)
+    add_messages(storage, 5, start=100)
+    second, _ = fetch_message_page(storage, cursor, page_size=10)
+    assert page_ids(second) == list(range(10, 0, -1))
+
+
+def test_filters_are_applied_before_paging(storage):
+    add_messages(storage, 5)
+    add_messages(storage, 5, start=5, recipient="Sarah", status='sent')
+
+    rows, cursor = fetch_message_page(storage, status='sent', page_size=10)
+    assert page_ids(rows) == [10, 9, 8, 7, 6] and cursor is None
+    rows, _ = fetch_message_page(storage, recipient='sarah', page_size=3)
+    assert page_ids(rows) == [10, 9, 8]
+    assert fetch_message_page(storage, status='sent', recipient='john')[0] == []
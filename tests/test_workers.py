@@ -0,0 +1,65 @@
+import random
+import threading
+import time
+
+from transport import OutgoingMessage, SendResult, Transport
+from workers import SendPool
+
+
+class SlowTransport(Transport):
+    """Sends after a random delay and records delivery order and overlap"""
+
+    max_concurrency = 8
+
+    def __init__(self):
+        self.delivered = []
+        self.active = 0
+        self.most_active = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(1)
+
+    def send(self, batch):
+        with self._lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+            delay = self._random.uniform(0, 0.005)
+        time.sleep(delay)
+        with self._lock:
+            self.active -= 1
+            self.delivered.extend(batch)
+        return [SendResult(message, True) for message in batch]
+
+
+def test_batches_for_a_recipient_keep_their_order():
+    transport = SlowTransport()
+    pool = SendPool(transport, workers=4)
+    recipients = [f"+1555000{i:04d}" for i in range(16)]
+    for i in range(10):
+        for recipient in recipients:
+            pool.submit(recipient, [OutgoingMessage(recipient, str(i))])
+    pool.join()
+    pool.close()
+
+    for recipient in recipients:
+        texts = [message.text for message in transport.delivered if message.phone_number == recipient]
+        assert texts == [str(i) for i in range(10)]
+    # Different recipients went out in parallel, at most one per worker
+    assert 1 < transport.most_active <= 4
+
+
+def test_workers_are_capped_by_the_transport():
+    transport = SlowTransport()
+    transport.max_concurrency = 1
+    assert SendPool(transport, workers=4).workers == 1
+
+
+def test_a_failing_callback_does_not_stop_its_worker():
+    pool = SendPool(SlowTransport(), workers=1)
+
+    def broken(results):
+        raise RuntimeError("callback failed")
+
+    pool.submit("+15550000001", [OutgoingMessage("+15550000001", "a")], broken)
+    results = pool.send("+15550000001", [OutgoingMessage("+15550000001", "b")])
+    assert [result.message.text for result in results] == ["b"]
+    pool.close()
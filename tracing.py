@@ -0,0 +1,205 @@
+import argparse
+import cProfile
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+# Timing spans are opt-in: set WHATSAPP_SCHEDULER_TRACE to a file name (or
+# pass --trace) and every span is appended to it as one JSON line:
+#
+#   {"name": "send.instant", "start": 1760000000.123, "duration_ms": 10342.1,
+#    "span": 17, "parent": 12, "thread": "Thread-3", "phone_number": "+91..."}
+#
+# Spans nest per thread through "parent".  The file rotates at
+# TRACE_MAX_BYTES, keeping TRACE_BACKUPS old files.
+
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+
+class _NullSpan:
+    """What span() returns while tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed operation; set() adds attributes before it ends"""
+
+    __slots__ = ('tracer', 'name', 'attributes', 'span_id', 'parent_id', 'start', '_started')
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.span_id = next(self.tracer._ids)
+        self.parent_id = stack[-1] if stack else None
+        stack.append(self.span_id)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        self.tracer._stack().pop()
+        if exc_type is not None:
+            self.attributes['error'] = f"{exc_type.__name__}: {exc}"
+        self.tracer._write(self, duration)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Writes timing spans to a rotating JSONL file once enabled.
+
+    span() costs one attribute check while tracing is off, so spans can
+    stay in hot paths (every database statement, every contact lookup).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path: Optional[str] = None
+        self._logger: Optional[logging.Logger] = None
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    def enable(self, path: str, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        """Start appending spans to path"""
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger(f'whatsapp_scheduler.trace.{id(self)}')
+        logger.handlers[:] = [handler]
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        self._logger = logger
+        self.path = path
+        self.enabled = True
+
+    def disable(self):
+        """Stop tracing and close the trace file"""
+        self.enabled = False
+        if self._logger:
+            for handler in self._logger.handlers:
+                handler.close()
+            self._logger.handlers[:] = []
+
+    def span(self, name: str, **attributes):
+        """Context manager timing the with block as a span called name"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, attributes)
+
+    def _stack(self) -> List[int]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _write(self, span: Span, duration: float):
+        logger = self._logger
+        if not self.enabled or logger is None:
+            return
+        record = {'name': span.name, 'start': round(span.start, 6), 'duration_ms': round(duration * 1000, 3),
+                  'span': span.span_id, 'parent': span.parent_id, 'thread': threading.current_thread().name}
+        record.update(span.attributes)
+        logger.info(json.dumps(record, default=str))
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes):
+    """TRACER.span(name, **attributes)"""
+    return TRACER.span(name, **attributes)
+
+
+def enable_tracing_from_env():
+    """Enable TRACER if WHATSAPP_SCHEDULER_TRACE names a trace file"""
+    path = os.environ.get("WHATSAPP_SCHEDULER_TRACE")
+    if path:
+        TRACER.enable(path)
+
+
+def run_profiled(func: Callable[[], None], output: str, top: int = 25):
+    """Run func under cProfile, including threads it starts, then dump pstats to output.
+
+    The top functions by cumulative time are printed as well; load the
+    file with `python -m pstats <output>` for more.
+    """
+    profiles: List[cProfile.Profile] = []
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # Runs on the first event of every new thread: swap in a profiler.
+        sys.setprofile(None)
+        thread_profile = cProfile.Profile()
+        try:
+            thread_profile.enable()
+        except ValueError:
+            return  # Python 3.12+: the main profiler already sees every thread
+        with lock:
+            profiles.append(thread_profile)
+
+    main_profile = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    main_profile.enable()
+    try:
+        func()
+    finally:
+        main_profile.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main_profile)
+        with lock:
+            thread_profiles = list(profiles)
+        for thread_profile in thread_profiles:
+            thread_profile.create_stats()
+            stats.add(thread_profile)
+        stats.dump_stats(output)
+        print(f"\nProfile written to {output} ({len(thread_profiles) + 1} thread(s))")
+        stats.sort_stats('cumulative').print_stats(top)
+
+
+def run_entry_point(main: Callable[[], None], description: str, default_profile: str,
+                    argv: Optional[List[str]] = None):
+    """Handle --trace/--profile for an entry point, then run main"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--trace', metavar='FILE',
+                        help="append timing spans to this JSONL file (or set WHATSAPP_SCHEDULER_TRACE)")
+    parser.add_argument('--profile', nargs='?', const=default_profile, metavar='FILE',
+                        help=f"run under cProfile and write pstats to FILE (default {default_profile})")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        TRACER.enable(args.trace)
+    else:
+        enable_tracing_from_env()
+    try:
+        if args.profile:
+            run_profiled(main, args.profile)
+        else:
+            main()
+    finally:
+        TRACER.disable()
@@ -0,0 +1,442 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from metrics import REGISTRY, SEND_BUCKETS
+from send_timing import AdaptiveTiming
+from sessions import DRIVERS, SessionPool, paste_text, screen_probe
+from tracing import span
+
+SEND_LATENCY_SECONDS = REGISTRY.histogram(
+    'whatsapp_scheduler_send_latency_seconds',
+    'Delivery time per message (a batch\'s send time divided by its size)', ('transport',), SEND_BUCKETS)
+
+
+@dataclass
+class OutgoingMessage:
+    """A single message handed to a transport; phone_number is in E.164 form"""
+    phone_number: str
+    text: str
+    message_id: Optional[int] = None
+    recipient_name: Optional[str] = None
+    scheduled_time: Optional[int] = None  # epoch ms
+
+
+@dataclass
+class SendResult:
+    """Outcome of delivering one OutgoingMessage"""
+    message: OutgoingMessage
+    success: bool
+    error: Optional[str] = None
+    # False for failures that retrying cannot fix; those are dead-lettered at once.
+    retryable: bool = True
+
+
+def describe_error(error: BaseException) -> str:
+    """Error text for SendResult.error, keeping the exception type"""
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+
+def deliver_batch(transport: 'Transport', batch: List[OutgoingMessage]) -> List[SendResult]:
+    """transport.send(batch), timed, with an exception turned into failed results"""
+    start = time.perf_counter()
+    with span('send.batch', transport=transport.name, messages=len(batch)):
+        try:
+            results = transport.send(batch)
+        except Exception as e:
+            results = [SendResult(message, False, describe_error(e)) for message in batch]
+    per_message = (time.perf_counter() - start) / len(batch)
+    for _ in batch:
+        SEND_LATENCY_SECONDS.observe(per_message, transport=transport.name)
+    return results
+
+
+async def deliver_batch_async(transport: 'Transport', batch: List[OutgoingMessage],
+                              executor: Optional[Executor] = None) -> List[SendResult]:
+    """deliver_batch() for an event loop.
+
+    An is_async transport's send_async() is awaited on the loop (without a
+    span: the tracer nests spans per thread, and tasks share the loop's
+    thread); any other transport runs deliver_batch() on executor.
+    """
+    if not transport.is_async:
+        return await asyncio.get_running_loop().run_in_executor(executor, deliver_batch, transport, batch)
+    start = time.perf_counter()
+    try:
+        results = await transport.send_async(batch)
+    except Exception as e:
+        results = [SendResult(message, False, describe_error(e)) for message in batch]
+    per_message = (time.perf_counter() - start) / len(batch)
+    for _ in batch:
+        SEND_LATENCY_SECONDS.observe(per_message, transport=transport.name)
+    return results
+
+
+def recipient_sessions(batch: List[OutgoingMessage]) -> Iterator[Tuple[str, List[OutgoingMessage]]]:
+    """Split a batch into runs of consecutive messages to the same number"""
+    for phone_number, messages in groupby(batch, key=lambda m: m.phone_number):
+        yield phone_number, list(messages)
+
+
+# Send phases (see send_timing.PHASES) whose waits an instant send uses.
+INSTANT_PHASES = ('page_load',)
+
+
+def next_send_slot(now: datetime, wait_time: float, margin: float = 5.0) -> datetime:
+    """Earliest whole minute pywhatkit.sendwhatmsg can book with this page-load wait.
+
+    pywhatkit opens the chat wait_time before the slot, so the slot has to
+    be more than wait_time (plus a margin) away.
+    """
+    slot = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    while (slot - now).total_seconds() <= wait_time + margin:
+        slot += timedelta(minutes=1)
+    return slot
+
+
+class Transport:
+    """Delivers batches of messages; subclasses implement send()
+
+    Consecutive messages to the same recipient in a batch are delivered
+    through one chat session, in batch order.
+    """
+
+    name = "base"
+    # How many send() calls may run in parallel on this transport.
+    max_concurrency = 1
+    # Transports that implement send_async() natively set is_async, and
+    # say how many of its calls may be awaited at once.
+    is_async = False
+    max_async_concurrency = 1
+
+    def send(self, batch: List[OutgoingMessage]) -> List[SendResult]:
+        """Deliver every message in the batch and return one result per message"""
+        raise NotImplementedError
+
+    async def send_async(self, batch: List[OutgoingMessage]) -> List[SendResult]:
+        """Awaitable send(); the default runs send() on the running loop's default executor"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.send, batch)
+
+    def send_one(self, phone_number: str, text: str) -> bool:
+        """Convenience wrapper for delivering a single message"""
+        return self.send([OutgoingMessage(phone_number, text)])[0].success
+
+    def close(self):
+        """Release any resources held by the transport"""
+
+
+class PyWhatKitTransport(Transport):
+    """Delivers through WhatsApp Web using pywhatkit and pyautogui keystrokes.
+
+    Its waits come from timing.  pywhatkit gives no readiness signal, so
+    its own page-load waits are never learned.  The waits this transport
+    does itself are learned only with a ready check, e.g. a screen probe
+    of the chat input (ready_image, see sessions.screen_probe): they end
+    as soon as it passes, and whether it passed in time is recorded.
+    Without one, nothing is recorded and every wait keeps its value.
+    """
+
+    name = "pywhatkit"
+
+    def __init__(self, timing: Optional[AdaptiveTiming] = None,
+                 ready: Optional[Callable[[], bool]] = None, ready_image: Optional[str] = None):
+        self.timing = timing or AdaptiveTiming(learn=False)
+        self.ready = ready or (screen_probe(ready_image) if ready_image else None)
+
+    def send(self, batch: List[OutgoingMessage]) -> List[SendResult]:
+        results = []
+        for phone_number, messages in recipient_sessions(batch):
+            results.extend(self._send_session(phone_number, messages))
+        return results
+
+    def _send_session(self, phone_number: str, messages: List[OutgoingMessage]) -> List[SendResult]:
+        """Open one chat, send the messages back to back, then close the tab"""
+        with span('send.session', phone_number=phone_number, messages=len(messages)):
+            return self._send_session_messages(phone_number, messages)
+
+    def _send_session_messages(self, phone_number: str, messages: List[OutgoingMessage]) -> List[SendResult]:
+        first, rest = messages[0], messages[1:]
+        try:
+            # Instant send is the more reliable path; fall back to
+            # booking a slot if it raises.
+            try:
+                self._send_instant(phone_number, first.text, tab_close=not rest)
+            except Exception as e:
+                instant_error = describe_error(e)
+                print(f"Instant send failed ({instant_error}), retrying with scheduled send")
+                try:
+                    self._send_scheduled(phone_number, first.text, tab_close=not rest)
+                except Exception as e:
+                    raise RuntimeError(f"instant send: {instant_error}; "
+                                       f"scheduled send: {describe_error(e)}") from e
+        except Exception as e:
+            print(f"Failed to send message: {e}")
+            print("💡 Tip: Make sure WhatsApp Web is accessible and you're logged in")
+            return [SendResult(message, False, str(e)) for message in messages]
+
+        results = [SendResult(first, True)]
+        if not rest:
+            return results
+
+        import pyautogui
+
+        for index, message in enumerate(rest):
+            try:
+                # The chat is already open with the input focused.
+                with span('send.type_message', chars=len(message.text)):
+                    paste_text(message.text)
+                    pyautogui.press('enter')
+                with span('send.wait_after_message'):
+                    self.timing.wait_and_record('message_gap', self.ready)
+                results.append(SendResult(message, True))
+            except Exception as e:
+                print(f"Failed to send message in open chat: {e}")
+                results.extend(SendResult(m, False, describe_error(e)) for m in rest[index:])
+                break
+
+        with span('send.close_tab'):
+            pyautogui.hotkey('ctrl', 'w')
+        print(f"✅ Sent {sum(r.success for r in results)} message(s) in one chat session")
+        return results
+
+    def _send_instant(self, phone_number: str, text: str, tab_close: bool = True):
+        import pywhatkit as pwk
+
+        print(f"Using instant send to {phone_number}")
+
+        # Includes pywhatkit's page-load wait.
+        wait_time = self.timing.get('page_load')
+        with span('send.instant', wait_time=wait_time):
+            pwk.sendwhatmsg_instantly(phone_number, text,
+                                      wait_time=wait_time,  # Wait for page load
+                                      tab_close=tab_close,  # Close after sending
+                                      close_time=3)
+
+    def _send_scheduled(self, phone_number: str, text: str, tab_close: bool = True):
+        import pyautogui
+        import pywhatkit as pwk
+
+        wait_time = self.timing.get('scheduled_page_load')
+        send_at = next_send_slot(datetime.now(), wait_time)
+
+        print(f"Sending WhatsApp message to {phone_number} at {send_at:%H:%M}")
+
+        with span('send.scheduled'):
+            # Send message with proper timing - but don't close tab yet
+            with span('send.book_slot', wait_time=wait_time):
+                pwk.sendwhatmsg(phone_number, text, send_at.hour, send_at.minute,
+                                wait_time=wait_time,
+                                tab_close=False,  # Don't close tab yet - we need to press Enter
+                                close_time=2)
+
+            # Wait a bit more for the message to be typed
+            with span('send.wait_typed'):
+                self.timing.wait_and_record('typed_wait', self.ready)
+
+            # Press Enter to send the message
+            print("Pressing Enter to send the message...")
+            with span('send.press_enter'):
+                pyautogui.press('enter')
+
+            # Wait a moment to confirm sending
+            with span('send.wait_confirm'):
+                self.timing.wait('confirm_wait')
+
+            if tab_close:
+                with span('send.close_tab'):
+                    pyautogui.hotkey('ctrl', 'w')
+                print("✅ Message sent and tab closed!")
+
+
+class FakeTransport(Transport):
+    """In-process stand-in for WhatsApp Web, for headless load testing.
+
+    session_latency is paid once per recipient session (opening a chat),
+    latency once per message; failure_rate is the probability that a
+    message fails.  With page_load set, a session whose learned
+    'page_load' wait (from timing) is shorter fails as a whole and the
+    outcome is recorded, so the learning can be exercised headlessly;
+    the wait itself is not slept.  Its send_async() sleeps on the event
+    loop instead of a thread, so thousands of sends can be in flight.
+    """
+
+    name = "fake"
+    max_concurrency = 64
+    is_async = True
+    max_async_concurrency = 1024
+
+    def __init__(self, latency: float = 0.0, session_latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: Optional[int] = None, page_load: float = 0.0,
+                 timing: Optional[AdaptiveTiming] = None):
+        self.latency = latency
+        self.session_latency = session_latency
+        self.failure_rate = failure_rate
+        self.page_load = page_load
+        self.timing = timing or AdaptiveTiming(learn=False)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.sent: List[OutgoingMessage] = []
+        self.failed: List[OutgoingMessage] = []
+        self.sessions = 0
+
+    def send(self, batch: List[OutgoingMessage]) -> List[SendResult]:
+        results = []
+        for phone_number, messages in recipient_sessions(batch):
+            with span('send.session', phone_number=phone_number, messages=len(messages)):
+                results.extend(self._send_session(messages))
+        return results
+
+    async def send_async(self, batch: List[OutgoingMessage]) -> List[SendResult]:
+        results = []
+        for _, messages in recipient_sessions(batch):
+            if self.session_latency:
+                await asyncio.sleep(self.session_latency)
+            not_loaded = self._open_session(messages)
+            if not_loaded:
+                results.extend(not_loaded)
+                continue
+            for message in messages:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                results.append(self._deliver(message))
+        return results
+
+    def _send_session(self, messages: List[OutgoingMessage]) -> List[SendResult]:
+        if self.session_latency:
+            time.sleep(self.session_latency)
+        not_loaded = self._open_session(messages)
+        if not_loaded:
+            return not_loaded
+
+        results = []
+        for message in messages:
+            if self.latency:
+                time.sleep(self.latency)
+            results.append(self._deliver(message))
+        return results
+
+    def _open_session(self, messages: List[OutgoingMessage]) -> List[SendResult]:
+        """Count a session; the failed results if its page load wait is too short"""
+        with self._lock:
+            self.sessions += 1
+        if self.page_load:
+            ready = self.timing.get('page_load') >= self.page_load
+            self.timing.record(INSTANT_PHASES, ready)
+            if not ready:
+                with self._lock:
+                    self.failed.extend(messages)
+                return [SendResult(message, False, "TimeoutError: chat not loaded yet") for message in messages]
+        return []
+
+    def _deliver(self, message: OutgoingMessage) -> SendResult:
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            (self.failed if failed else self.sent).append(message)
+        if failed:
+            return SendResult(message, False, "simulated failure")
+        return SendResult(message, True)
+
+
+class BrowserTransport(Transport):
+    """Delivers through warm browser sessions kept in a SessionPool.
+
+    Instead of a new WhatsApp Web tab per chat, sends reuse logged-in
+    sessions and load each chat into the same tab; with the real driver
+    that reloads the page from the browser cache, see sessions.py.  driver picks
+    the browser driver ('whatsapp_web', or 'fake' for headless runs) and
+    driver_options go to it.  Sessions are recycled after max_sends
+    messages or on an error.
+    """
+
+    name = "browser"
+
+    def __init__(self, driver: str = "whatsapp_web", sessions: int = 1, max_sends: int = 50,
+                 timing: Optional[AdaptiveTiming] = None, **driver_options):
+        if driver not in DRIVERS:
+            raise ValueError(f"Unknown browser driver '{driver}' (choose from {', '.join(DRIVERS)})")
+        driver_class = DRIVERS[driver]
+        if driver_class.max_sessions is not None:
+            sessions = min(sessions, driver_class.max_sessions)
+        self.timing = timing or AdaptiveTiming(learn=False)
+        self.max_concurrency = sessions
+        self.pool = SessionPool(lambda: driver_class(timing=self.timing, **driver_options),
+                                sessions, max_sends)
+
+    def send(self, batch: List[OutgoingMessage]) -> List[SendResult]:
+        results = []
+        for phone_number, messages in recipient_sessions(batch):
+            with span('send.session', phone_number=phone_number, messages=len(messages)):
+                results.extend(self._send_chat(phone_number, messages))
+        return results
+
+    def _send_chat(self, phone_number: str, messages: List[OutgoingMessage]) -> List[SendResult]:
+        try:
+            session = self.pool.acquire(phone_number)
+        except Exception as e:
+            print(f"No browser session available: {e}")
+            return [SendResult(message, False, describe_error(e)) for message in messages]
+
+        results = []
+        healthy = True
+        try:
+            for index, message in enumerate(messages):
+                try:
+                    if session.chat != phone_number:
+                        # The first message rides in the chat URL, so it may hold any text.
+                        session.chat = None
+                        with span('send.open_chat', session=session.session_id):
+                            session.driver.open_chat(phone_number, message.text)
+                        session.chat = phone_number
+                    else:
+                        with span('send.type_message', chars=len(message.text)):
+                            session.driver.type_text(message.text)
+                    with span('send.submit'):
+                        session.driver.submit()
+                    session.sends += 1
+                    results.append(SendResult(message, True))
+                except Exception as e:
+                    print(f"Failed to send message in browser session {session.session_id}: {e}")
+                    results.extend(SendResult(m, False, describe_error(e)) for m in messages[index:])
+                    healthy = False
+                    break
+        finally:
+            self.pool.release(session, healthy)
+        return results
+
+    def close(self):
+        self.pool.close()
+
+
+TRANSPORTS = {
+    PyWhatKitTransport.name: PyWhatKitTransport,
+    FakeTransport.name: FakeTransport,
+    BrowserTransport.name: BrowserTransport,
+}
+
+
+def create_transport(spec: str = "pywhatkit", timing: Optional[AdaptiveTiming] = None) -> Transport:
+    """Build a transport from a spec such as 'pywhatkit', 'fake:latency=0.05,failure_rate=0.1'
+    or 'browser:driver=fake,sessions=4'.
+
+    timing holds the send-phase waits the transport uses and learns.
+    """
+    name, _, options = spec.partition(':')
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown transport '{name}' (choose from {', '.join(TRANSPORTS)})")
+
+    kwargs: Dict[str, object] = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        value = value.strip()
+        try:
+            kwargs[key.strip()] = int(value) if value.isdigit() else float(value)
+        except ValueError:
+            kwargs[key.strip()] = value
+
+    return TRANSPORTS[name](timing=timing, **kwargs)
@@ -1,64 +1,124 @@
+import bisect
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime, timedelta
-import sqlite3
-import threading
-import schedule
-import time
-import pywhatkit as pwk
-import pyautogui
+
+from change_feed import ChangeFeed
+from client import connect_to_daemon
+from main import RemoteScheduler, create_scheduler
+from recurrence import parse_rule
+from storage import Storage, from_epoch_ms
+from tracing import run_entry_point
+from workers import TaskRunner
+
+def format_message_row(msg_id, recipient, message, scheduled_time, status):
+    """Build the Treeview values and tags for one scheduled message"""
+    # Truncate long messages
+    display_message = message[:50] + "..." if len(message) > 50 else message
+    
+    formatted_time = from_epoch_ms(scheduled_time).strftime("%Y-%m-%d %H:%M")
+    
+    return (recipient.title(), display_message, formatted_time, status.title()), (str(msg_id),)
+
+
+MESSAGE_PAGE_SIZE = 200
+
+# How often (ms) the window checks the database for changes made elsewhere
+CHANGE_POLL_INTERVAL = 500
+
+# How often (ms) the Stats tab re-reads the metrics registry while shown
+STATS_REFRESH_INTERVAL = 2000
+
+# Schedule Type "Repeat": choice -> recurrence rule ({} is the value entered)
+REPEAT_KINDS = {
+    "Every N minutes": "every {} minutes",
+    "Every N hours": "every {} hours",
+    "Every N days": "every {} days",
+    "Daily at HH:MM": "daily at {}",
+    "Weekdays at HH:MM": "weekdays at {}",
+    "Cron expression": "cron {}",
+}
+
+
+def fetch_message_page(storage, after=None, status=None, recipient=None, page_size=MESSAGE_PAGE_SIZE):
+    """Fetch one page of the messages list, newest first, and build its Treeview rows.
+    
+    Returns ((scheduled_time, id), (values, tags)) per row and the cursor.
+    Keyset pagination: pass the returned cursor as after to get the next
+    page (the cursor is None once the list is exhausted).  Status and
+    recipient filters are applied in SQL.  No Tk needed.
+    """
+    conditions, params = [], []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if recipient:
+        conditions.append("recipient_name = ? COLLATE NOCASE")
+        params.append(recipient)
+    if after:
+        conditions.append("(scheduled_time, id) < (?, ?)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    messages = storage.query(f'''
+        SELECT id, recipient_name, message, scheduled_time, status 
+        FROM scheduled_messages 
+        {where}
+        ORDER BY scheduled_time DESC, id DESC
+        LIMIT ?
+    ''', (*params, page_size))
+    
+    rows = [((message[3], message[0]), format_message_row(*message)) for message in messages]
+    cursor = (messages[-1][3], messages[-1][0]) if len(messages) == page_size else None
+    return rows, cursor
+
 
 class WhatsAppSchedulerGUI:
-    def __init__(self, root):
+    def __init__(self, root, scheduler, workers=4):
+        """scheduler is a WhatsAppScheduler (see create_scheduler) or a RemoteScheduler"""
         self.root = root
+        self.scheduler = scheduler
+        # With a daemon running (see daemon.py) it does all writing and
+        # sending; this window then only reads the shared database
+        self.client = scheduler.client if isinstance(scheduler, RemoteScheduler) else None
         self.root.title("WhatsApp Scheduler - Professional")
         self.root.geometry("1000x700")
         self.root.configure(bg='#f0f0f0')
         
-        # Initialize database
-        self.db_path = "scheduler.db"
-        self.init_database()
+        # The lists are read straight from the database
+        self.storage = Storage(self.client.health()['database']) if self.client else scheduler.storage
         
         # Scheduler state
         self.scheduler_running = False
-        self.scheduler_thread = None
+        
+        # Database work and sending run here, never on the Tk thread
+        self.tasks = TaskRunner(self.post_to_ui, workers)
+        self.actions = {}
+        self.next_action_id = 0
+        
+        # Live updates: rows changed by this window, the dispatcher or other
+        # processes are patched into the lists.  The feed is polled from its
+        # own thread, so it sees commits from every other connection.
+        self.change_feed = ChangeFeed(self.storage, limit=MESSAGE_PAGE_SIZE)
+        self.feed_tasks = TaskRunner(self.post_to_ui, workers=1)
+        self.change_poll_running = False
+        self.stats_refresh_running = False
+        self.remote_rate_levels = None
         
         # Create GUI
         self.create_widgets()
         self.load_data()
+        self.root.after(CHANGE_POLL_INTERVAL, self.schedule_change_polls)
+        self.root.after(STATS_REFRESH_INTERVAL, self.schedule_stats_refreshes)
+        if self.client:
+            self.run_action("Connecting to the daemon...", self.client.health,
+                            on_done=lambda health: self.show_scheduler_state(health['dispatching']),
+                            error_message="Failed to reach the daemon")
         
         # Handle window closing
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
-    def init_database(self):
-        """Initialize SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS scheduled_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                recipient_name TEXT NOT NULL,
-                phone_number TEXT NOT NULL,
-                message TEXT NOT NULL,
-                scheduled_time DATETIME NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pending',
-                sent_at DATETIME NULL
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contacts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                phone_number TEXT NOT NULL
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
     def create_widgets(self):
         """Create the main GUI components"""
         # Main frame
@@ -79,12 +139,23 @@ class WhatsAppSchedulerGUI:
                                    padx=10, pady=5)
         self.status_label.pack(side=tk.LEFT)
         
+        # Progress of background actions
+        self.progress_bar = ttk.Progressbar(status_frame, mode='indeterminate', length=120)
+        self.progress_label = tk.Label(status_frame, text="Ready", font=('Arial', 10),
+                                       bg='#f0f0f0', fg='#7f8c8d', anchor='w')
+        self.progress_label.pack(side=tk.LEFT, padx=(20, 0), fill=tk.X, expand=True)
+        
         self.toggle_button = tk.Button(status_frame, text="Start Scheduler", 
                                      command=self.toggle_scheduler,
                                      bg='#27ae60', fg='white', font=('Arial', 10, 'bold'),
                                      padx=20, pady=5)
         self.toggle_button.pack(side=tk.RIGHT)
         
+        # Remaining global send budget (token bucket level)
+        self.rate_label = tk.Label(status_frame, text="", font=('Arial', 10),
+                                   bg='#f0f0f0', fg='#7f8c8d')
+        self.rate_label.pack(side=tk.RIGHT, padx=(0, 20))
+        
         # Notebook for tabs
         self.notebook = ttk.Notebook(main_frame)
         self.notebook.pack(fill=tk.BOTH, expand=True)
@@ -93,6 +164,7 @@ class WhatsAppSchedulerGUI:
         self.create_schedule_tab()
         self.create_contacts_tab()
         self.create_messages_tab()
+        self.create_stats_tab()
     
     def create_schedule_tab(self):
         """Create the schedule message tab"""
@@ -138,6 +210,8 @@ class WhatsAppSchedulerGUI:
                       value="days", bg='white', command=self.on_schedule_type_change).pack(side=tk.LEFT)
         tk.Radiobutton(schedule_frame_radio, text="Custom", variable=self.schedule_type_var,
                       value="custom", bg='white', command=self.on_schedule_type_change).pack(side=tk.LEFT)
+        tk.Radiobutton(schedule_frame_radio, text="Repeat", variable=self.schedule_type_var,
+                      value="repeat", bg='white', command=self.on_schedule_type_change).pack(side=tk.LEFT)
         
         # Delay input frame
         self.delay_frame = tk.Frame(left_frame, bg='white')
@@ -164,6 +238,19 @@ class WhatsAppSchedulerGUI:
         self.custom_time_var = tk.StringVar()
         tk.Entry(self.custom_frame, textvariable=self.custom_time_var, width=15).pack(anchor='w')
         
+        # Recurrence frame (initially hidden)
+        self.repeat_frame = tk.Frame(left_frame, bg='white')
+        
+        tk.Label(self.repeat_frame, text="Repeat:", font=('Arial', 10), bg='white').pack(anchor='w')
+        self.repeat_kind_var = tk.StringVar(value="Daily at HH:MM")
+        ttk.Combobox(self.repeat_frame, textvariable=self.repeat_kind_var, state='readonly', width=25,
+                     values=list(REPEAT_KINDS)).pack(anchor='w')
+        
+        tk.Label(self.repeat_frame, text="Value (N, HH:MM or cron fields):", 
+                font=('Arial', 10), bg='white').pack(anchor='w')
+        self.repeat_value_var = tk.StringVar(value="09:00")
+        tk.Entry(self.repeat_frame, textvariable=self.repeat_value_var, width=20).pack(anchor='w')
+        
         # Schedule button
         schedule_btn = tk.Button(left_frame, text="Schedule Message", 
                                command=self.schedule_message,
@@ -251,10 +338,36 @@ class WhatsAppSchedulerGUI:
         tk.Button(header_frame, text="Refresh", command=self.refresh_messages,
                  bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.RIGHT, padx=10)
         
-        # Messages treeview
-        self.messages_tree = ttk.Treeview(messages_frame, 
+        # Filters (applied in SQL)
+        self.recipient_filter_var = tk.StringVar()
+        recipient_entry = tk.Entry(header_frame, textvariable=self.recipient_filter_var, width=15)
+        recipient_entry.pack(side=tk.RIGHT, padx=(0, 10))
+        recipient_entry.bind('<Return>', lambda event: self.refresh_messages())
+        tk.Label(header_frame, text="Recipient:", bg='white').pack(side=tk.RIGHT)
+        
+        self.status_filter_var = tk.StringVar(value="All")
+        status_combo = ttk.Combobox(header_frame, textvariable=self.status_filter_var, state='readonly', width=10,
+                                    values=("All", "Pending", "Sending", "Sent"))
+        status_combo.pack(side=tk.RIGHT, padx=(0, 10))
+        status_combo.bind('<<ComboboxSelected>>', lambda event: self.refresh_messages())
+        tk.Label(header_frame, text="Status:", bg='white').pack(side=tk.RIGHT)
+        
+        # Messages treeview; pages are fetched as the list is scrolled
+        tree_frame = tk.Frame(messages_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        self.messages_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL)
+        self.messages_tree = ttk.Treeview(tree_frame, 
                                         columns=('Recipient', 'Message', 'Scheduled Time', 'Status'), 
-                                        show='headings')
+                                        show='headings', yscrollcommand=self.on_messages_scroll)
+        self.messages_scrollbar.config(command=self.messages_tree.yview)
+        self.messages_cursor = None
+        self.messages_page_queued = False
+        self.messages_generation = 0
+        self.messages_reloading = False
+        self.messages_deferred_changes = []
+        self.message_keys = {}
+        self.contact_names = {}
         self.messages_tree.heading('Recipient', text='Recipient')
         self.messages_tree.heading('Message', text='Message')
         self.messages_tree.heading('Scheduled Time', text='Scheduled Time')
@@ -266,7 +379,8 @@ class WhatsAppSchedulerGUI:
         self.messages_tree.column('Scheduled Time', width=150)
         self.messages_tree.column('Status', width=100)
         
-        self.messages_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.messages_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.messages_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
         # Buttons frame
         buttons_frame = tk.Frame(messages_frame, bg='white')
@@ -277,14 +391,40 @@ class WhatsAppSchedulerGUI:
         
         tk.Button(buttons_frame, text="Send Now", command=self.send_now,
                  bg='#f39c12', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=10)
+        
+        tk.Button(buttons_frame, text="Dead Letters", command=self.show_dead_letters,
+                 bg='#7f8c8d', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.RIGHT, padx=10)
+    
+    def create_stats_tab(self):
+        """Create the stats tab (the metrics registry as text)"""
+        self.stats_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.stats_frame, text="Stats")
+        
+        header_frame = tk.Frame(self.stats_frame, bg='white')
+        header_frame.pack(fill=tk.X, pady=10)
+        
+        tk.Label(header_frame, text="Queue, Latency and Failures", font=('Arial', 16, 'bold'),
+                bg='white').pack(side=tk.LEFT, padx=10)
+        
+        tk.Button(header_frame, text="Refresh", command=self.refresh_stats,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.RIGHT, padx=10)
+        
+        self.stats_text = tk.Text(self.stats_frame, font=('Courier', 10), state=tk.DISABLED, wrap=tk.NONE)
+        self.stats_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
     
     def on_schedule_type_change(self):
         """Handle schedule type change"""
         if self.schedule_type_var.get() == "custom":
             self.delay_frame.pack_forget()
+            self.repeat_frame.pack_forget()
             self.custom_frame.pack(pady=(0, 10), padx=20, fill='x')
+        elif self.schedule_type_var.get() == "repeat":
+            self.delay_frame.pack_forget()
+            self.custom_frame.pack_forget()
+            self.repeat_frame.pack(pady=(0, 10), padx=20, fill='x')
         else:
             self.custom_frame.pack_forget()
+            self.repeat_frame.pack_forget()
             self.delay_frame.pack(pady=(0, 10), padx=20, fill='x')
             
             # Update delay label
@@ -311,13 +451,7 @@ class WhatsAppSchedulerGUI:
             messagebox.showwarning("Missing Information", "Please enter both name and phone number")
             return
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("INSERT OR REPLACE INTO contacts (name, phone_number) VALUES (?, ?)",
-                         (name.lower(), phone))
-            conn.commit()
+        def added(_):
             messagebox.showinfo("Success", f"Contact {name} added successfully!")
             
             # Clear fields
@@ -325,12 +459,10 @@ class WhatsAppSchedulerGUI:
             self.contact_phone_var.set("")
             
             # Refresh displays
-            self.load_contacts()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to add contact: {e}")
-        finally:
-            conn.close()
+            self.poll_changes()
+        
+        self.run_action(f"Adding contact {name}...", self.scheduler.save_contact, name, phone,
+                        on_done=added, error_message="Failed to add contact")
     
     def delete_contact(self):
         """Delete selected contact"""
@@ -343,18 +475,12 @@ class WhatsAppSchedulerGUI:
         name = item['values'][0]
         
         if messagebox.askyesno("Confirm Delete", f"Delete contact {name}?"):
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            try:
-                cursor.execute("DELETE FROM contacts WHERE name = ?", (name.lower(),))
-                conn.commit()
+            def deleted(_):
                 messagebox.showinfo("Success", f"Contact {name} deleted successfully!")
-                self.load_contacts()
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to delete contact: {e}")
-            finally:
-                conn.close()
+                self.poll_changes()
+            
+            self.run_action(f"Deleting contact {name}...", self.scheduler.remove_contact, name,
+                            on_done=deleted, error_message="Failed to delete contact")
     
     def schedule_message(self):
         """Schedule a new message"""
@@ -365,19 +491,10 @@ class WhatsAppSchedulerGUI:
             messagebox.showwarning("Missing Information", "Please select a contact and enter a message")
             return
         
-        # Get contact phone number
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT phone_number FROM contacts WHERE name = ?", (contact_name.lower(),))
-        result = cursor.fetchone()
-        
-        if not result:
-            messagebox.showerror("Error", f"Contact {contact_name} not found")
-            conn.close()
+        if self.schedule_type_var.get() == "repeat":
+            self.schedule_recurring_message(contact_name, message)
             return
         
-        phone_number = result[0]
-        
         # Calculate scheduled time
         try:
             if self.schedule_type_var.get() == "custom":
@@ -393,18 +510,13 @@ class WhatsAppSchedulerGUI:
         
         except ValueError as e:
             messagebox.showerror("Invalid Input", f"Please check your date/time format: {e}")
-            conn.close()
             return
         
-        # Save to database
-        try:
-            cursor.execute('''
-                INSERT INTO scheduled_messages 
-                (recipient_name, phone_number, message, scheduled_time)
-                VALUES (?, ?, ?, ?)
-            ''', (contact_name, phone_number, message, scheduled_time))
+        def scheduled(found):
+            if not found:
+                messagebox.showerror("Error", f"Contact {contact_name} not found")
+                return
             
-            conn.commit()
             messagebox.showinfo("Success", 
                               f"Message scheduled for {contact_name} at {scheduled_time.strftime('%Y-%m-%d %H:%M:%S')}")
             
@@ -413,162 +525,450 @@ class WhatsAppSchedulerGUI:
             self.contact_var.set("")
             
             # Refresh messages list
-            self.refresh_messages()
+            self.poll_changes()
+        
+        self.run_action(f"Scheduling message for {contact_name}...", self.schedule_for_contact,
+                        contact_name, message, scheduled_time,
+                        on_done=scheduled, error_message="Failed to schedule message")
+    
+    def schedule_recurring_message(self, contact_name, message):
+        """Create a recurring schedule from the Repeat fields"""
+        rule = REPEAT_KINDS[self.repeat_kind_var.get()].format(self.repeat_value_var.get().strip())
+        try:
+            parse_rule(rule)
+        except ValueError as e:
+            messagebox.showerror("Invalid Input", f"Please check the repeat settings: {e}")
+            return
+        
+        def scheduled(found):
+            if not found:
+                messagebox.showerror("Error", f"Contact {contact_name} not found")
+                return
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to schedule message: {e}")
-        finally:
-            conn.close()
+            first_time = found.scheduled_time
+            messagebox.showinfo("Success", f"Recurring message for {contact_name} ({rule}), "
+                                f"first sent at {first_time.strftime('%Y-%m-%d %H:%M')}")
+            
+            # Clear form
+            self.message_text.delete(1.0, tk.END)
+            self.contact_var.set("")
+            self.poll_changes()
+        
+        self.run_action(f"Scheduling recurring message for {contact_name}...", self.schedule_for_contact,
+                        contact_name, message, None, rule,
+                        on_done=scheduled, error_message="Failed to schedule message")
+    
+    def schedule_for_contact(self, contact_name, message, scheduled_time, rule=None):
+        """Schedule a message (worker thread); returns the ScheduledMessage, or None if the contact is unknown"""
+        try:
+            return self.scheduler.schedule(contact_name, message, scheduled_time, recurrence=rule)
+        except LookupError:
+            return None
     
     def delete_message(self):
-        """Delete selected scheduled message"""
-        selection = self.messages_tree.selection()
-        if not selection:
+        """Delete the selected scheduled messages"""
+        message_ids = self.selected_message_ids()
+        if not message_ids:
             messagebox.showwarning("No Selection", "Please select a message to delete")
             return
         
-        if messagebox.askyesno("Confirm Delete", "Delete selected message?"):
-            item = self.messages_tree.item(selection[0])
-            # We need to get the message ID somehow - let's store it in tags
-            message_id = self.messages_tree.item(selection[0])['tags'][0] if self.messages_tree.item(selection[0])['tags'] else None
+        if messagebox.askyesno("Confirm Delete", f"Delete {len(message_ids)} selected message(s)? "
+                               "Deleting the next occurrence of a recurring message stops it repeating."):
+            def deleted(_):
+                messagebox.showinfo("Success", "Message deleted successfully!")
+                self.poll_changes()
             
-            if message_id:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                try:
-                    cursor.execute("DELETE FROM scheduled_messages WHERE id = ?", (message_id,))
-                    conn.commit()
-                    messagebox.showinfo("Success", "Message deleted successfully!")
-                    self.refresh_messages()
-                except Exception as e:
-                    messagebox.showerror("Error", f"Failed to delete message: {e}")
-                finally:
-                    conn.close()
+            self.run_action("Deleting messages...", self.scheduler.delete_messages, message_ids,
+                            on_done=deleted, error_message="Failed to delete message")
+    
+    def selected_message_ids(self):
+        """Message ids of the selected rows (stored in their tags)"""
+        return [int(self.messages_tree.item(item)['tags'][0])
+                for item in self.messages_tree.selection() if self.messages_tree.item(item)['tags']]
     
     def send_now(self):
-        """Send selected message immediately"""
-        selection = self.messages_tree.selection()
-        if not selection:
+        """Send the selected messages immediately, in the background"""
+        message_ids = self.selected_message_ids()
+        if not message_ids:
             messagebox.showwarning("No Selection", "Please select a message to send")
             return
         
-        message_id = self.messages_tree.item(selection[0])['tags'][0] if self.messages_tree.item(selection[0])['tags'] else None
+        action = self.start_action(f"Sending {len(message_ids)} message(s)...")
         
-        if message_id:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            try:
-                cursor.execute("SELECT phone_number, message FROM scheduled_messages WHERE id = ?", (message_id,))
-                result = cursor.fetchone()
-                
-                if result:
-                    phone_number, message = result
-                    
-                    # Send message
-                    if self.send_whatsapp_message(phone_number, message):
-                        cursor.execute("UPDATE scheduled_messages SET status = 'sent', sent_at = ? WHERE id = ?",
-                                     (datetime.now(), message_id))
-                        conn.commit()
-                        messagebox.showinfo("Success", "Message sent successfully!")
-                        self.refresh_messages()
-                    else:
-                        messagebox.showerror("Error", "Failed to send message")
-                        
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to send message: {e}")
-            finally:
-                conn.close()
-    
-    def send_whatsapp_message(self, phone_number, message):
-        """Send WhatsApp message"""
-        try:
-            import pyautogui
-            import time as time_module
-            
-            phone_number = phone_number.replace('+', '').replace('-', '').replace(' ', '')
-            
-            if not phone_number.startswith('91') and len(phone_number) == 10:
-                phone_number = '91' + phone_number
-            
-            now = datetime.now()
-            send_hour = now.hour
-            send_minute = now.minute + 2
-            
-            if send_minute >= 60:
-                send_minute -= 60
-                send_hour += 1
-                if send_hour >= 24:
-                    send_hour = 0
-            
-            pwk.sendwhatmsg(f"+{phone_number}", message, send_hour, send_minute, 
-                          wait_time=15, tab_close=False, close_time=2)
-            
-            time_module.sleep(3)
-            pyautogui.press('enter')
-            time_module.sleep(2)
-            pyautogui.hotkey('ctrl', 'w')
+        def finished(outcome):
+            self.finish_action(action)
+            skipped, sent, failed = outcome
             
-            return True
+            if not sent and not failed:
+                messagebox.showwarning("Not Sent", "Message is already being sent or was sent")
+            elif failed or skipped:
+                messagebox.showwarning("Send Now", f"Sent {sent}, failed {failed} (they will be retried), "
+                                       f"skipped {skipped} already being sent or sent")
+            else:
+                messagebox.showinfo("Success", f"{sent} message(s) sent successfully!")
+            self.poll_changes()
+        
+        def failed(error):
+            self.finish_action(action)
+            messagebox.showerror("Error", f"Failed to send message: {error}")
+            self.poll_changes()
+        
+        self.tasks.submit(self.send_messages_now, action, message_ids, on_done=finished, on_error=failed)
+    
+    def send_messages_now(self, action, message_ids):
+        """Send messages now through the scheduler (worker thread); returns (skipped, sent, failed)"""
+        if self.client:
+            outcome = self.client.send_messages_now(message_ids)
+            return outcome['skipped'], outcome['sent'], outcome['failed']
+        
+        done = 0
+        done_lock = threading.Lock()
+        
+        def progress(batch_results):
+            nonlocal done
+            with done_lock:
+                done += len(batch_results)
+                text = f"Sending messages: {done} sent or failed"
+            self.tasks.post(lambda: self.update_action(action, text))
+        
+        skipped, results = self.scheduler.send_messages_now(message_ids, on_results=progress)
+        sent = sum(result.success for result in results)
+        return skipped, sent, len(results) - sent
+    
+    def show_dead_letters(self):
+        """Open a window listing messages that failed every retry, with replay buttons"""
+        window = tk.Toplevel(self.root)
+        window.title("Dead Letters")
+        window.geometry("800x400")
+        
+        columns = ('Recipient', 'Message', 'Attempts', 'Last Error')
+        tree = ttk.Treeview(window, columns=columns, show='headings', height=12)
+        for column, width in zip(columns, (120, 250, 70, 330)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        def load():
+            self.run_action("Loading dead letters...", self.scheduler.dead_letters, 1000,
+                            on_done=show, error_message="Failed to load dead letters")
+        
+        def show(dead_letters):
+            if not tree.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            for dead_id, recipient, message, _, attempts, last_error, _ in dead_letters:
+                display_message = message[:50] + "..." if len(message) > 50 else message
+                tree.insert('', tk.END, iid=str(dead_id),
+                            values=(recipient.title(), display_message, attempts, last_error or ""))
+        
+        def replay(ids):
+            def replayed(count):
+                messagebox.showinfo("Replayed", f"{count} message(s) rescheduled to send now", parent=window)
+                load()
+                self.poll_changes()
             
-        except Exception as e:
-            print(f"Failed to send message: {e}")
-            return False
+            self.run_action("Replaying dead letters...", self.scheduler.replay_dead_letters, ids,
+                            on_done=replayed, error_message="Failed to replay dead letters")
+        
+        def replay_selected():
+            ids = [int(item) for item in tree.selection()]
+            if not ids:
+                messagebox.showwarning("No Selection", "Please select messages to replay", parent=window)
+                return
+            replay(ids)
+        
+        buttons_frame = tk.Frame(window)
+        buttons_frame.pack(fill=tk.X, pady=(0, 10))
+        tk.Button(buttons_frame, text="Replay Selected", command=replay_selected,
+                  bg='#27ae60', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=10)
+        tk.Button(buttons_frame, text="Replay All", command=lambda: replay(None),
+                  bg='#f39c12', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=10)
+        tk.Button(buttons_frame, text="Refresh", command=load,
+                  bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.RIGHT, padx=10)
+        load()
     
     def load_contacts(self):
         """Load contacts into combo box and tree view"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.run_action("Loading contacts...", self.storage.query,
+                        "SELECT id, name, phone_number FROM contacts ORDER BY name",
+                        on_done=self.show_contacts, error_message="Failed to load contacts")
+    
+    def show_contacts(self, contacts):
+        """Fill combo box and tree view with loaded contacts"""
+        # Update tree view; items are keyed by the (unique) contact name
+        self.contacts_tree.delete(*self.contacts_tree.get_children())
+        self.contact_names = {}
         
-        cursor.execute("SELECT name, phone_number FROM contacts ORDER BY name")
-        contacts = cursor.fetchall()
-        conn.close()
+        for contact_id, name, phone in contacts:
+            self.contact_names[contact_id] = name
+            self.contacts_tree.insert('', 'end', iid=name, values=(name.title(), phone))
         
         # Update combo box
-        contact_names = [contact[0].title() for contact in contacts]
-        self.contact_combo['values'] = contact_names
+        self.update_contact_choices()
+    
+    def update_contact_choices(self):
+        """Offer the listed contacts in the schedule tab"""
+        self.contact_combo['values'] = [name.title() for name in self.contacts_tree.get_children()]
+    
+    def refresh_messages(self):
+        """Reload the messages list from its first page"""
+        self.messages_generation += 1
+        self.messages_cursor = None
+        self.messages_page_queued = True
+        self.messages_reloading = True
+        self.load_more_messages(first_page=True)
+    
+    def load_more_messages(self, first_page=False):
+        """Fetch the next page of messages in the background and append it to the list"""
+        if not first_page and self.messages_cursor is None:
+            self.messages_page_queued = False
+            return  # everything is loaded
+        
+        status, recipient = self.message_filters()
+        generation = self.messages_generation
+        
+        def loaded(page):
+            if generation != self.messages_generation:
+                return  # a newer refresh replaced this list
+            rows, self.messages_cursor = page
+            self.messages_page_queued = False
+            
+            if first_page:
+                self.messages_tree.delete(*self.messages_tree.get_children())
+                self.message_keys = {}
+            for key, (values, tags) in rows:
+                iid = str(key[1])
+                if not self.messages_tree.exists(iid):  # already added by a change
+                    self.messages_tree.insert('', 'end', iid=iid, values=values, tags=tags)
+                    self.message_keys[iid] = key
+            
+            if first_page:
+                # Changes that arrived while the list was being replaced
+                self.messages_reloading = False
+                changes, self.messages_deferred_changes = self.messages_deferred_changes, []
+                for rows, deleted in changes:
+                    self.apply_message_changes(rows, deleted)
+        
+        def failed(error):
+            self.messages_page_queued = False
+            self.messages_reloading = False
+            messagebox.showerror("Error", f"Failed to load messages: {error}")
+        
+        self.run_action("Loading messages...", fetch_message_page, self.storage, self.messages_cursor,
+                        status, recipient, on_done=loaded, on_error=failed)
+    
+    def on_messages_scroll(self, first, last):
+        """Update the scrollbar and fetch the next page near the bottom"""
+        self.messages_scrollbar.set(first, last)
+        if float(last) >= 0.9 and self.messages_cursor is not None and not self.messages_page_queued:
+            self.messages_page_queued = True
+            self.root.after_idle(self.load_more_messages)
+    
+    def post_to_ui(self, callback):
+        """Run callback on the Tk thread (safe to call from any thread)"""
+        try:
+            self.root.after(0, callback)
+        except (RuntimeError, tk.TclError):
+            pass  # the window has been closed
+    
+    def run_action(self, text, func, *args, on_done=None, on_error=None, error_message="Action failed"):
+        """Run func(*args) in the background while text is shown as progress.
+        
+        on_done(result) or on_error(exception) is then called on the Tk
+        thread; without on_error, failures are shown as error_message.
+        """
+        action = self.start_action(text)
+        
+        def done(result):
+            self.finish_action(action)
+            if on_done:
+                on_done(result)
+        
+        def failed(error):
+            self.finish_action(action)
+            if on_error:
+                on_error(error)
+            else:
+                messagebox.showerror("Error", f"{error_message}: {error}")
         
-        # Update tree view
-        for item in self.contacts_tree.get_children():
-            self.contacts_tree.delete(item)
+        return self.tasks.submit(func, *args, on_done=done, on_error=failed)
+    
+    def start_action(self, text):
+        """Show a background action in the progress area and return its id"""
+        self.next_action_id += 1
+        self.actions[self.next_action_id] = text
+        self.update_progress()
+        return self.next_action_id
+    
+    def update_action(self, action, text):
+        """Change the progress text of a running action"""
+        if action in self.actions:
+            self.actions[action] = text
+            self.update_progress()
+    
+    def finish_action(self, action):
+        """Remove a finished action from the progress area"""
+        self.actions.pop(action, None)
+        self.update_progress()
+    
+    def update_progress(self):
+        """Show running actions next to the scheduler status"""
+        if self.actions:
+            self.progress_label.config(text="  |  ".join(self.actions.values()))
+            if not self.progress_bar.winfo_manager():
+                self.progress_bar.pack(side=tk.LEFT, padx=(20, 0), before=self.progress_label)
+                self.progress_bar.start(10)
+        else:
+            self.progress_label.config(text="Ready")
+            self.progress_bar.stop()
+            self.progress_bar.pack_forget()
+    
+    def message_filters(self):
+        """Status and recipient filters of the messages list, as used in SQL"""
+        status = self.status_filter_var.get()
+        return (None if status == "All" else status.lower(),
+                self.recipient_filter_var.get().strip() or None)
+    
+    def schedule_change_polls(self):
+        """Poll the change feed every CHANGE_POLL_INTERVAL ms"""
+        self.poll_changes()
+        self.update_rate_label()
+        self.root.after(CHANGE_POLL_INTERVAL, self.schedule_change_polls)
+    
+    def schedule_stats_refreshes(self):
+        """Refresh the Stats tab every STATS_REFRESH_INTERVAL ms while it is shown"""
+        # The daemon's stats also carry the rate limit levels, so keep those current
+        if self.client or self.notebook.select() == str(self.stats_frame):
+            self.refresh_stats()
+        self.root.after(STATS_REFRESH_INTERVAL, self.schedule_stats_refreshes)
+    
+    def refresh_stats(self):
+        """Render the metrics registry in the background and show it"""
+        if self.stats_refresh_running:
+            return
+        self.stats_refresh_running = True
+        
+        def show(stats):
+            self.stats_refresh_running = False
+            lines, self.remote_rate_levels = stats
+            self.stats_text.config(state=tk.NORMAL)
+            self.stats_text.delete('1.0', tk.END)
+            self.stats_text.insert(tk.END, "\n".join(lines) or "No metrics recorded yet")
+            self.stats_text.config(state=tk.DISABLED)
         
-        for name, phone in contacts:
-            self.contacts_tree.insert('', 'end', values=(name.title(), phone))
+        def failed(error):
+            self.stats_refresh_running = False
+            print(f"Stats refresh failed: {error}")
+        
+        self.tasks.submit(self.load_stats, on_done=show, on_error=failed)
     
-    def refresh_messages(self):
-        """Refresh the messages list"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, recipient_name, message, scheduled_time, status 
-            FROM scheduled_messages 
-            ORDER BY scheduled_time DESC
-        ''')
-        messages = cursor.fetchall()
-        conn.close()
-        
-        # Clear existing items
-        for item in self.messages_tree.get_children():
-            self.messages_tree.delete(item)
-        
-        # Add messages
-        for msg_id, recipient, message, scheduled_time, status in messages:
-            # Truncate long messages
-            display_message = message[:50] + "..." if len(message) > 50 else message
+    def load_stats(self):
+        """Metrics summary lines and, from a daemon, its rate limit levels (worker thread)"""
+        return self.scheduler.stats_summary(), self.scheduler.rate_limit_levels() if self.client else None
+    
+    def update_rate_label(self):
+        """Show the global bucket level and how many recipients are throttled"""
+        levels = self.remote_rate_levels if self.client else self.scheduler.rate_limit_levels()
+        if not levels:
+            self.rate_label.config(text="Rate limit: off")
+            return
+        
+        throttled = sum(1 for tokens in levels['recipients'].values() if tokens < 1)
+        text = f"Send budget: {levels['global']:.1f}/{levels['global_capacity']:g}"
+        if throttled:
+            text += f"  ({throttled} recipient(s) throttled)"
+        self.rate_label.config(text=text)
+    
+    def poll_changes(self):
+        """Fetch rows changed since the last poll and patch them into the lists"""
+        if self.change_poll_running:
+            return
+        self.change_poll_running = True
+        
+        def polled(changes):
+            self.change_poll_running = False
+            if changes:
+                self.apply_changes(changes)
+        
+        def failed(error):
+            self.change_poll_running = False
+            print(f"Error polling for changes: {error}")
+        
+        self.feed_tasks.submit(self.change_feed.poll, on_done=polled, on_error=failed)
+    
+    def apply_changes(self, changes):
+        """Patch a ChangeSet into the contacts and messages lists"""
+        if changes.truncated:
+            # Too much changed (e.g. a bulk import): reload instead
+            self.load_contacts()
+            self.refresh_messages()
+            return
+        
+        if changes.contacts or changes.deleted_contacts:
+            self.apply_contact_changes(changes.contacts, changes.deleted_contacts)
+        if changes.messages or changes.deleted_messages:
+            if self.messages_reloading:
+                self.messages_deferred_changes.append((changes.messages, changes.deleted_messages))
+            else:
+                self.apply_message_changes(changes.messages, changes.deleted_messages)
+    
+    def apply_contact_changes(self, contacts, deleted):
+        """Update, insert (in name order) or remove contacts by name"""
+        # Deletions first: ids are never reused, so a deleted id cannot
+        # belong to a row changed later in the same set.
+        for contact_id in deleted:
+            name = self.contact_names.pop(contact_id, None)
+            if name is not None and self.contacts_tree.exists(name):
+                self.contacts_tree.delete(name)
+        
+        for contact_id, name, phone in contacts:
+            self.contact_names[contact_id] = name
+            if self.contacts_tree.exists(name):
+                self.contacts_tree.item(name, values=(name.title(), phone))
+            else:
+                index = bisect.bisect(self.contacts_tree.get_children(), name)
+                self.contacts_tree.insert('', index, iid=name, values=(name.title(), phone))
+        
+        self.update_contact_choices()
+    
+    def apply_message_changes(self, rows, deleted):
+        """Update, insert or remove message rows in place by message id"""
+        status_filter, recipient_filter = self.message_filters()
+        
+        for msg_id in deleted:
+            self.remove_message_item(str(msg_id))
+        
+        for row in rows:
+            msg_id, recipient, _, scheduled_time, status = row
+            iid = str(msg_id)
+            key = (scheduled_time, msg_id)
+            
+            if ((status_filter and status != status_filter)
+                    or (recipient_filter and recipient.lower() != recipient_filter.lower())):
+                self.remove_message_item(iid)
+                continue
             
-            # Format datetime
-            try:
-                dt = datetime.strptime(scheduled_time, "%Y-%m-%d %H:%M:%S.%f")
-            except ValueError:
-                dt = datetime.strptime(scheduled_time, "%Y-%m-%d %H:%M:%S")
+            values, tags = format_message_row(*row)
+            if self.message_keys.get(iid) == key:
+                self.messages_tree.item(iid, values=values, tags=tags)
+                continue
             
-            formatted_time = dt.strftime("%Y-%m-%d %H:%M")
+            # New, or its scheduled time moved: (re)insert in list order,
+            # unless it sorts below the pages loaded so far
+            self.remove_message_item(iid)
+            if self.messages_cursor is not None and key < tuple(self.messages_cursor):
+                continue
             
-            self.messages_tree.insert('', 'end', 
-                                    values=(recipient.title(), display_message, formatted_time, status.title()),
-                                    tags=(str(msg_id),))
+            loaded = [(-t, -i) for t, i in (self.message_keys[c] for c in self.messages_tree.get_children())]
+            index = bisect.bisect(loaded, (-scheduled_time, -msg_id))
+            self.messages_tree.insert('', index, iid=iid, values=values, tags=tags)
+            self.message_keys[iid] = key
+    
+    def remove_message_item(self, iid):
+        """Remove a message row from the list if it is shown"""
+        if self.messages_tree.exists(iid):
+            self.messages_tree.delete(iid)
+        self.message_keys.pop(iid, None)
     
     def load_data(self):
         """Load initial data"""
@@ -583,90 +983,53 @@ class WhatsAppSchedulerGUI:
             self.start_scheduler()
     
     def start_scheduler(self):
-        """Start the background scheduler"""
-        if not self.scheduler_running:
-            self.scheduler_running = True
-            self.scheduler_thread = threading.Thread(target=self.run_scheduler, daemon=True)
-            self.scheduler_thread.start()
-            
-            self.status_label.config(text="Scheduler: RUNNING", bg='#27ae60')
-            self.toggle_button.config(text="Stop Scheduler", bg='#e74c3c')
-            
+        """Start the background scheduler (the daemon's, when connected)"""
+        def started(_):
+            self.show_scheduler_state(True)
             messagebox.showinfo("Scheduler Started", "Message scheduler is now running in the background!")
-    
-    def stop_scheduler(self):
-        """Stop the scheduler"""
-        self.scheduler_running = False
-        schedule.clear()
         
-        self.status_label.config(text="Scheduler: STOPPED", bg='#e74c3c')
-        self.toggle_button.config(text="Start Scheduler", bg='#27ae60')
-        
-        messagebox.showinfo("Scheduler Stopped", "Message scheduler has been stopped.")
+        self.run_action("Starting the scheduler...", self.scheduler.start_scheduler,
+                        on_done=started, error_message="Failed to start the scheduler")
     
-    def run_scheduler(self):
-        """Run the scheduler in background"""
-        schedule.every(1).minutes.do(self.check_and_send_messages)
+    def stop_scheduler(self):
+        """Stop the scheduler (the daemon keeps running)"""
+        def stopped(_):
+            self.show_scheduler_state(False)
+            messagebox.showinfo("Scheduler Stopped", "Message scheduler has been stopped.")
         
-        while self.scheduler_running:
-            schedule.run_pending()
-            time.sleep(1)
+        self.run_action("Stopping the scheduler...", self.scheduler.stop_scheduler,
+                        on_done=stopped, error_message="Failed to stop the scheduler")
     
-    def check_and_send_messages(self):
-        """Check for pending messages and send them"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        current_time = datetime.now()
-        
-        cursor.execute('''
-            SELECT id, recipient_name, phone_number, message 
-            FROM scheduled_messages 
-            WHERE status = 'pending' AND scheduled_time <= ?
-        ''', (current_time,))
-        
-        pending_messages = cursor.fetchall()
-        
-        for msg_id, recipient, phone_number, message in pending_messages:
-            print(f"Sending message to {recipient}: {message}")
-            
-            success = self.send_whatsapp_message(phone_number, message)
-            
-            if success:
-                cursor.execute('''
-                    UPDATE scheduled_messages 
-                    SET status = 'sent', sent_at = ? 
-                    WHERE id = ?
-                ''', (current_time, msg_id))
-                print(f"Message sent successfully to {recipient}")
-            else:
-                cursor.execute('''
-                    UPDATE scheduled_messages 
-                    SET status = 'failed' 
-                    WHERE id = ?
-                ''', (msg_id,))
-                print(f"Failed to send message to {recipient}")
-        
-        conn.commit()
-        conn.close()
-        
-        # Refresh the GUI if messages were processed
-        if pending_messages:
-            self.root.after(0, self.refresh_messages)
+    def show_scheduler_state(self, running):
+        """Show whether the scheduler (or the daemon's dispatcher) is running"""
+        self.scheduler_running = running
+        owner = "Daemon" if self.client else "Scheduler"
+        if running:
+            self.status_label.config(text=f"{owner}: RUNNING", bg='#27ae60')
+            self.toggle_button.config(text="Stop Scheduler", bg='#e74c3c')
+        else:
+            self.status_label.config(text=f"{owner}: STOPPED", bg='#e74c3c')
+            self.toggle_button.config(text="Start Scheduler", bg='#27ae60')
     
     def on_closing(self):
         """Handle window closing"""
-        if self.scheduler_running:
-            if messagebox.askokcancel("Quit", "Scheduler is running. Do you want to quit?"):
-                self.stop_scheduler()
-                self.root.destroy()
-        else:
-            self.root.destroy()
+        if self.scheduler_running and not self.client:
+            if not messagebox.askokcancel("Quit", "Scheduler is running. Do you want to quit?"):
+                return
+        self.tasks.close()
+        self.feed_tasks.close()
+        # Stops the dispatcher and releases the transport; nothing to do for a daemon
+        self.scheduler.close()
+        self.root.destroy()
 
 def main():
     root = tk.Tk()
-    app = WhatsAppSchedulerGUI(root)
+    client = connect_to_daemon()
+    # With a daemon the window is its client and the daemon sends; otherwise
+    # it runs its own scheduler, configured like main.py's
+    scheduler = RemoteScheduler(client) if client else create_scheduler()
+    app = WhatsAppSchedulerGUI(root, scheduler)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_entry_point(main, "WhatsApp Message Scheduler (GUI)", "gui.prof")
\ No newline at end of file
@@ -0,0 +1,149 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from transport import OutgoingMessage, SendResult, Transport, deliver_batch
+
+
+class SendPool:
+    """Bounded pool of sender threads in front of a transport.
+
+    Every recipient key is pinned to one worker lane, so batches for the
+    same recipient are delivered in submission order while different
+    recipients go out in parallel.  Each lane holds at most
+    max_queued_per_worker batches; submit() blocks when a lane is full.
+    """
+
+    def __init__(self, transport: Transport, workers: int = 4, max_queued_per_worker: int = 16):
+        self.transport = transport
+        self.workers = max(1, min(workers, transport.max_concurrency))
+        self._lanes: List[queue.Queue] = [queue.Queue(maxsize=max_queued_per_worker)
+                                          for _ in range(self.workers)]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for lane in self._lanes:
+                thread = threading.Thread(target=self._work, args=(lane,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, key: str, batch: List[OutgoingMessage],
+               on_results: Optional[Callable[[List[SendResult]], None]] = None):
+        """Queue a batch for the lane owning key, blocking while that lane is full"""
+        self._ensure_started()
+        self._lanes[hash(key) % self.workers].put((batch, on_results))
+
+    async def deliver(self, key: str, batch: List[OutgoingMessage]) -> List[SendResult]:
+        """submit() for an event loop: await the batch's results.
+
+        The batch goes through the same lanes as every other submit(), so a
+        single-desktop transport still never sends two batches at once.
+        """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def finished(results: List[SendResult]):
+            loop.call_soon_threadsafe(done.set_result, results)
+
+        # submit() blocks while the lane is full, so keep it off the loop.
+        await loop.run_in_executor(None, self.submit, key, batch, finished)
+        return await done
+
+    def send(self, key: str, batch: List[OutgoingMessage]) -> List[SendResult]:
+        """submit() and wait for the batch's results (not from a worker thread)"""
+        done: Future = Future()
+        self.submit(key, batch, done.set_result)
+        return done.result()
+
+    def join(self):
+        """Wait until every submitted batch has been delivered"""
+        for lane in self._lanes:
+            lane.join()
+
+    def queued(self) -> int:
+        """Number of batches waiting for a worker"""
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def close(self):
+        """Stop the workers once their queued batches are delivered"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for lane in self._lanes[:len(threads)]:
+            lane.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _work(self, lane: queue.Queue):
+        while True:
+            item = lane.get()
+            try:
+                if item is None:
+                    return
+                batch, on_results = item
+                results = deliver_batch(self.transport, batch)
+                if on_results:
+                    try:
+                        on_results(results)
+                    except Exception as e:
+                        print(f"Error recording send results: {e}")
+            finally:
+                lane.task_done()
+
+
+class TaskRunner:
+    """Runs blocking actions (database work, sending) off a UI thread.
+
+    post must schedule a callable on the UI thread, e.g. for Tk
+    lambda callback: root.after(0, callback).  The on_done and on_error
+    callbacks of submit() always run through it, so they may touch widgets.
+    """
+
+    def __init__(self, post: Callable[[Callable[[], None]], None], workers: int = 4):
+        self._post = post
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="task")
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func: Callable, *args,
+               on_done: Optional[Callable] = None,
+               on_error: Optional[Callable[[Exception], None]] = None) -> Future:
+        """Run func(*args) on a worker thread, then on_done(result) or on_error(exception) on the UI thread"""
+        with self._lock:
+            self._active += 1
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._finished(f, on_done, on_error))
+        return future
+
+    def post(self, callback: Callable[[], None]):
+        """Run callback on the UI thread"""
+        self._post(callback)
+
+    def active(self) -> int:
+        """Number of submitted actions that have not finished yet"""
+        with self._lock:
+            return self._active
+
+    def close(self, wait: bool = False):
+        """Stop accepting actions and drop those that have not started yet"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _finished(self, future: Future, on_done, on_error):
+        with self._lock:
+            self._active -= 1
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                self.post(lambda: on_error(error))
+            else:
+                print(f"Background action failed: {error}")
+        elif on_done:
+            result = future.result()
+            self.post(lambda: on_done(result))